@@ -1,3 +1,6 @@
+import fnmatch
+import hashlib
+import os
 from typing import NoReturn
 
 import click
@@ -55,3 +58,32 @@ def info(message):
 
 def warn(message):
     click.echo(click.style(f"{_now()} W {message}", fg='yellow'))
+
+
+def sha256_file(path):
+    """Return the sha256 of the content of the file path as a hex string."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def walk_files(root, exclude):
+    """Yield the paths of the regular files under root, relative to it, in sorted order.
+
+    exclude holds glob patterns matched against those relative paths; a matching directory
+    is skipped entirely.
+    """
+    def excluded(path):
+        return any(fnmatch.fnmatch(path, pattern) for pattern in exclude)
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        rel_dir = os.path.relpath(dirpath, root)
+        rel_dir = "" if rel_dir == "." else rel_dir
+        dirnames[:] = sorted(d for d in dirnames if not excluded(os.path.join(rel_dir, d)))
+        for name in sorted(filenames):
+            path = os.path.join(rel_dir, name)
+            if not excluded(path) and os.path.isfile(os.path.join(root, path)) \
+                    and not os.path.islink(os.path.join(root, path)):
+                yield path
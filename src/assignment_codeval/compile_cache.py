@@ -0,0 +1,247 @@
+"""Content-addressed cache of compile results for the C tag.
+
+An entry is keyed by the compile command, the version of the tools it runs and the
+content of its inputs: the source files the command names, and every source or header file
+in the working directory since those can be included or compiled implicitly. Commands that
+name no sources (make, mvn, gradle, build scripts) are keyed by every file in the working
+directory instead, except the files the same command was seen producing before, so the
+artifacts left behind by the last evaluation of a submission do not change its key.
+
+A successful compile is stored as the files it created or changed (and the files it
+removed), each kept once as a blob named by its sha256, so identical artifacts of different
+submissions share storage. A hit restores those files instead of running the command.
+Every lookup is appended to stats.log, from which evaluate-submissions reports the hit rate of
+its run.
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import time
+from functools import cache
+
+from assignment_codeval.commons import debug, sha256_file, walk_files
+
+# Bump whenever the key or the entry layout changes so old entries are not used
+CACHE_VERSION = 1
+
+# Files compilers read without the compile command naming them
+_IMPLICIT_INPUT_EXTS = ('.c', '.cpp', '.cc', '.cxx', '.h', '.hh', '.hpp', '.hxx', '.inc', '.tpp',
+                        '.java', '.py')
+
+# Compiles whose outputs add up to more than this are not cached
+MAX_ENTRY_BYTES = 256 * 1024 * 1024
+
+# Build tools whose output depends on compilers they find themselves
+_DELEGATED_TOOLS = {"make": ("cc", "c++"), "cmake": ("cc", "c++")}
+
+_COMMAND_SEPARATORS = re.compile(r"&&|\|\||;|\|")
+
+
+@cache
+def _tool_version(tool):
+    """Return what `tool --version` prints, or where the tool is if it cannot tell."""
+    path = shutil.which(tool)
+    if path is None:
+        return ""
+    try:
+        out = subprocess.run([path, "--version"], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT, timeout=10).stdout
+        return out.decode("utf-8", errors="replace")
+    except (OSError, subprocess.SubprocessError):
+        stat = os.stat(path)
+        return f"{path} {stat.st_size} {stat.st_mtime_ns}"
+
+
+def toolchain_version(command):
+    """Return the versions of the programs command runs, one per line."""
+    tools = []
+    for segment in _COMMAND_SEPARATORS.split(command):
+        words = segment.split()
+        # skip environment assignments in front of the program
+        while words and "=" in words[0] and not words[0].startswith("="):
+            words.pop(0)
+        if not words or words[0] in ("cd", "true", "exit"):
+            continue
+        tool = os.path.basename(words[0])
+        tools.append(tool)
+        tools.extend(_DELEGATED_TOOLS.get(tool, ()))
+    return "\n".join(f"{tool}: {_tool_version(tool)}" for tool in dict.fromkeys(tools))
+
+
+class CompileCache:
+    """A compile cache stored in the directory root, which may be shared by several evaluations.
+
+    Entries and blobs are written to temporary names and renamed into place, so concurrent
+    evaluations never see partial entries.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(os.path.join(root, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(root, "entries"), exist_ok=True)
+
+    def key(self, command, sources, workdir=".", exclude=()):
+        """Return the key of compiling with command in workdir.
+
+        Arguments:
+            command: the compile command
+            sources: the source files the command names, shell globs are expanded
+            workdir: the directory the command runs in
+            exclude: glob patterns of files in workdir that are never compile inputs
+
+        Returns:
+            the key as a hex string
+        """
+        digest = hashlib.sha256()
+        digest.update(f"{CACHE_VERSION}\n{command}\n{toolchain_version(command)}\n".encode())
+        inputs = set()
+        for source in sources:
+            matches = glob.glob(os.path.join(workdir, source))
+            inputs.update(os.path.relpath(match, workdir) for match in matches)
+            if not matches:
+                digest.update(f"missing {source}\n".encode())
+        if sources:
+            inputs.update(path for path in walk_files(workdir, exclude) if path.endswith(_IMPLICIT_INPUT_EXTS))
+        else:
+            outputs = self._known_outputs(command)
+            inputs.update(path for path in walk_files(workdir, exclude) if path not in outputs)
+        for path in sorted(inputs):
+            full_path = os.path.join(workdir, path)
+            if os.path.isfile(full_path):
+                digest.update(f"{path}\0{sha256_file(full_path)}\n".encode())
+        return digest.hexdigest()
+
+    def snapshot(self, workdir=".", exclude=()):
+        """Return the state of the files in workdir, to find what a compile changes."""
+        state = {}
+        for path in walk_files(workdir, exclude):
+            stat = os.stat(os.path.join(workdir, path))
+            state[path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        return state
+
+    def _outputs_path(self, command):
+        return os.path.join(self.root, "outputs", f"{hashlib.sha256(command.encode()).hexdigest()}.json")
+
+    def _known_outputs(self, command):
+        """Return the paths command produced in the compiles stored so far."""
+        try:
+            with open(self._outputs_path(command)) as f:
+                return set(json.load(f))
+        except (OSError, ValueError):
+            return set()
+
+    def _entry_path(self, key):
+        return os.path.join(self.root, "entries", key[:2], f"{key}.json")
+
+    def _blob_path(self, blob):
+        return os.path.join(self.root, "blobs", blob[:2], blob)
+
+    def _write_atomic(self, path, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            write(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def store(self, key, command, before, log="", workdir=".", exclude=()):
+        """Record the files a successful compile created, changed or removed.
+
+        Arguments:
+            key: the key of the compile
+            command: the compile command
+            before: the snapshot taken before the compile ran
+            log: what the compile printed
+            workdir: the directory the compile ran in
+            exclude: glob patterns of files in workdir to leave out
+
+        Returns:
+            True if the entry was stored, False if the outputs are too large or could not be written
+        """
+        after = self.snapshot(workdir, exclude)
+        changed = [path for path, state in after.items() if before.get(path) != state]
+        if sum(after[path][0] for path in changed) > MAX_ENTRY_BYTES:
+            debug(f"not caching compile {key}: outputs are larger than {MAX_ENTRY_BYTES} bytes")
+            return False
+        files = []
+        try:
+            for path in changed:
+                full_path = os.path.join(workdir, path)
+                blob = sha256_file(full_path)
+                if not os.path.exists(self._blob_path(blob)):
+                    self._write_atomic(self._blob_path(blob), lambda tmp: shutil.copyfile(full_path, tmp))
+                files.append({"path": path, "blob": blob, "mode": os.stat(full_path).st_mode & 0o7777})
+            entry = {"version": CACHE_VERSION, "files": files, "log": log,
+                     "removed": sorted(path for path in before if path not in after)}
+
+            def write_entry(tmp):
+                with open(tmp, "w") as f:
+                    json.dump(entry, f)
+            self._write_atomic(self._entry_path(key), write_entry)
+
+            outputs = sorted(self._known_outputs(command) | set(changed))
+
+            def write_outputs(tmp):
+                with open(tmp, "w") as f:
+                    json.dump(outputs, f)
+            self._write_atomic(self._outputs_path(command), write_outputs)
+            return True
+        except OSError as e:
+            debug(f"could not store compile {key} in {self.root}: {e}")
+            return False
+
+    def restore(self, key, workdir="."):
+        """Put the outputs of the compile with key into workdir.
+
+        Returns:
+            the compile log of the entry, None if there is no usable entry
+        """
+        try:
+            with open(self._entry_path(key)) as f:
+                entry = json.load(f)
+            if entry.get("version") != CACHE_VERSION or \
+                    not all(os.path.exists(self._blob_path(file["blob"])) for file in entry["files"]):
+                return None
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        for path in entry["removed"]:
+            if os.path.isfile(os.path.join(workdir, path)):
+                os.remove(os.path.join(workdir, path))
+        for file in entry["files"]:
+            full_path = os.path.join(workdir, file["path"])
+            os.makedirs(os.path.dirname(full_path) or ".", exist_ok=True)
+            if os.path.lexists(full_path):
+                os.remove(full_path)
+            shutil.copyfile(self._blob_path(file["blob"]), full_path)
+            os.chmod(full_path, file["mode"])
+        return entry["log"]
+
+    def record(self, key, hit):
+        """Append a lookup to stats.log; appends of a single short line do not interleave."""
+        line = f"{time.time():.3f} {'hit' if hit else 'miss'} {key}\n"
+        try:
+            with open(os.path.join(self.root, "stats.log"), "a") as f:
+                f.write(line)
+        except OSError as e:
+            debug(f"could not record compile cache lookup: {e}")
+
+
+def read_stats(root):
+    """Return the number of hits and misses recorded in the cache at root."""
+    hits = misses = 0
+    try:
+        with open(os.path.join(root, "stats.log")) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3:
+                    hits += parts[1] == "hit"
+                    misses += parts[1] == "miss"
+    except OSError:
+        pass
+    return hits, misses
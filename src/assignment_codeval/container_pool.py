@@ -0,0 +1,143 @@
+"""Warm evaluator containers for evaluate-submissions --pool.
+
+Instead of a `docker run` for every submission, the pool keeps one long-lived container per
+worker, started with the [RUN] pool_command of codeval.ini (NAME is replaced by the name of
+the container and SUBMISSIONS by its job directory on the host, which the command mounts).
+For each submission the job directory is emptied and the submission is copied into it, and
+the evaluation runs in the container with pool_exec, `docker exec` by default.
+
+A container is replaced by a fresh one after a number of jobs, and after a job that failed
+in a way that may have left the container in a bad state: a timeout, an exception, or an
+exit code of 125 or more (docker itself failed, or the evaluation was killed by a signal).
+Test failures exit with 1 or 2 and keep the container.
+"""
+import dataclasses
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+import click
+
+from assignment_codeval.commons import debug, info, warn
+
+DEFAULT_EXEC_COMMAND = 'docker exec -i NAME bash -c "EVALUATE"'
+DEFAULT_STOP_COMMAND = "docker rm -f NAME"
+
+# Exit codes of docker exec when docker or the command could not run, or when it was killed
+FAILED_EXIT_CODE = 125
+
+
+@dataclasses.dataclass
+class WarmContainer:
+    """A pool container: its name, its place in the pool, the host directory mounted into it, and the jobs it ran."""
+    name: str
+    index: int
+    job_dir: str
+    jobs: int = 0
+    started: bool = False
+
+
+class ContainerPool:
+    """A fixed number of warm containers, handed out to one job at a time.
+
+    Arguments:
+        start_command: the command that starts a container in the background, with NAME and SUBMISSIONS
+        stop_command: the command that stops and removes a container, with NAME
+        size: the number of containers
+        recycle_after: the number of jobs after which a container is replaced
+        root_dir: the directory the job directories are created in
+    """
+
+    def __init__(self, start_command, stop_command, size, recycle_after, root_dir):
+        self.start_command = start_command
+        self.stop_command = stop_command
+        self.recycle_after = recycle_after
+        self.root_dir = root_dir
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._containers = []
+        for index in range(size):
+            self._idle.put(self._new_container(index))
+
+    def _new_container(self, index):
+        with self._lock:
+            self._generation += 1
+            generation = self._generation
+        container = WarmContainer(f"codeval-pool-{os.getpid()}-{index}-{generation}", index,
+                                  os.path.join(self.root_dir, f"job{index}"))
+        os.makedirs(container.job_dir, exist_ok=True)
+        with self._lock:
+            self._containers.append(container)
+        return container
+
+    def _run(self, command, container):
+        command = command.replace("NAME", container.name).replace("SUBMISSIONS", container.job_dir)
+        debug(f"container pool: {command}")
+        return subprocess.run(command, shell=True, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT)
+
+    def _start(self, container):
+        info(f"starting pool container {container.name}")
+        result = self._run(self.start_command, container)
+        if result.returncode != 0:
+            raise click.ClickException(f"could not start pool container {container.name}: "
+                                       f"{result.stdout.decode('utf-8', errors='replace')}")
+        container.started = True
+
+    def _stop(self, container):
+        if container.started:
+            result = self._run(self.stop_command, container)
+            if result.returncode != 0:
+                warn(f"could not stop pool container {container.name}: "
+                     f"{result.stdout.decode('utf-8', errors='replace')}")
+            container.started = False
+        with self._lock:
+            self._containers.remove(container)
+
+    def acquire(self):
+        """Take an idle container, starting it if it is not running yet."""
+        container = self._idle.get()
+        try:
+            if not container.started:
+                self._start(container)
+        except BaseException:
+            self._idle.put(container)
+            raise
+        return container
+
+    def prepare(self, container, source_dir):
+        """Empty the job directory of container and copy source_dir into it.
+
+        The job directory itself stays, since the container has it mounted.
+
+        Returns:
+            the job directory
+        """
+        for entry in os.scandir(container.job_dir):
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+        shutil.copytree(source_dir, container.job_dir, symlinks=True, dirs_exist_ok=True)
+        return container.job_dir
+
+    def release(self, container, failed=False):
+        """Give a container back after a job; it is replaced if it failed or ran recycle_after jobs."""
+        container.jobs += 1
+        if failed or container.jobs >= self.recycle_after:
+            info(f"recycling pool container {container.name} after {container.jobs} jobs"
+                 f"{' and a failure' if failed else ''}")
+            self._stop(container)
+            container = self._new_container(container.index)
+        self._idle.put(container)
+
+    def close(self):
+        """Stop every container of the pool and remove the job directories."""
+        with self._lock:
+            containers = list(self._containers)
+        for container in containers:
+            self._stop(container)
+        shutil.rmtree(self.root_dir, ignore_errors=True)
@@ -0,0 +1,234 @@
+"""Benchmark the evaluation engine with synthetic specs.
+
+`benchmark-evaluation` generates codeval specs together with the files they test: a program
+that echoes its input, data files for the test cases, and a C++ source with as many
+functions and streams as the spec has CF and CO checks. The spec compiles the source with
+g++ into an object file, so CF looks the functions up in its symbol table as it does for a
+real submission (without g++ CF falls back to the source). Each scenario varies the number
+of test cases, the size of their input and output, and the mix of checks.
+
+Every scenario is evaluated by run-evaluation in a fresh process and a fresh directory, so
+nothing is cached between repeats, and timed end to end (wall, including the interpreter
+start) and per phase (see run-evaluation --timings-file). The median of the repeats is
+reported, saved as a JSON baseline, and compared with an earlier baseline; a phase that got
+slower than the threshold allows is a regression. Nothing needs Docker or Canvas.
+"""
+import dataclasses
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+import click
+
+from assignment_codeval.commons import info
+
+# Bump whenever the layout of the baseline or what the scenarios run changes
+BASELINE_VERSION = 2
+
+_RUN_EVALUATION = "from assignment_codeval.evaluate import run_evaluation; run_evaluation()"
+
+
+@dataclasses.dataclass
+class Scenario:
+    """A synthetic evaluation: its test cases, the bytes each one reads and writes, and its checks."""
+    name: str
+    tests: int
+    io_bytes: int
+    function_checks: int = 0
+    object_checks: int = 0
+    jobs: int = 1
+
+    def scaled(self, scale):
+        """Return the scenario with scale times as many test cases and checks, at least one test case."""
+        return dataclasses.replace(self, tests=max(1, round(self.tests * scale)),
+                                   function_checks=round(self.function_checks * scale),
+                                   object_checks=round(self.object_checks * scale))
+
+
+SCENARIOS = [
+    Scenario("many-tests", tests=200, io_bytes=64),
+    Scenario("large-io", tests=8, io_bytes=2 * 1024 * 1024),
+    Scenario("checks", tests=10, io_bytes=64, function_checks=200, object_checks=200),
+    Scenario("mixed", tests=100, io_bytes=16 * 1024, function_checks=40, object_checks=40),
+    Scenario("parallel", tests=200, io_bytes=64, jobs=4),
+]
+
+
+def _data(case, size):
+    """Return size bytes of text lines that differ from test case to test case."""
+    line = f"test case {case} line of synthetic input "
+    data = (line * (size // len(line) + 1))[:max(size - 1, 0)]
+    return "\n".join(data[i:i + 79] for i in range(0, len(data), 80)) + "\n"
+
+
+def write_scenario(scenario, workdir, compile_source=True):
+    """Write the spec of scenario and the files it tests into workdir.
+
+    Every test case passes and every check finds what it checks for. With compile_source,
+    the spec compiles prog.cpp to prog.o with g++, which CF then reads.
+    """
+    with open(os.path.join(workdir, "echo.sh"), "w") as f:
+        f.write("#!/bin/sh\nexec cat\n")
+
+    functions = "".join(f"int f{i}(int x) {{ return x + {i}; }}\n" for i in range(scenario.function_checks))
+    calls = "".join(f"    std::cout << f{i}(1);\n" for i in range(scenario.function_checks))
+    streams = "".join(f"    std::ofstream log{i}(\"log{i}.txt\");\n    log{i} << {i};\n"
+                      for i in range(scenario.object_checks))
+    with open(os.path.join(workdir, "prog.cpp"), "w") as f:
+        f.write(f"#include <fstream>\n#include <iostream>\n{functions}int main() {{\n{calls}{streams}"
+                "    return 0;\n}\n")
+
+    # the checks are spread over the test cases, as they are in real specs
+    checks = [f"CF f{i} prog.cpp" for i in range(scenario.function_checks)] + \
+             [f"CO log{i} prog.cpp" for i in range(scenario.object_checks)]
+    compile_command = "cp echo.sh echo_prog && chmod +x echo_prog"
+    if compile_source:
+        compile_command = f"g++ -c prog.cpp -o prog.o && {compile_command}"
+    spec = [f"C {compile_command}"]
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    for case in range(1, scenario.tests + 1):
+        data_file = os.path.join("data", f"case{case}.txt")
+        with open(os.path.join(workdir, data_file), "w") as f:
+            f.write(_data(case, scenario.io_bytes))
+        spec += ["T ./echo_prog", f"IF {data_file}", f"OF {data_file}"]
+        spec += checks[(case - 1) * len(checks) // scenario.tests:case * len(checks) // scenario.tests]
+    with open(os.path.join(workdir, "codeval.txt"), "w") as f:
+        f.write("\n".join(spec) + "\n")
+
+
+def run_scenario(scenario, compile_source=True):
+    """Generate scenario in a fresh directory and evaluate it with run-evaluation in a fresh process.
+
+    Returns:
+        {"wall": seconds, "total": seconds, "phases": {phase: seconds}}
+
+    Raises:
+        click.ClickException if the evaluation does not pass
+    """
+    with TemporaryDirectory(prefix="codeval-bench") as workdir:
+        write_scenario(scenario, workdir, compile_source)
+        timings_file = os.path.join(workdir, "timings.json")
+        start = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-c", _RUN_EVALUATION, "codeval.txt", "--timings-file", timings_file,
+             "--jobs", str(scenario.jobs)],
+            cwd=workdir, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        wall = time.perf_counter() - start
+        if completed.returncode != 0:
+            output = completed.stdout.decode("utf-8", errors="replace")
+            raise click.ClickException(f"scenario {scenario.name} exited with {completed.returncode}:\n"
+                                       f"{output[-2000:]}")
+        with open(timings_file) as f:
+            timings = json.load(f)
+    return {"wall": wall, "total": timings["total"], "phases": timings["phases"]}
+
+
+def _median(runs):
+    """Combine repeated runs of a scenario into the median of each time."""
+    phases = sorted({phase for run in runs for phase in run["phases"]})
+    return {
+        "wall": statistics.median(run["wall"] for run in runs),
+        "total": statistics.median(run["total"] for run in runs),
+        "phases": {phase: statistics.median(run["phases"].get(phase, 0.0) for run in runs) for phase in phases},
+    }
+
+
+def _times(result):
+    """Return the times of a scenario result as (name, seconds) pairs, phases as phase/NAME."""
+    return [("wall", result["wall"]), ("total", result["total"])] + \
+        [(f"phase/{phase}", seconds) for phase, seconds in result["phases"].items()]
+
+
+def find_regressions(current, baseline, threshold, min_delta):
+    """Compare the results of benchmark runs with a baseline.
+
+    Arguments:
+        current: the results, by scenario name
+        baseline: the results of the baseline, by scenario name
+        threshold: fraction a time may grow by before it is a regression
+        min_delta: seconds a time may grow by in any case, so short phases do not fail on noise
+
+    Returns:
+        a list of messages, one for each time that regressed
+    """
+    regressions = []
+    for name, result in current.items():
+        if name not in baseline:
+            continue
+        base_times = dict(_times(baseline[name]))
+        for time_name, seconds in _times(result):
+            base = base_times.get(time_name)
+            if base is None:
+                continue
+            if seconds > base * (1 + threshold) and seconds - base > min_delta:
+                regressions.append(f"{name} {time_name}: {seconds:.3f}s, baseline {base:.3f}s "
+                                   f"(+{(seconds - base) / base if base else float('inf'):.0%})")
+    return regressions
+
+
+@click.command("benchmark-evaluation")
+@click.option("--scenario", "scenario_names", multiple=True,
+              type=click.Choice([scenario.name for scenario in SCENARIOS]),
+              help="scenario to run, repeat for several; all of them by default")
+@click.option("--repeat", type=click.IntRange(min=1), default=3, show_default=True,
+              help="runs of each scenario, the median is reported")
+@click.option("--scale", type=click.FloatRange(min=0, min_open=True), default=1.0, show_default=True,
+              help="multiply the number of test cases and checks of each scenario")
+@click.option("--baseline", type=click.File("r"), help="JSON baseline to compare with")
+@click.option("--save-baseline", type=click.Path(dir_okay=False, writable=True),
+              help="write the results as a JSON baseline to this file")
+@click.option("--threshold", type=click.FloatRange(min=0), default=0.25, show_default=True,
+              help="fraction a time may grow by compared to the baseline before it is a regression")
+@click.option("--min-delta", type=click.FloatRange(min=0), default=0.05, show_default=True,
+              help="seconds a time may grow by regardless of --threshold")
+def benchmark_evaluation(scenario_names, repeat, scale, baseline, save_baseline, threshold, min_delta):
+    """
+    Time run-evaluation on synthetic specs, end to end and per phase.
+
+    The phases are loading the plan, compiling, running test cases, CF/CO checks, commands
+    and the rest of the spec. With --baseline, exits with 1 if a time regressed by more
+    than --threshold (and --min-delta seconds) compared to the baseline.
+    """
+    compile_source = shutil.which("g++") is not None
+    if not compile_source:
+        click.echo("g++ not found: not compiling the C++ source, CF checks fall back to the source")
+    baseline_results = None
+    if baseline:
+        baseline_data = json.load(baseline)
+        if baseline_data.get("version") != BASELINE_VERSION:
+            raise click.UsageError(f"{baseline.name} is not a version {BASELINE_VERSION} baseline")
+        if baseline_data.get("scale") != scale:
+            raise click.UsageError(f"{baseline.name} was run with --scale {baseline_data.get('scale')}, not {scale}")
+        if baseline_data.get("compiled") != compile_source:
+            raise click.UsageError(f"{baseline.name} was run {'with' if baseline_data.get('compiled') else 'without'} "
+                                   f"g++, unlike this run")
+        baseline_results = baseline_data["scenarios"]
+
+    results = {}
+    for scenario in SCENARIOS:
+        if scenario_names and scenario.name not in scenario_names:
+            continue
+        scenario = scenario.scaled(scale)
+        info(f"running {scenario.name}: {scenario.tests} tests of {scenario.io_bytes} bytes, "
+             f"{scenario.function_checks} CF and {scenario.object_checks} CO checks, {scenario.jobs} jobs")
+        results[scenario.name] = _median([run_scenario(scenario, compile_source) for _ in range(repeat)])
+        click.echo(f"{scenario.name}: " + ", ".join(f"{time_name} {seconds:.3f}s"
+                                                     for time_name, seconds in _times(results[scenario.name])))
+
+    if save_baseline:
+        with open(save_baseline, "w") as f:
+            json.dump({"version": BASELINE_VERSION, "python": sys.version.split()[0], "scale": scale,
+                       "compiled": compile_source, "repeat": repeat, "scenarios": results}, f, indent=2)
+
+    if baseline_results is not None:
+        regressions = find_regressions(results, baseline_results, threshold, min_delta)
+        for regression in regressions:
+            click.echo(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        click.echo(f"no regressions compared to {baseline.name}")
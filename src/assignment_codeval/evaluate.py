@@ -1,17 +1,46 @@
 #! /usr/bin/python3
 
-import ast
+import codecs
+import contextlib
+import dataclasses
+import io
+import json
 import os
 import re
+import shlex
+import shutil
+import socket
 import subprocess
 import sys
 import traceback
 import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import click
 
 from assignment_codeval.file_utils import unzip
+from assignment_codeval.compile_cache import CompileCache
+from assignment_codeval.process_runner import (
+    STOPPED_MISMATCH,
+    STOPPED_OUTPUT_CAP,
+    LIMIT_CPU,
+    LIMIT_MEMORY,
+    LIMIT_PROCESSES,
+    ResourceLimits,
+    ResourceUsage,
+    buffer_equals,
+    read_buffer,
+    run_supervised,
+    run_with_pipes,
+    stop_process_group,
+)
+from assignment_codeval.result_cache import ResultCache, case_fields
+from assignment_codeval.shards import marker_line, parse_shard, shard_of
+from assignment_codeval.source_index import SourceIndex
+from assignment_codeval.spec_plan import SpecPlan, compile_spec, load_spec_plan, plan_path_for
+from assignment_codeval.symbol_index import SymbolIndex
+from assignment_codeval.unified_diff import format_label, unified_diff
 
 ###########################################################
 # Globals
@@ -29,33 +58,72 @@ test_args = ""
 cmps = []
 timeout_val = 10
 output_length_limit = 4096
+# Bytes of stdout or stderr a test command may produce before it is stopped
+output_cap = 16 * 1024 * 1024
+# Resource limits of test commands set with MEM, CPU and NPROC, None for no limit
+memory_limit_mb = None
+cpu_limit_sec = None
+process_limit = None
+# cgroup v2 directory test commands get a transient cgroup in, None to only use rlimits
+cgroup_parent = None
 expected_exit_code = -1
 test_case_count = 0
 test_case_hint = ""
 test_case_total = 0
 num_passed = 0
 num_failed = 0
+# Keep running the remaining test cases after one fails (run-evaluation --keep-going)
+keep_going = False
+# (index, count) of the shard of the test cases to run (run-evaluation --shard), None for all
+shard = None
+# Number of the test case that stopped the evaluation, None while none has
+failed_test_case = None
+# Send the output of CMD commands to /dev/null, for setup that another shard reports
+_quiet_commands = False
 is_hidden_testcase = False
 is_verbose = False
 compilelog = []
 last_compile_command = ""
 temp_files = []
 _active_temp_files = []
+# Test case stdin and expected stdout/stderr, kept in memory as lists of byte chunks
+test_input = []
+expected_output = []
+expected_error = []
+_test_executor = None
+_pending_tests = []
+# Processes left behind by test commands, CMD/TCMD commands and servers that were killed
+stray_processes = 0
+_stray_lock = threading.Lock()
+# Servers started with SS that may still be running, each in its own process group
+_servers = []
+# Resource usage of each test case run so far, see _usage_record
+test_usage = []
+# Outcome of each test case run so far, see _result_record
+test_results = []
+# CompileCache used by the C tag (run-evaluation --compile-cache), None to always compile
+compile_cache = None
+# Glob patterns of files in the working directory that are not compile inputs
+compile_cache_exclude = []
+compile_cache_hits = 0
+compile_cache_misses = 0
+# ResultCache of test case outcomes (run-evaluation --result-cache), None to always run test cases
+result_cache = None
+result_cache_hits = 0
+result_cache_misses = 0
+# Seconds spent in each phase of the evaluation (run-evaluation --timings-file), see _timed
+phase_times = {}
+# Seconds spent in the phases nested in each of the phases being timed
+_phase_stack = []
+# Names in the compiled artifacts CF and NCF check, read once per version of an artifact
+symbol_index = SymbolIndex()
+# Tokens and Python calls of the source files CO, CC and CF check, read once per version of a file
+source_index = SourceIndex()
 
 ###########################################################
 # Specification Tags to Function Mapping
 ###########################################################
 
-# Shell commands that likely indicate a missing CMD prefix when found untagged
-_BARE_SHELL_COMMANDS = {
-    'echo', 'rm', 'cp', 'mv', 'mkdir', 'rmdir', 'cat', 'ls', 'grep',
-    'sed', 'awk', 'find', 'chmod', 'chown', 'touch', 'ln', 'diff',
-    'sort', 'head', 'tail', 'cut', 'tr', 'wc', 'bash', 'sh', 'python',
-    'python3', 'make', 'export', 'source', 'kill', 'pkill', 'sleep',
-    'printf', 'read', 'unzip', 'tar', 'curl', 'wget',
-}
-
-
 def compile_code(compile_command):
     """Specifies the command to compile the submission code
 
@@ -71,6 +139,21 @@ def compile_code(compile_command):
     if test_case_count != 0:
         check_test()
 
+    cache_key = None
+    if compile_cache is not None:
+        global compile_cache_hits, compile_cache_misses
+        cache_key = compile_cache.key(compile_command, _extract_source_files_from_compile(compile_command),
+                                      exclude=compile_cache_exclude)
+        cached_log = compile_cache.restore(cache_key)
+        compile_cache.record(cache_key, cached_log is not None)
+        if cached_log is not None:
+            with open(get_testing_path("compilelog"), "w") as outfile:
+                outfile.write(cached_log)
+            compile_cache_hits += 1
+            return
+        compile_cache_misses += 1
+        before = compile_cache.snapshot(exclude=compile_cache_exclude)
+
     # Run compile command
     with open(get_testing_path("compilelog"), "w") as outfile:
         compile_popen = subprocess.Popen(
@@ -96,6 +179,10 @@ def compile_code(compile_command):
 
         sys.exit(1)
 
+    if cache_key is not None:
+        with open(get_testing_path("compilelog"), "r") as infile:
+            compile_cache.store(cache_key, compile_command, before, infile.read(), exclude=compile_cache_exclude)
+
 
 ###########################################################
 # Function detection helpers
@@ -166,7 +253,11 @@ def _extract_source_files_from_compile(compile_command):
 
 
 def _function_used_in_c_cpp(function_name, files):
-    """Use objdump on compiled artifacts to detect C/C++ function usage.
+    """Look the function up in the symbol tables of the compiled artifacts.
+
+    The symbol table of each artifact is read and demangled once into symbol_index, so
+    checking several functions does not inspect the artifact again. Artifacts the index
+    cannot read (not ELF) are inspected with objdump instead.
 
     Returns True if found, False if artifact exists but function absent,
     None if no compiled artifact was found (caller should fall back).
@@ -177,23 +268,34 @@ def _function_used_in_c_cpp(function_name, files):
         if artifact is None:
             continue
         found_artifact = True
-        # objdump -t dumps the symbol table; pipe through c++filt to demangle C++ names.
-        # Mangled C++ names embed the original identifier, so grep -w finds exact matches.
-        cmd = f"objdump -t '{artifact}' | c++filt | grep -w '{function_name}'"
-        result = subprocess.run(
-            ["bash", "-c", cmd],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        if result.returncode == 0:
+        used = symbol_index.elf_uses(artifact, function_name)
+        if used is None:
+            used = _objdump_mentions(artifact, function_name)
+        if used:
             return True
     if not found_artifact:
         return None
     return False
 
 
+def _objdump_mentions(artifact, function_name):
+    """Tell whether function_name is a word of the demangled `objdump -t` output of artifact."""
+    # objdump -t dumps the symbol table; pipe through c++filt to demangle C++ names.
+    # Mangled C++ names embed the original identifier, so grep -w finds exact matches.
+    cmd = f"objdump -t '{artifact}' | c++filt | grep -w '{function_name}'"
+    result = subprocess.run(
+        ["bash", "-c", cmd],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    return result.returncode == 0
+
+
 def _function_used_in_java(function_name, files):
-    """Use javap on compiled .class files to detect Java method usage.
+    """Look the method up in the names the compiled .class files declare or reference.
+
+    The constant pool of each class file is read once into symbol_index. Class files the
+    index cannot read are disassembled with javap instead.
 
     Returns True if found, False if class file exists but method absent,
     None if no .class file was found (caller should fall back).
@@ -205,13 +307,16 @@ def _function_used_in_java(function_name, files):
         if not os.path.exists(class_file):
             continue
         found_class = True
-        # javap -c disassembles bytecode; method invocations reference the method name.
-        result = subprocess.run(
-            ["javap", "-c", class_file],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        if function_name.encode() in result.stdout:
+        used = symbol_index.class_uses(class_file, function_name)
+        if used is None:
+            # javap -c disassembles bytecode; method invocations reference the method name.
+            result = subprocess.run(
+                ["javap", "-c", class_file],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            used = function_name.encode() in result.stdout
+        if used:
             return True
     if not found_class:
         return None
@@ -221,45 +326,19 @@ def _function_used_in_java(function_name, files):
 def _function_used_in_python(function_name, files):
     """Use the ast module to detect function calls in Python source files.
 
+    Each file is parsed once into source_index, which collects every called name, so
+    further checks of the same files are set lookups.
+
     Returns True if a matching call is found, False otherwise.
     Handles both direct calls (func()) and attribute calls (obj.func()).
     """
-    for source_file in files:
-        try:
-            with open(source_file, 'r') as f:
-                source = f.read()
-            tree = ast.parse(source)
-            for node in ast.walk(tree):
-                if isinstance(node, ast.Call):
-                    func = node.func
-                    if isinstance(func, ast.Name) and func.id == function_name:
-                        return True
-                    if isinstance(func, ast.Attribute) and func.attr == function_name:
-                        return True
-        except (SyntaxError, OSError):
-            continue
-    return False
+    return source_index.python_calls_any(files, function_name)
 
 
 def _function_used_regex(function_name, files):
-    """Legacy regex-based fallback used when no compiled artifact is available."""
-    regex = rf'(^|[^[:alnum:]_]){function_name}[[:space:]]*\('
-    cmd = (
-        "sed -E "
-        "'"
-        "s://.*$::g; "
-        "s:#.*$::g; "
-        ":a; /\\/\\*/{N; s:/\\*.*?\\*/::g; ba}"
-        "' "
-        + " ".join(files)
-        + f" | grep -E '{regex}'"
-    )
-    result = subprocess.run(
-        ["bash", "-c", cmd],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    return result.returncode == 0
+    """Source fallback used when no compiled artifact is available: look for a call of
+    function_name outside comments and string literals."""
+    return source_index.calls(files, function_name)
 
 
 def _is_function_used(function_name, files, allow_regex_fallback=True):
@@ -353,35 +432,11 @@ def check_object(args):
     object_name = args[0]
     files = args[1:]
 
-    # Match:
-    #  [1] start of line OR non-identifier character
-    #  [2] object name
-    #  [3] optional whitespace
-    #  [4] stream operator << or >>
-    regex = rf'(^|[^[:alnum:]_]){object_name}[[:space:]]*(<<|>>)'
-
-    # Strip comments, then search
-    cmd = (
-        "sed -E "
-        "'s://.*$::g; "              # remove // comments
-        ":a; /\\/\\*/{N; s:/\\*.*?\\*/::g; ba}' "
-        + " ".join(files)
-        + f" | grep -E '{regex}'"
-    )
-
-    # Surpress output
-    function_popen = subprocess.Popen(
-        ["bash", "-c", cmd],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-
-    function_popen.communicate()
-    if function_popen.returncode:
-        print(f"Not using {object_name} FAILED")
-    else:
+    if source_index.streams(files, object_name):
         print(f"Used {object_name} PASSED")
-        
+    else:
+        print(f"Not using {object_name} FAILED")
+
 def check_container(args):
     """Will be followed by a container and a list of files to ensure that the function is
     used by one of those files. 
@@ -401,34 +456,11 @@ def check_container(args):
     container_name = args[0]
     files = args[1:]
     
-    # Match:
-    #  [1] start of line OR non-identifier character
-    #  [2] container name
-    #  [3] optional whitespace
-    #  [4] either '<' (template usage) or space (e.g. std::vector v;)
-    regex = rf'(^|[^[:alnum:]_]){container_name}[[:space:]]*(<|[[:space:]])'
-
-    # Strip comments, then search
-    cmd = (
-        "sed -E "
-        "'s://.*$::g; "
-        ":a; /\\/\\*/{N; s:/\\*.*?\\*/::g; ba}' "
-        + " ".join(files)
-        + f" | grep -E '{regex}'"
-    )
-
-    function_popen = subprocess.Popen(
-        ["bash", "-c", cmd],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-
-    function_popen.communicate()
-    if function_popen.returncode:
-        print(f"Not using {container_name} FAILED")
-    else:
+    if source_index.declares_with(files, container_name):
         print(f"Used {container_name} PASSED")
-    
+    else:
+        print(f"Not using {container_name} FAILED")
+
 
 def check_not_function(args):
     """Will be followed by a function name and an optional list of files to check to ensure that
@@ -492,9 +524,9 @@ def run_command(command):
     """
     check_test()
 
-    # Execute without surpressing output
-    command_popen = subprocess.Popen(command, shell=True)
-    command_popen.communicate()
+    # Execute without surpressing output, unless this shard does not report the command
+    output = {"stdout": subprocess.DEVNULL, "stderr": subprocess.DEVNULL} if _quiet_commands else {}
+    _record_strays(run_supervised(command, **output).strays)
 
 
 def run_command_noerror(command):
@@ -512,13 +544,28 @@ def run_command_noerror(command):
     # Run as test case
     global test_case_count
     test_case_count += 1
+    if not _owns_test_case(test_case_count):
+        # Later test cases may depend on what the command sets up, so every shard runs it;
+        # the shard that owns the test case reports it and the strays it left
+        run_supervised(command, _current_limits(), cgroup_parent,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return
     print(f"Test case count {test_case_count} of {test_case_total}")
 
     # Execute without surpressing output
-    command_popen = subprocess.Popen(command, shell=True)
-    command_popen.communicate()
-
-    if command_popen.returncode:
+    command_exec = run_supervised(command, _current_limits(), cgroup_parent)
+    _record_strays(command_exec.strays)
+    test_usage.append(_usage_record(test_case_count, command, command_exec.returncode == 0,
+                                    command_exec.usage))
+    failures = []
+    if command_exec.returncode and command_exec.limit is not None:
+        failures.append(_limit_message(_current_limits(), command_exec.limit))
+    test_results.append(_result_record(test_case_count, "TCMD", command, command_exec.returncode == 0,
+                                       False, "", failures, "", command_exec.usage))
+
+    if command_exec.returncode:
+        for line in failures:
+            print(line)
         print("FAILED")
         eval_logs_dir = get_testing_path("evaluationLogs")
         if os.path.exists(eval_logs_dir):
@@ -528,9 +575,15 @@ def run_command_noerror(command):
                 # Print entire file
                 print("\n".join(file_lines))
 
+        global num_failed
+        num_failed += 1
         # Exit entire program with error
-        sys.exit(1)
+        if not keep_going:
+            _stop_at_failed_test_case(test_case_count)
+            sys.exit(1)
     else:
+        global num_passed
+        num_passed += 1
         print("PASSED")
 
 
@@ -555,7 +608,7 @@ def test_case(test_case_command):
     Returns:
         None
     """
-    check_test()
+    check_test(barrier=False)
     _pre_test_temp_cleanup()
 
     # Clear hint
@@ -584,7 +637,7 @@ def test_case_hidden(test_case_command):
     Returns:
         None
     """
-    check_test()
+    check_test(barrier=False)
     _pre_test_temp_cleanup()
 
     # Clear hint
@@ -613,8 +666,7 @@ def supply_input(inputs):
     Returns:
         None
     """
-    with open(get_testing_path("fileinput"), "ab") as outfile:
-        outfile.write((inputs + "\n").encode("utf-8"))
+    test_input.append((inputs + "\n").encode("utf-8"))
 
 
 def supply_input_bare(inputs):
@@ -626,8 +678,7 @@ def supply_input_bare(inputs):
     Returns:
         None
     """
-    with open(get_testing_path("fileinput"), "ab") as outfile:
-        outfile.write(inputs.encode("utf-8"))
+    test_input.append(inputs.encode("utf-8"))
 
 
 def supply_input_file(input_file):
@@ -640,10 +691,7 @@ def supply_input_file(input_file):
         None
     """
     with open(input_file, "rb") as infile:
-        input_data = infile.read()
-
-    with open(get_testing_path("fileinput"), "ab") as outfile:
-        outfile.write(input_data)
+        test_input.append(infile.read())
 
 
 def check_output(outputs):
@@ -655,9 +703,7 @@ def check_output(outputs):
     Returns:
         None
     """
-
-    with open(get_testing_path("expectedoutput"), "a") as outfile:
-        outfile.write(outputs + "\n")
+    expected_output.append((outputs + "\n").encode("utf-8"))
 
 
 def check_output_bare(outputs):
@@ -669,9 +715,7 @@ def check_output_bare(outputs):
     Returns:
         None
     """
-
-    with open(get_testing_path("expectedoutput"), "a") as outfile:
-        outfile.write(outputs)
+    expected_output.append(outputs.encode("utf-8"))
 
 
 def check_output_file(output_file):
@@ -685,10 +729,7 @@ def check_output_file(output_file):
     """
     output_length(os.path.getsize(output_file)) 
     with open(output_file, "r") as infile:
-        output_lines = infile.readlines()
-        
-    with open(get_testing_path("expectedoutput"), "a") as outfile:
-        outfile.writelines(output_lines)
+        expected_output.append(infile.read().encode("utf-8"))
 
 
 def check_error(error_output):
@@ -700,8 +741,7 @@ def check_error(error_output):
     Returns:
         None
     """
-    with open(get_testing_path("expectederror"), "a") as outfile:
-        outfile.write(error_output + "\n")
+    expected_error.append((error_output + "\n").encode("utf-8"))
 
 
 def check_error_bare(error_output):
@@ -713,8 +753,7 @@ def check_error_bare(error_output):
     Returns:
         None
     """
-    with open(get_testing_path("expectederror"), "a") as outfile:
-        outfile.write(error_output)
+    expected_error.append(error_output.encode("utf-8"))
 
 
 def hint(hints):
@@ -798,6 +837,71 @@ def output_length(length):
     output_length_limit = int(length)
 
 
+def limit_memory(size_mb):
+    """Specifies the memory in MiB the processes of a test case may use, 0 for no limit.
+
+    Arguments:
+        size_mb: memory limit in MiB
+
+    Returns:
+        None
+    """
+    global memory_limit_mb
+    memory_limit_mb = int(size_mb) or None
+
+
+def limit_cpu(cpu_sec):
+    """Specifies the CPU time in seconds each process of a test case may use, 0 for no limit.
+
+    Arguments:
+        cpu_sec: CPU time limit in seconds
+
+    Returns:
+        None
+    """
+    global cpu_limit_sec
+    cpu_limit_sec = float(cpu_sec) or None
+
+
+def limit_processes(count):
+    """Specifies the number of processes a test case may run at once, 0 for no limit.
+
+    Arguments:
+        count: maximum number of processes
+
+    Returns:
+        None
+    """
+    global process_limit
+    process_limit = int(count) or None
+
+
+def _current_limits():
+    return ResourceLimits(memory_limit_mb, cpu_limit_sec, process_limit)
+
+
+def _limit_message(limits, limit):
+    """Return the failure line for a command that ran into limit."""
+    if limit == LIMIT_MEMORY:
+        return f"Exceeded the memory limit of {limits.memory_mb} MiB. FAIL"
+    if limit == LIMIT_CPU:
+        return f"Exceeded the CPU time limit of {limits.cpu_seconds:g} seconds. FAIL"
+    if limit == LIMIT_PROCESSES:
+        return f"Exceeded the limit of {limits.processes} processes. FAIL"
+    return f"Exceeded the {limit} limit. FAIL"
+
+
+def _stop_reason(case, test_exec):
+    """Return why the command of a test case was killed before it exited."""
+    if test_exec.timed_out:
+        return f"it took more than {case.timeout} seconds"
+    if test_exec.stopped == STOPPED_MISMATCH:
+        return "its output can no longer match"
+    if test_exec.stopped == STOPPED_OUTPUT_CAP:
+        return f"it produced more than {case.output_cap} bytes of output"
+    return "it was stopped"
+
+
 def exit_code(test_case_exit_code):
     """Specifies the expected exit code for a test case. Defaults to zero.
 
@@ -811,48 +915,159 @@ def exit_code(test_case_exit_code):
     expected_exit_code = int(test_case_exit_code)
 
 
-def start_server(timeout_sec, kill_timeout_sec, *server_cmd):
+def start_server(args):
     """Command containing timeout (wait until server starts), kill timeout (wait to kill the server),
-    and the command to start a server
+    an optional readiness condition, and the command to start a server
+
+    Without a readiness condition, SS waits the whole timeout for the server to start. With
+    one, it polls the condition with a growing delay and continues as soon as it holds:
+
+      - tcp:PORT or tcp:HOST:PORT, a TCP connection to the port (on localhost) succeeds
+      - log:TEXT, the server printed TEXT (quote TEXT if it contains spaces)
+      - file:PATH, the file PATH exists
+
+    Either way, SS stops waiting when the server exits. The server runs in its own process
+    group, which is stopped with everything the server started once the kill timeout
+    expires or the evaluation ends.
 
     Arguments:
-        timeout_sec: timeout in seconds to wait for server to start
-        kill_timeout_sec: timeout in seconds to wait until killing the server
-        server_cmd: command to run to start the server
+        args: timeout in seconds to wait for server to start, timeout in seconds to wait
+            until killing the server, the optional readiness condition, and the command to
+            run to start the server
 
     Returns:
         None
     """
+    timeout_sec, kill_timeout_sec, rest = args.split(None, 2)
+    condition, server_cmd = _split_ready_condition(rest)
 
-    print(
-        f'Starting server with command: {" ".join(server_cmd)} and sleeping for: {timeout_sec}. Will kill server '
-        f'after {kill_timeout_sec} seconds.'
-    )
+    # Tests defined before the server starts must not overlap with it
+    _drain_pending_tests()
+
+    if condition is None:
+        print(
+            f'Starting server with command: {server_cmd} and sleeping for: {timeout_sec}. Will kill server '
+            f'after {kill_timeout_sec} seconds.'
+        )
+    else:
+        print(
+            f'Starting server with command: {server_cmd} and waiting up to {timeout_sec} seconds for '
+            f'{condition[0]}:{condition[1]}. Will kill server after {kill_timeout_sec} seconds.'
+        )
 
     # Send output to compile log in background
-    with open(get_testing_path("compilelog"), "w") as outfile:
+    log_path = get_testing_path("compilelog")
+    with open(log_path, "w") as outfile:
         server_popen = subprocess.Popen(
-            server_cmd, shell=True, stdout=outfile, stderr=outfile, text=True
+            server_cmd, shell=True, stdout=outfile, stderr=outfile, text=True,
+            start_new_session=True,
         )
+    _servers.append(server_popen)
 
-    print(f"Server pid: {server_popen.pid}. Sleeping for {timeout_sec} seconds.")
-    # Block for timeout_sec so that server can start
-    time.sleep(float(timeout_sec))
+    if condition is None:
+        print(f"Server pid: {server_popen.pid}. Sleeping for {timeout_sec} seconds.")
+    else:
+        print(f"Server pid: {server_popen.pid}.")
+    start = time.monotonic()
+    ready = _wait_for_server(server_popen, condition, log_path, float(timeout_sec))
+    if server_popen.poll() is not None:
+        print(f"Server exited with {server_popen.returncode} while starting")
+    elif condition is not None:
+        if ready:
+            print(f"Server ready after {time.monotonic() - start:.2f} seconds")
+        else:
+            print(f"Server not ready after {timeout_sec} seconds")
 
-    # Kill the server after the timeout
-    def kill_server(pid):
-        print(f"Killing {pid}")
-        subprocess.Popen(
-            ["kill", "-9", f"{pid}"], stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
+    # Stop the server and everything it started after the timeout
+    def kill_server(server):
+        print(f"Killing {server.pid}")
+        _stop_server(server)
 
     kill_timer = threading.Timer(
-        float(kill_timeout_sec), kill_server, *[server_popen.pid]
+        float(kill_timeout_sec), kill_server, [server_popen]
     )
     kill_timer.daemon = True
     kill_timer.start()
 
 
+# Readiness conditions of SS, see start_server
+_READY_CONDITIONS = ("tcp", "log", "file")
+
+
+def _split_ready_condition(rest):
+    """Split the readiness condition, if any, from the command of an SS tag.
+
+    Returns:
+        ((kind, value) or None, the server command)
+    """
+    kind, sep, _ = rest.partition(":")
+    if not sep or kind not in _READY_CONDITIONS:
+        return None, rest
+    lexer = shlex.shlex(rest, posix=True)
+    lexer.whitespace_split = True
+    token = lexer.get_token()
+    command = lexer.instream.read().strip()
+    if not command:
+        return None, rest
+    return (kind, token.split(":", 1)[1]), command
+
+
+def _server_ready(condition, log_path):
+    """Tell whether the readiness condition of a server holds."""
+    kind, value = condition
+    if kind == "tcp":
+        host, _, port = value.rpartition(":")
+        try:
+            with socket.create_connection((host or "localhost", int(port)), timeout=0.25):
+                return True
+        except (OSError, ValueError):
+            return False
+    if kind == "log":
+        try:
+            with open(log_path, "rb") as f:
+                return value.encode() in f.read()
+        except OSError:
+            return False
+    return os.path.exists(value)
+
+
+def _wait_for_server(server, condition, log_path, timeout):
+    """Wait until the server's readiness condition holds, it exits, or timeout seconds pass.
+
+    Without a condition, wait the whole timeout unless the server exits.
+
+    Returns:
+        True if the condition holds
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.01
+    while True:
+        if condition is not None and _server_ready(condition, log_path):
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or server.poll() is not None:
+            return False
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.5)
+
+
+def _stop_server(server):
+    """Stop the process group of a server started by start_server."""
+    try:
+        # the kill timer and the end of the evaluation may both stop a server
+        _servers.remove(server)
+    except ValueError:
+        return
+    _record_strays(stop_process_group(server))
+
+
+def _record_strays(count):
+    """Add to the number of stray processes that were killed."""
+    global stray_processes
+    with _stray_lock:
+        stray_processes += count
+
+
 """
 Here is where the tags are mapped to functions.
 Any tags that are added or changed must be modified here.
@@ -882,6 +1097,9 @@ tag_func_map = {
     "HINT": hint,
     "TO": timeout,
     "OLEN": output_length,
+    "MEM": limit_memory,
+    "CPU": limit_cpu,
+    "NPROC": limit_processes,
     "X": exit_code,
     "SS": start_server,
     "TEMP": register_temp_file,
@@ -889,26 +1107,33 @@ tag_func_map = {
 
 
 def setup():
-    files = [
-        "compilelog",
-        "difflog",
-        "expectedoutput",
-        "expectederror",
-        "fileinput",
-        "yourerror",
-        "youroutput",
-    ]
     cleanup()
-    # Create testing directory and files
+    # Create testing directory, test case input and expected output are kept in memory
     os.makedirs(TESTING_DIR, exist_ok=True)
-    for file in files:
-        open(get_testing_path(file), "w").close()
+    _reset_test_state()
 
-    # Reset test case variables
-    global expected_exit_code
+
+def _reset_test_state():
+    """Reset the test case variables after a test case has been collected."""
+    global test_args, expected_exit_code, cmps, test_input, expected_output, expected_error
+    test_args = ""
     expected_exit_code = -1
-    global cmps
     cmps = []
+    test_input = []
+    expected_output = []
+    expected_error = []
+
+
+def _owns_test_case(number):
+    """Tell whether this shard runs test case number, and reports what follows it in the spec."""
+    return shard is None or shard_of(number, shard[1]) == shard[0]
+
+
+def _stop_at_failed_test_case(number):
+    """Remember which test case stopped the evaluation, for the shard marker."""
+    global failed_test_case
+    if failed_test_case is None:
+        failed_test_case = number
 
 
 def parse_tags(tags: list[str]):
@@ -920,118 +1145,103 @@ def parse_tags(tags: list[str]):
     Returns:
         None
     """
-    # Pattern matches: TAG arguments (arguments required)
-    # Use single space separator to preserve leading whitespace in values
-    tag_pattern = r"([A-Z_]+) (.*)"
-    # Pattern for tag with optional arguments
-    tag_only_pattern = r"([A-Z_]+)\s*$"
-
-    valid_tags = set(tag_func_map.keys())
-    # Tags to silently ignore (used by other tools but not by run-evaluation)
-    ignored_tags = {"CD", "CTO", "Z", "RUN"}
-
-    # Track if we're inside a CRT_HW block (content to ignore)
-    in_crt_hw_block = False
-
-    for line_num, tag_line in enumerate(tags, start=1):
-        # Skip empty lines and comments
-        stripped = tag_line.strip()
-        if not stripped or stripped.startswith("#"):
-            continue
+    run_plan(compile_spec(tags, tag_func_map.keys()))
 
-        # Check for ASSIGNMENT START/END (or legacy CRT_HW) block delimiter
-        if stripped.startswith("CRT_HW") or stripped.startswith("ASSIGNMENT START") or stripped.startswith("ASSIGNMENT END"):
-            in_crt_hw_block = not in_crt_hw_block
-            continue
 
-        # Skip lines inside assignment description block
-        if in_crt_hw_block:
-            continue
+# Tags that only report, skipped by shards that do not report the part of the spec they are in
+_REPORT_TAGS = {"CF", "NCF", "CO", "CC", "PRINT"}
+# Tags every shard needs, run without output by shards that do not report them
+_SETUP_TAGS = {"C", "CMD", "SS"}
 
-        tag_match = re.match(tag_pattern, tag_line)
-        tag_only_match = re.match(tag_only_pattern, tag_line)
 
-        # Check for tag without arguments
-        if tag_only_match and not tag_match:
-            tag = tag_only_match.group(1)
-            # Skip ignored tags
-            if tag in ignored_tags:
-                continue
-            if tag in valid_tags:
-                print(f"Error on line {line_num}: Tag '{tag}' requires arguments")
-                print(f"  {line_num}: {tag_line.rstrip()}")
-                sys.exit(1)
-            elif tag.isupper():
-                print(f"Error on line {line_num}: Unknown tag '{tag}'")
-                print(f"  {line_num}: {tag_line.rstrip()}")
-                print(f"  Valid tags are: {', '.join(sorted(valid_tags))}")
-                sys.exit(1)
-            continue
+# Phase of the evaluation each tag is timed in, the tags not listed are "spec"
+_TAG_PHASES = {"C": "compile", "CF": "checks", "NCF": "checks", "CO": "checks", "CC": "checks",
+               "CMD": "commands", "SS": "commands", "TCMD": "tests"}
 
-        # If line does not match tag format, skip non-tag lines
-        if not tag_match:
-            # Check if it looks like an invalid tag (starts with uppercase letters)
-            potential_tag = re.match(r"([A-Z]+)", tag_line)
-            if potential_tag:
-                tag = potential_tag.group(1)
-                # Skip ignored tags
-                if tag in ignored_tags:
-                    continue
-                if tag not in valid_tags and len(tag) <= 4:
-                    print(f"Error on line {line_num}: Unknown tag '{tag}'")
-                    print(f"  {line_num}: {tag_line.rstrip()}")
-                    print(f"  Valid tags are: {', '.join(sorted(valid_tags))}")
-                    sys.exit(1)
-            else:
-                # Check if this looks like a bare shell command missing a CMD prefix
-                first_word = tag_line.split()[0] if tag_line.split() else ""
-                if first_word.lower() in _BARE_SHELL_COMMANDS:
-                    print(f"Warning on line {line_num}: bare shell command without CMD prefix, shell commands will be ignored")
-                    print(f"  {line_num}: {tag_line.rstrip()}")
-                    print(f"  Did you mean: CMD {tag_line.rstrip()}")
-            continue
 
-        tag = tag_match.group(1)
-        args = tag_match.group(2)
+@contextlib.contextmanager
+def _timed(phase):
+    """Add the time spent in the block, less the time of the phases timed within it, to phase_times[phase]."""
+    start = time.perf_counter()
+    _phase_stack.append(0.0)
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = _phase_stack.pop()
+        phase_times[phase] = phase_times.get(phase, 0.0) + elapsed - nested
+        if _phase_stack:
+            _phase_stack[-1] += elapsed
+
+
+def _run_quietly(tag_func, args):
+    """Run a setup tag without printing anything, also from the commands it runs."""
+    # Report the test cases that are still pending first
+    check_test()
+    global _quiet_commands
+    _quiet_commands = True
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            tag_func(args)
+    finally:
+        _quiet_commands = False
 
-        # Skip ignored tags
-        if tag in ignored_tags:
-            continue
 
-        # Check for unknown tag
-        if tag not in valid_tags:
-            print(f"Error on line {line_num}: Unknown tag '{tag}'")
-            print(f"  {line_num}: {tag_line.rstrip()}")
-            print(f"  Valid tags are: {', '.join(sorted(valid_tags))}")
-            sys.exit(1)
+def run_plan(plan: SpecPlan):
+    """Execute the steps of a compiled spec in order
 
-        # Check for empty arguments
-        if not args.strip():
-            print(f"Error on line {line_num}: Tag '{tag}' requires arguments")
-            print(f"  {line_num}: {tag_line.rstrip()}")
+    Arguments:
+        plan (SpecPlan): the compiled spec to execute
+
+    Returns:
+        None
+    """
+    for step in plan.steps:
+        # With --shard, what is not part of a test case is reported by the shard that runs
+        # the test case before it; the other shards only do the setup every shard needs
+        reported = _owns_test_case(test_case_count)
+        if step.kind == "warning":
+            if reported:
+                for message in step.messages:
+                    print(message)
+            continue
+        if step.kind == "error":
+            if reported:
+                for message in step.messages:
+                    print(message)
             sys.exit(1)
 
+        line_num = step.line
+        tag = step.tag
+        if not reported and tag in _REPORT_TAGS:
+            check_test()
+            continue
+
         # Execute function based on tag-function mapping
         try:
-            tag_func_map[tag](args)
+            with _timed(_TAG_PHASES.get(tag, "spec")):
+                if reported or tag not in _SETUP_TAGS:
+                    tag_func_map[tag](step.args)
+                else:
+                    _run_quietly(tag_func_map[tag], step.args)
         except TypeError as e:
             print(f"Error on line {line_num}: Invalid arguments for tag '{tag}'")
-            print(f"  {line_num}: {tag_line.rstrip()}")
+            print(f"  {line_num}: {step.text}")
             print(f"  Details: {e}")
             sys.exit(1)
         except ValueError as e:
             print(f"Error on line {line_num}: Invalid value for tag '{tag}'")
-            print(f"  {line_num}: {tag_line.rstrip()}")
+            print(f"  {line_num}: {step.text}")
             print(f"  Details: {e}")
             sys.exit(1)
         except FileNotFoundError as e:
             print(f"Error on line {line_num}: File not found for tag '{tag}'")
-            print(f"  {line_num}: {tag_line.rstrip()}")
+            print(f"  {line_num}: {step.text}")
             print(f"  Details: {e}")
             sys.exit(1)
         except Exception as e:
             print(f"Error on line {line_num}: Unexpected error for tag '{tag}'")
-            print(f"  {line_num}: {tag_line.rstrip()}")
+            print(f"  {line_num}: {step.text}")
             print(f"  Details: {e}")
             traceback.print_exc()
             sys.exit(1)
@@ -1071,64 +1281,46 @@ def parse_diff(diff_lines: list[str], testing_dir: str):
                     outfile.write(line)
 
 
+def _escape_bytes(error):
+    """Decoding error handler that renders each undecodable byte as \\xNN."""
+    return "".join(f"\\x{b:02X}" for b in error.object[error.start:error.end]), error.end
+
+
+codecs.register_error("codeval-render", _escape_bytes)
+
+# Bytes _render_diff_output shows as they are (newlines only get a $ in front)
+_PLAIN_BYTES = bytes(range(0x20, 0x7F)) + b"\n"
+# How _render_diff_output shows the other ASCII bytes: ^@ to ^_ and ^? for DEL
+_CONTROL_CHARS = {chr(b): "^" + chr(b + 0x40) for b in range(0x20)}
+_CONTROL_CHARS["\x7f"] = "^?"
+_CONTROL_CHAR = re.compile(r"[\x00-\x09\x0b-\x1f\x7f]")
+_NON_ASCII_RUN = re.compile(r"[^\x00-\x7f]+")
+
+
+def _render_non_ascii(match):
+    """Keep printable characters of a non-ASCII run and render the others as \\xNN bytes."""
+    run = match.group()
+    if run.isprintable():
+        return run
+    return "".join(c if c.isprintable() else "".join(f"\\x{b:02X}" for b in c.encode("utf-8"))
+                   for c in run)
+
+
 def _render_diff_output(raw_bytes: bytes) -> str:
     """Render raw bytes for diff output, making unprintable characters visible.
 
-    Replaces the shell pipeline `cat -te | head -22` with pure Python.
+    Replaces the shell pipeline `cat -te | head -22` with pure Python. Output that is only
+    printable ASCII and newlines, found with one bytes.translate, just gets its line ends
+    marked. Otherwise the bytes are decoded in one go, with undecodable bytes rendered as
+    \\xNN, and only control characters and runs of non-ASCII characters are looked at.
     """
-    result = []
-    i = 0
-    n = len(raw_bytes)
-
-    while i < n:
-        b = raw_bytes[i]
-
-        if b == 0x0A:  # newline
-            result.append("$\n")
-            i += 1
-        elif b == 0x20 or (0x21 <= b <= 0x7E):  # space or printable ASCII
-            result.append(chr(b))
-            i += 1
-        elif b <= 0x1F:  # control chars (except newline handled above)
-            result.append("^" + chr(b + 0x40))
-            i += 1
-        elif b == 0x7F:  # DEL
-            result.append("^?")
-            i += 1
-        elif b >= 0x80:
-            # Try to decode as UTF-8 multi-byte sequence
-            seq_len = 0
-            if (b & 0xE0) == 0xC0:
-                seq_len = 2
-            elif (b & 0xF0) == 0xE0:
-                seq_len = 3
-            elif (b & 0xF8) == 0xF0:
-                seq_len = 4
-
-            decoded_char = None
-            if seq_len >= 2 and i + seq_len <= n:
-                try:
-                    decoded_char = raw_bytes[i:i + seq_len].decode("utf-8")
-                except UnicodeDecodeError:
-                    pass
-
-            if decoded_char and len(decoded_char) == 1 and decoded_char.isprintable():
-                result.append(decoded_char)
-                i += seq_len
-            elif decoded_char and len(decoded_char) == 1:
-                # Valid UTF-8 but non-printable: render each byte as \xCC
-                for j in range(seq_len):
-                    result.append(f"\\x{raw_bytes[i + j]:02X}")
-                i += seq_len
-            else:
-                # Invalid UTF-8 byte
-                result.append(f"\\x{b:02X}")
-                i += 1
-        else:
-            result.append(chr(b))
-            i += 1
-
-    output = "".join(result)
+    if not raw_bytes.translate(None, _PLAIN_BYTES):
+        output = raw_bytes.decode("ascii").replace("\n", "$\n")
+    else:
+        text = raw_bytes.decode("utf-8", errors="codeval-render")
+        output = _CONTROL_CHAR.sub(lambda match: _CONTROL_CHARS[match.group()], text).replace("\n", "$\n")
+        if not output.isascii():
+            output = _NON_ASCII_RUN.sub(_render_non_ascii, output)
 
     # If output doesn't end with \n, append $ at the very end
     if output and not output.endswith("\n"):
@@ -1158,155 +1350,492 @@ def _find_touched_files(pre_run_timestamp):
     return touched
 
 
-def check_test():
-    global test_args
-    if test_args == "":
-        return
+@dataclasses.dataclass
+class _TestCase:
+    """Snapshot of everything needed to run a single T/HT test case."""
+    number: int
+    total: int
+    command: str
+    testing_dir: str
+    timeout: float
+    output_length_limit: int
+    output_cap: int
+    limits: ResourceLimits
+    expected_exit_code: int
+    cmps: list
+    hint: str
+    hidden: bool
+    input: bytes
+    expected_output: bytes
+    expected_error: bytes
+    # Set when --result-cache is used: the key of the outcome and of the files the test case ran with
+    cache_key: str | None = None
+    tree_key: str | None = None
+
+
+@dataclasses.dataclass
+class _TestResult:
+    """Outcome of a test case along with the lines it prints to the report."""
+    passed: bool
+    lines: list
+    strays: int = 0
+    usage: dict | None = None
+    result: dict | None = None
+    # False when running the test case again might not give the same outcome
+    cacheable: bool = True
+
+
+def _current_test_case(testing_dir=TESTING_DIR):
+    """Capture the test case described by the current globals."""
+    return _TestCase(
+        number=test_case_count,
+        total=test_case_total,
+        command=test_args,
+        testing_dir=testing_dir,
+        timeout=timeout_val,
+        output_length_limit=output_length_limit,
+        output_cap=output_cap,
+        limits=_current_limits(),
+        expected_exit_code=expected_exit_code,
+        cmps=[list(files) for files in cmps],
+        hint=test_case_hint,
+        hidden=test_case_hidden,
+        input=b"".join(test_input),
+        expected_output=b"".join(expected_output),
+        expected_error=b"".join(expected_error),
+    )
+
+
+def _execute_test_case(case):
+    """Run a test case and build its report.
+
+    stdin is fed from case.input and stdout/stderr are captured in memory and compared
+    in-process with the same report `diff -U1 -a` would print. The command is stopped as
+    soon as its output cannot match anymore (once the report has case.output_length_limit
+    bytes past the mismatch to show) or a stream grows past case.output_cap. The failure logs are only
+    written to case.testing_dir when the output does not match, so test cases with
+    different directories can run concurrently.
+
+    Arguments:
+        case: the _TestCase to run
 
-    print(f"Test case {test_case_count} of {test_case_total}")
+    Returns:
+        _TestResult with the pass/fail status and the lines to print
+    """
+    lines = [f"Test case {case.number} of {case.total}"]
     passed = True
 
+    def testing_path(filename):
+        return os.path.join(case.testing_dir, filename)
+
     # Record timestamp before running student code for file tracking
     pre_run_timestamp = time.time()
 
-    with open(get_testing_path("fileinput"), "rb") as fileinput, open(
-        get_testing_path("youroutput"), "w"
-    ) as youroutput, open(get_testing_path("yourerror"), "w") as yourerror:
-        test_exec = subprocess.Popen(
-            test_args, shell=True, stdin=fileinput, stdout=youroutput, stderr=yourerror
-        )
+    test_exec = run_with_pipes(
+        case.command, case.input, timeout=case.timeout,
+        expected_stdout=case.expected_output, expected_stderr=case.expected_error,
+        mismatch_slack=case.output_length_limit, output_cap=case.output_cap,
+        limits=case.limits, cgroup_parent=cgroup_parent,
+    )
 
-    # Timeout handling
-    try:
-        test_exec.communicate(timeout=timeout_val)
+    strays = test_exec.strays
+    usage = test_exec.usage
+    cacheable = not test_exec.timed_out and test_exec.limit is None and not strays
 
-    except subprocess.TimeoutExpired:
-        print(f"Took more than {timeout_val} seconds to run. FAIL")
+    # Timeout and early stop handling
+    if test_exec.timed_out:
+        lines.append(f"Took more than {case.timeout} seconds to run. FAIL")
+        passed = False
+    elif test_exec.stopped == STOPPED_MISMATCH:
+        lines.append("Stopped early because the output can no longer match. FAIL")
+        passed = False
+    elif test_exec.stopped == STOPPED_OUTPUT_CAP:
+        lines.append(f"Stopped after producing more than {case.output_cap} bytes of output. FAIL")
+        passed = False
+    elif test_exec.limit is not None:
+        lines.append(_limit_message(case.limits, test_exec.limit))
         passed = False
 
     # Find files touched by student's program
     touched_files = _find_touched_files(pre_run_timestamp)
 
-    # Difflog handling
-    with open(get_testing_path("difflog"), "w") as outfile:
-        diff_popen = subprocess.Popen(
-            ["diff", "-U1", "-a",
-             f"./{TESTING_DIR}/youroutput", f"./{TESTING_DIR}/expectedoutput"],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-        )
-        raw_output, _ = diff_popen.communicate()
-        outfile.write(_render_diff_output(raw_output[:output_length_limit]))
-
-    # Append to difflog second time around
-    with open(get_testing_path("difflog"), "a") as outfile:
-        diff_popen = subprocess.Popen(
-            ["diff", "-U1", "-a",
-             f"./{TESTING_DIR}/yourerror", f"./{TESTING_DIR}/expectederror"],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+    # Diff handling, stdout diff first then stderr diff; identical streams have an empty diff
+    rendered_diff = ""
+    for yours, captured, expected, expected_data in (
+            ("youroutput", test_exec.stdout, "expectedoutput", case.expected_output),
+            ("yourerror", test_exec.stderr, "expectederror", case.expected_error)):
+        if buffer_equals(captured, expected_data):
+            continue
+        raw_output = unified_diff(
+            read_buffer(captured), expected_data,
+            format_label(f"./{testing_path(yours)}"), format_label(f"./{testing_path(expected)}"),
+            limit=case.output_length_limit,
         )
-        raw_output, _ = diff_popen.communicate()
-        outfile.write(_render_diff_output(raw_output[:output_length_limit]))
+        rendered_diff += _render_diff_output(raw_output[:case.output_length_limit])
+    test_exec.close()
 
-    # Now read all the lines to accumulate both diffs
-    with open(get_testing_path("difflog"), "r") as infile:
-        diff_lines = infile.readlines()
+    diff_lines = io.StringIO(rendered_diff).readlines()
 
     if len(diff_lines):
         passed = False
-        parse_diff(diff_lines, TESTING_DIR)
+        parse_diff(diff_lines, case.testing_dir)
 
     # Exit code handling
-    if expected_exit_code != -1 and test_exec.returncode != expected_exit_code:
+    if case.expected_exit_code != -1 and test_exec.returncode != case.expected_exit_code:
         passed = False
-        print(
-            f"    Exit Code failure: expected {expected_exit_code} got {test_exec.returncode}"
-        )
-
-    # Compare files handling, do not surpress output
-    for files in cmps:
-        cmd_popen = subprocess.Popen(["cmp"] + files)
-        cmd_popen.communicate()
+        if test_exec.returncode is not None:
+            lines.append(
+                f"    Exit Code failure: expected {case.expected_exit_code} got {test_exec.returncode}"
+            )
+        else:
+            lines.append(
+                f"    Exit Code failure: expected {case.expected_exit_code}, but the test was killed "
+                f"because {_stop_reason(case, test_exec)}"
+            )
+
+    # Compare files handling, cmp's own message is part of the report
+    for files in case.cmps:
+        cmd_popen = subprocess.Popen(["cmp"] + files, stdout=subprocess.PIPE, text=True)
+        cmp_output, _ = cmd_popen.communicate()
+        if cmp_output:
+            lines.append(cmp_output.rstrip("\n"))
         if cmd_popen.returncode:
             passed = False
             break
 
+    # Everything reported after the test case header so far explains a failure
+    usage_record = _usage_record(case.number, case.command, passed, usage)
+    result_record = _result_record(case.number, "HT" if case.hidden else "T", case.command, passed,
+                                   case.hidden, case.hint, lines[1:], rendered_diff, usage)
+
     # Pass fail handling
     if passed:
+        lines.append("Passed")
+        return _TestResult(passed, lines, strays, usage_record, result_record, cacheable)
+
+    lines.append("FAILED")
+
+    # Hidden test case handling
+    if case.hidden:
+        lines.append("    Test Case is Hidden")
+        if case.hint:
+            lines.append(f"HINT: {case.hint}")
+        return _TestResult(passed, lines, strays, usage_record, result_record, cacheable)
+
+    if case.hint:
+        lines.append(f"HINT: {case.hint}")
+
+    lines.append(f"    Command ran: {case.command}")
+    eval_logs_dir = testing_path("evaluationLogs")
+    if os.path.exists(eval_logs_dir):
+        for file in os.listdir(eval_logs_dir):
+            with open(os.path.join(eval_logs_dir, file), "r") as infile:
+                file_lines = infile.readlines()
+
+            # Print entire file
+            lines.append("".join(file_lines))
+
+    # Show diffs for files touched by student's program
+    if touched_files and case.cmps:
+        expected_map = {}
+        for file_pair in case.cmps:
+            if len(file_pair) >= 2:
+                expected_map[os.path.normpath(file_pair[0])] = file_pair[1]
+
+        for filepath in touched_files:
+            normalized = os.path.normpath(filepath)
+            if normalized in expected_map:
+                expected_file = expected_map[normalized]
+                if os.path.exists(expected_file):
+                    with open(filepath, "rb") as infile:
+                        actual_data = infile.read()
+                    with open(expected_file, "rb") as infile:
+                        expected_data = infile.read()
+                    diff_output = unified_diff(
+                        actual_data, expected_data,
+                        format_label(filepath, os.stat(filepath).st_mtime_ns),
+                        format_label(expected_file, os.stat(expected_file).st_mtime_ns),
+                    ).decode("utf-8", errors="replace")
+                    if diff_output:
+                        lines.append(f"    File output diff ({os.path.basename(filepath)}):")
+                        diff_output_lines = diff_output.splitlines()
+                        for line in diff_output_lines[:22]:
+                            lines.append(f"    {line}")
+                        if len(diff_output_lines) > 22:
+                            lines.append(f"    ... ({len(diff_output_lines) - 22} more lines)")
+
+    return _TestResult(passed, lines, strays, usage_record, result_record, cacheable)
+
+
+def _usage_record(number, command, passed, usage):
+    """Return the resource usage of a test case as it is written to the usage file."""
+    return {"test_case": number, "command": command, "passed": passed, **dataclasses.asdict(usage)}
+
+
+def _result_record(number, tag, command, passed, hidden, hint, failures, diff, usage):
+    """Return the outcome of a test case as it is written to the results file.
+
+    failures are the report lines that explain a failure, diff is the rendered stdout/stderr
+    diff, already cut off at the OLEN limit.
+    """
+    return {
+        "test_case": number,
+        "tag": tag,
+        "command": command,
+        "status": "passed" if passed else "failed",
+        "hidden": hidden,
+        "hint": hint,
+        "wall_time": usage.wall_time,
+        "failures": failures,
+        "diff": diff,
+    }
+
+
+def _write_results_file(path, codeval_file):
+    """Write the outcome of the test cases that ran as JSON.
+
+    status is "passed" only when every test case of the spec ran and passed; a compile
+    failure or a failed test case stops the evaluation before the remaining ones run.
+    """
+    passed = sum(1 for record in test_results if record["status"] == "passed")
+    complete = passed == len(test_results) == test_case_total
+    results = {
+        "codeval_file": codeval_file,
+        "status": "passed" if complete else "failed",
+        "test_case_total": test_case_total,
+        "passed": passed,
+        "failed": len(test_results) - passed,
+        "tests": test_results,
+    }
+    if compile_cache is not None:
+        results["compile_cache"] = {"hits": compile_cache_hits, "misses": compile_cache_misses}
+    if result_cache is not None:
+        results["result_cache"] = {"hits": result_cache_hits, "misses": result_cache_misses}
+    if shard is not None:
+        results["shard"] = f"{shard[0]}/{shard[1]}"
+    with open(path, "w") as outfile:
+        json.dump(results, outfile, indent=2)
+
+
+def _write_timings_file(path, codeval_file, total):
+    """Write the seconds spent in each phase of the evaluation, and in all of it, as JSON."""
+    with open(path, "w") as outfile:
+        json.dump({"codeval_file": codeval_file, "total": total, "phases": phase_times}, outfile, indent=2)
+
+
+def _print_usage_trailer():
+    """Print the resource usage of each test case, and the totals."""
+    def describe(record):
+        # At or below the floor, the peak RSS is only known to be at most that much
+        at_most = "<= " if record["max_rss_kb"] <= record["rss_floor_kb"] else ""
+        return (f"wall {record['wall_time']:.3f}s, user {record['user_time']:.3f}s, "
+                f"sys {record['system_time']:.3f}s, peak RSS {at_most}{record['max_rss_kb']} KiB, "
+                f"output {record['stdout_bytes'] + record['stderr_bytes']} bytes")
+
+    print("Resource usage:")
+    for record in test_usage:
+        print(f"  Test case {record['test_case']}: {describe(record)}")
+    print(f"  Total: {describe(_usage_total())}")
+
+
+def _usage_total():
+    """Sum up the resource usage of all test cases; peak RSS is the largest one."""
+    total = dataclasses.asdict(ResourceUsage())
+    for record in test_usage:
+        for key in total:
+            if key in ("max_rss_kb", "rss_floor_kb"):
+                total[key] = max(total[key], record[key])
+            else:
+                total[key] += record[key]
+    return total
+
+
+def _write_usage_file(path, codeval_file):
+    """Write the resource usage of the test cases as JSON."""
+    with open(path, "w") as outfile:
+        json.dump({"codeval_file": codeval_file, "tests": test_usage, "total": _usage_total()},
+                  outfile, indent=2)
+
+
+def _cached_test_result(case):
+    """Look up the outcome of a test case in the result cache.
+
+    Sets case.cache_key and case.tree_key, so the outcome can be stored once the test case ran.
+
+    Returns:
+        the replayed _TestResult, marked as cached in its records, None if it has to run
+    """
+    global result_cache_hits, result_cache_misses
+    if result_cache is None:
+        return None
+    case.tree_key = result_cache.tree_key(exclude=compile_cache_exclude)
+    case.cache_key = result_cache.key(case.tree_key, case_fields(case))
+    entry = result_cache.lookup(case.cache_key)
+    result_cache.record(case.cache_key, entry is not None)
+    if entry is None:
+        result_cache_misses += 1
+        return None
+    result_cache_hits += 1
+    entry = _relocate(entry, _CACHED_TESTING_DIR, case.testing_dir)
+    return _TestResult(entry["passed"], [f"Test case {case.number} of {case.total}"] + entry["lines"],
+                       usage={**entry["usage"], "test_case": case.number, "cached": True},
+                       result={**entry["result"], "test_case": case.number, "cached": True})
+
+
+# Stands for the testing directory of a test case in stored outcomes, which differs with --jobs
+_CACHED_TESTING_DIR = "\0testing_dir\0"
+
+
+def _relocate(value, old, new):
+    """Return value with old replaced by new in every string of it, through lists and dicts."""
+    if isinstance(value, str):
+        return value.replace(old, new)
+    if isinstance(value, list):
+        return [_relocate(item, old, new) for item in value]
+    if isinstance(value, dict):
+        return {key: _relocate(item, old, new) for key, item in value.items()}
+    return value
+
+
+def _store_test_result(case, result):
+    """Store the outcome of a test case that ran in the result cache, if running it again gives the same outcome.
+
+    Must be called after the test case's TEMP files are removed, since the outcome is only
+    stored if the working directory is as the test case found it.
+    """
+    if case.cache_key is None or not result.cacheable or \
+            result_cache.tree_key(exclude=compile_cache_exclude) != case.tree_key:
+        return
+    result_cache.store(case.cache_key, _relocate({"passed": result.passed, "lines": result.lines[1:],
+                                                  "usage": result.usage, "result": result.result},
+                                                 case.testing_dir, _CACHED_TESTING_DIR))
+
+
+def _report_test_result(result):
+    """Print a test case report and update the pass/fail counters."""
+    for line in result.lines:
+        print(line)
+    _record_strays(result.strays)
+    if result.usage is not None:
+        test_usage.append(result.usage)
+    if result.result is not None:
+        test_results.append(result.result)
+
+    if result.passed:
         global num_passed
         num_passed += 1
-        print("Passed")
     else:
         global num_failed
         num_failed += 1
-        print("FAILED")
 
-        # Hidden test case handling
-        if test_case_hidden:
-            print("    Test Case is Hidden")
-            if test_case_hint:
-                print(f"HINT: {test_case_hint}")
-        else:
-            if test_case_hint:
-                print(f"HINT: {test_case_hint}")
-
-            # Cleanup
-            print(f"    Command ran: {test_args}")
-            eval_logs_dir = get_testing_path("evaluationLogs")
-            if os.path.exists(eval_logs_dir):
-                for file in os.listdir(eval_logs_dir):
-                    with open(os.path.join(eval_logs_dir, file), "r") as infile:
-                        file_lines = infile.readlines()
-
-                    # Print entire file
-                    print("".join(file_lines))
-
-            # Show diffs for files touched by student's program
-            if touched_files and cmps:
-                expected_map = {}
-                for file_pair in cmps:
-                    if len(file_pair) >= 2:
-                        expected_map[os.path.normpath(file_pair[0])] = file_pair[1]
-
-                for filepath in touched_files:
-                    normalized = os.path.normpath(filepath)
-                    if normalized in expected_map:
-                        expected_file = expected_map[normalized]
-                        if os.path.exists(expected_file):
-                            diff_proc = subprocess.Popen(
-                                ["diff", "-U1", "-a", filepath, expected_file],
-                                stdout=subprocess.PIPE,
-                                stderr=subprocess.PIPE,
-                                text=True,
-                            )
-                            diff_output, _ = diff_proc.communicate()
-                            if diff_output:
-                                print(f"    File output diff ({os.path.basename(filepath)}):")
-                                lines = diff_output.splitlines()
-                                for line in lines[:22]:
-                                    print(f"    {line}")
-                                if len(lines) > 22:
-                                    print(f"    ... ({len(lines) - 22} more lines)")
 
+def _run_isolated_test_case(case):
+    """Worker entry point for parallel mode: run the test, then drop its scratch directory."""
+    try:
+        return _execute_test_case(case)
+    finally:
+        shutil.rmtree(case.testing_dir, ignore_errors=True)
+
+
+def _submit_test_case(case):
+    """Hand a test case to the worker pool, or replay it from the result cache."""
+    result = _cached_test_result(case)
+    if result is None:
+        future = _test_executor.submit(_run_isolated_test_case, case)
+    else:
+        shutil.rmtree(case.testing_dir, ignore_errors=True)
+        future = Future()
+        future.set_result(result)
+    _pending_tests.append((case, future))
+
+
+def _drain_pending_tests():
+    """Wait for every submitted test case and report them in spec order.
+
+    Stops at the first failed test case, just like the serial path does, unless
+    run-evaluation was started with --keep-going.
+    """
+    global _pending_tests
+    pending, _pending_tests = _pending_tests, []
+    for index, (case, future) in enumerate(pending):
+        with _timed("tests"):
+            result = future.result()
+        _report_test_result(result)
+        if not result.result.get("cached"):
+            _store_test_result(case, result)
+        if not result.passed and not keep_going:
+            _test_executor.shutdown(wait=True, cancel_futures=True)
+            for skipped_case, _ in pending[index + 1:]:
+                shutil.rmtree(skipped_case.testing_dir, ignore_errors=True)
+            cleanup()
+
+            # Exit program after failed test case
+            _stop_at_failed_test_case(case.number)
+            sys.exit(2)
+
+
+def check_test(barrier=True):
+    """Run the test case collected so far, if any.
+
+    When run-evaluation was started with --jobs > 1, test cases that do not share
+    files with other tests (no CMP or TEMP) are handed to a worker pool instead.
+    Every caller except the T/HT tags is a barrier: pending test cases are drained
+    and reported before the caller's own side effects happen.
+
+    Arguments:
+        barrier: wait for all pending parallel test cases before returning
+
+    Returns:
+        None
+    """
+    if test_args != "" and not _owns_test_case(test_case_count):
+        # another shard runs this test case
         _post_test_temp_cleanup()
+        _reset_test_state()
+
+    if test_args != "" and _test_executor is not None and not cmps and not _active_temp_files:
+        _submit_test_case(_current_test_case(get_testing_path(f"case-{test_case_count}")))
+        _reset_test_state()
+
+    if barrier:
+        _drain_pending_tests()
+
+    if test_args == "":
+        return
+
+    case = _current_test_case()
+    result = _cached_test_result(case)
+    if result is None:
+        with _timed("tests"):
+            result = _execute_test_case(case)
+        _post_test_temp_cleanup()
+        _store_test_result(case, result)
+    else:
+        _post_test_temp_cleanup()
+    _report_test_result(result)
+
+    if not result.passed:
         cleanup()
 
         # Exit program after failed test case
-        sys.exit(2)
+        if not keep_going:
+            _stop_at_failed_test_case(case.number)
+            sys.exit(2)
+        # the tags after it still write into the testing directory cleanup may have removed
+        os.makedirs(TESTING_DIR, exist_ok=True)
 
-    # reinitialize test variables and files here
-    _post_test_temp_cleanup()
-    setup()
+    # reinitialize test variables here
+    _reset_test_state()
 
 
 def cleanup():
     global test_args
     test_args = ""
+    # Files written when reporting a failed test case or a compile
     files = [
         "compilelog",
-        "difflog",
         "expectedoutput",
         "expectederror",
-        "fileinput",
         "yourerror",
         "youroutput",
     ]
@@ -1328,11 +1857,87 @@ def cleanup():
         os.rmdir(TESTING_DIR)
 
 
+def _parse_shard_option(ctx, param, value):
+    """Click callback turning --shard I/N into (I, N)."""
+    if value is None:
+        return None
+    try:
+        return parse_shard(value)
+    except ValueError as e:
+        raise click.BadParameter(str(e))
+
+
 @click.command()
 @click.argument("codeval_file", type=click.Path(exists=True))
-def run_evaluation(codeval_file):
+@click.option("--jobs", "-j", type=click.IntRange(min=1), default=1, show_default=True,
+              help="number of independent test cases to run concurrently")
+@click.option("--output-cap", "max_output", type=click.IntRange(min=1), default=output_cap, show_default=True,
+              help="bytes of stdout or stderr a test may produce before it is stopped")
+@click.option("--keep-going", "-k", "keep_going_", is_flag=True,
+              help="run the remaining test cases after one fails and report the totals at the end")
+@click.option("--show-usage", is_flag=True,
+              help="print the wall time, CPU time, peak RSS and output size of each test at the end")
+@click.option("--usage-file", type=click.Path(dir_okay=False, writable=True),
+              help="write the resource usage of each test as JSON to this file")
+@click.option("--results-file", type=click.Path(dir_okay=False, writable=True),
+              help="write the status, timing, hint and diff of each test as JSON to this file")
+@click.option("--timings-file", type=click.Path(dir_okay=False, writable=True),
+              help="write the seconds spent in each phase of the evaluation as JSON to this file")
+@click.option("--compile-cache", "compile_cache_dir", envvar="CODEVAL_COMPILE_CACHE",
+              type=click.Path(file_okay=False),
+              help="directory of a cache of compile results; a C command whose inputs and toolchain "
+                   "were compiled before restores the files it produced instead of running")
+@click.option("--result-cache", "result_cache_dir", envvar="CODEVAL_RESULT_CACHE",
+              type=click.Path(file_okay=False),
+              help="directory of a cache of test case outcomes; a test case that ran before with the same "
+                   "files, command, input, expected output and limits is replayed instead of run")
+@click.option("--cgroup", "cgroup_dir", envvar="CODEVAL_CGROUP", type=click.Path(exists=True, file_okay=False),
+              help="cgroup v2 directory delegated to the evaluation; MEM and NPROC limits then use a "
+                   "transient cgroup per test instead of rlimits")
+@click.option("--shard", "shard_", callback=_parse_shard_option, metavar="I/N",
+              help="run only the test cases of shard I of N; combine the outputs with merge-shards")
+def run_evaluation(codeval_file, jobs, max_output, keep_going_, show_usage, usage_file, results_file, timings_file,
+                   compile_cache_dir, result_cache_dir, cgroup_dir, shard_):
     """
     This command should be run in the docker container, so it is not usually run directly.
+
+    With --jobs N, test cases that do not use CMP or TEMP run concurrently, each with its own
+    scratch directory under .testing. Results are still reported in spec order.
+
+    The evaluation stops at the first failed test case and exits with 2 (1 for TCMD). With
+    --keep-going every test case runs, the number of passed and failed test cases is
+    printed at the end, and the exit code is 2 if any of them failed.
+
+    A test is stopped as soon as its output can no longer match the expected output, or once
+    it writes more than --output-cap bytes to stdout or stderr, and is reported as failed.
+
+    The resource usage of every test (wall time, user/system CPU time and peak RSS of the
+    test's processes, bytes of output) is printed with --show-usage and written as JSON
+    with --usage-file, also when a test fails. --results-file writes the outcome of each test
+    that ran (status, wall time, hidden flag, hint, failure lines and the truncated diff)
+    as JSON for the tools that process the evaluation afterwards. --timings-file writes the
+    seconds spent loading the plan, compiling, running tests, checking functions and objects,
+    running commands and processing the rest of the spec, for benchmark-evaluation.
+
+    With --compile-cache, the files a successful C command produced are stored under a key
+    made of the command, the toolchain version and the content of its inputs, and restored
+    the next time the same key comes up; the hits and misses go to the results file.
+
+    With --result-cache, the outcome of a test case is stored under a key made of the
+    content of the working directory and everything the test case is made of (command,
+    input, expected output, exit code and limits), and replayed the next time the same key
+    comes up. Replayed test cases print the same report and are marked "cached" in the
+    results and usage files. Test cases that time out, hit a limit, leave processes behind
+    or change files in the working directory always run.
+
+    MEM, CPU and NPROC limits are enforced with rlimits in each test command, or for MEM
+    and NPROC with a transient cgroup per test under --cgroup, and a test that runs into
+    one is reported with the limit it exceeded.
+
+    With --shard I/N only every Nth test case, starting with test case I, is run, along
+    with the C, CMD and SS lines every shard needs. Each shard prints a marker line where it
+    stopped; merge-shards combines the outputs of all N shards into the output of one
+    evaluation, with the test cases in spec order.
     """
     start_time_seconds = time.time()
 
@@ -1341,30 +1946,73 @@ def run_evaluation(codeval_file):
     sys.stderr.reconfigure(line_buffering=True)
 
     setup()
-
-    # Count test case total
+    global output_cap, test_usage, test_results, cgroup_parent, keep_going, num_passed, num_failed
+    global shard, failed_test_case
+    shard = shard_
+    failed_test_case = None
+    output_cap = max_output
+    keep_going = keep_going_
+    num_passed = num_failed = 0
+    cgroup_parent = cgroup_dir
+    test_usage = []
+    test_results = []
+    phase_times.clear()
+
+    # The compiled plan is cached next to the spec, so the spec is only parsed once
+    with _timed("plan"):
+        plan = load_spec_plan(codeval_file, tag_func_map.keys())
     global test_case_total
-    with open(codeval_file, "r") as infile:
-        testcases = infile.readlines()
-        in_crt_hw_block = False
-        for testcase in testcases:
-            stripped = testcase.strip()
-            if stripped.startswith("CRT_HW") or stripped.startswith("ASSIGNMENT START") or stripped.startswith("ASSIGNMENT END"):
-                in_crt_hw_block = not in_crt_hw_block
-                continue
-            if in_crt_hw_block:
-                continue
-            parts = testcase.split(" ", 1)
-            tag = parts[0]
-            if tag == "T" or tag == "HT" or tag == "TCMD":
-                test_case_total += 1
-
-    # Read testcases
-    with open(codeval_file, "r") as infile:
-        testcases = infile.readlines()
-        parse_tags(testcases)
-
-    check_test()
-
+    test_case_total = plan.test_case_total
+
+    global compile_cache, compile_cache_exclude, compile_cache_hits, compile_cache_misses
+    compile_cache = CompileCache(compile_cache_dir) if compile_cache_dir else None
+    compile_cache_hits = compile_cache_misses = 0
+    # The spec and the test data files are copied next to the sources, but are not compiled
+    compile_cache_exclude = [TESTING_DIR, os.path.relpath(codeval_file),
+                             os.path.relpath(plan_path_for(codeval_file))]
+    for test in plan.tests:
+        for source, value in test.input + test.expected_output:
+            if source == "file":
+                compile_cache_exclude.append(os.path.normpath(value))
+
+    global result_cache, result_cache_hits, result_cache_misses
+    result_cache = ResultCache(result_cache_dir) if result_cache_dir else None
+    result_cache_hits = result_cache_misses = 0
+
+    global _test_executor, _pending_tests
+    if jobs > 1:
+        _test_executor = ThreadPoolExecutor(max_workers=jobs)
+    status = 0
+    try:
+        run_plan(plan)
+        check_test()
+    except SystemExit as e:
+        status = e.code or 0
+        raise
+    finally:
+        if _test_executor is not None:
+            _test_executor.shutdown(wait=True, cancel_futures=True)
+            _test_executor = None
+            _pending_tests = []
+        for server in list(_servers):
+            _stop_server(server)
+        if stray_processes:
+            print(f"Killed {stray_processes} stray processes left running by tests")
+        if shard is not None:
+            stopped_at = failed_test_case if status and failed_test_case is not None else test_case_count
+            print(marker_line(shard[0], shard[1], stopped_at, test_case_total, status))
+        if show_usage:
+            _print_usage_trailer()
+        if usage_file:
+            _write_usage_file(usage_file, codeval_file)
+        if results_file:
+            _write_results_file(results_file, codeval_file)
+        if timings_file:
+            _write_timings_file(timings_file, codeval_file, time.time() - start_time_seconds)
+
+    if keep_going:
+        print(f"Passed {num_passed} of {test_case_total} test cases, {num_failed} failed")
     end_time_seconds = time.time()
     print(f"took {end_time_seconds - start_time_seconds} seconds")
+    if keep_going and num_failed:
+        sys.exit(2)
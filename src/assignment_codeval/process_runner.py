@@ -0,0 +1,583 @@
+"""Run student commands with in-memory stdin/stdout/stderr.
+
+stdin is fed from memory and stdout/stderr are drained through pipes into spooled buffers
+that stay in memory up to SPOOL_THRESHOLD bytes and only then roll over to a temp file.
+When the expected output is known, the streams are checked as they arrive so that a
+command whose output can no longer match is stopped right away.
+
+Every command runs in its own session (and so its own process group), and the whole group
+is killed when the command finishes or times out, so processes forked by a student program
+cannot keep running into later tests. Commands are reaped with wait4 so their resource
+usage, including the children they waited for, is reported along with the result.
+
+ResourceLimits are applied by the shell that runs the command, before the command starts:
+it sets its own rlimits with prlimit (or a short Python script where prlimit is missing),
+which the command inherits. Nothing runs between fork and exec, which is not safe while
+other threads run test cases (--jobs). When a cgroup v2 directory is given, each command
+also gets a transient child cgroup there, which the shell moves itself into first, so the
+memory and process limits cover the whole process group and the cgroup's event counters
+tell when a command ran into them. Without a cgroup, a command that failed is taken to have
+run into a limit from how it failed: killed by SIGXCPU (or by SIGKILL after using up its CPU
+rlimit), or with an out of memory or cannot fork error at the end of its stderr.
+"""
+import dataclasses
+import itertools
+import math
+import os
+import resource
+import select
+import selectors
+import shlex
+import shutil
+import signal
+import subprocess
+import sys
+import time
+from tempfile import SpooledTemporaryFile
+
+# Captured output stays in memory up to this many bytes per stream
+SPOOL_THRESHOLD = 1024 * 1024
+
+_READ_SIZE = 32768
+# Seconds between checks whether the command itself has exited
+_POLL_INTERVAL = 0.05
+
+# Reasons a command was stopped before it finished
+STOPPED_MISMATCH = "mismatch"
+STOPPED_OUTPUT_CAP = "output_cap"
+
+# Resource limits a command can run into
+LIMIT_MEMORY = "memory"
+LIMIT_CPU = "cpu"
+LIMIT_PROCESSES = "processes"
+
+# What programs print when an allocation fails under RLIMIT_AS (ENOMEM)
+_OUT_OF_MEMORY_ERRORS = (b"MemoryError", b"std::bad_alloc", b"OutOfMemoryError", b"Cannot allocate memory",
+                         b"out of memory", b"Could not reserve enough space")
+# What programs print when fork fails under RLIMIT_NPROC (EAGAIN)
+_CANNOT_FORK_ERRORS = (b"Resource temporarily unavailable", b"unable to create native thread")
+# Bytes at the end of stderr searched for those errors
+_ERROR_TAIL = 65536
+
+
+@dataclasses.dataclass
+class ResourceLimits:
+    """Limits applied to a command and the processes it starts; None means no limit.
+
+    Without a cgroup, memory_mb caps the address space of each process and processes is
+    RLIMIT_NPROC, which counts all processes of the user (and does not apply to root).
+    In a cgroup both cover the command's processes together. cpu_seconds always caps the
+    CPU time of each process; the process gets SIGXCPU and then SIGKILL a second later.
+    """
+    memory_mb: int | None = None
+    cpu_seconds: float | None = None
+    processes: int | None = None
+
+    def __bool__(self):
+        return any(value is not None for value in dataclasses.astuple(self))
+
+
+@dataclasses.dataclass
+class ResourceUsage:
+    """Resources used by a command and the children it waited for.
+
+    Linux carries the peak RSS of a process across fork and exec, so a command started by
+    the evaluator reports at least the evaluator's own peak. rss_floor_kb records that peak;
+    a max_rss_kb that does not exceed it only tells that the command stayed below it.
+    """
+    wall_time: float = 0.0
+    user_time: float = 0.0
+    system_time: float = 0.0
+    # Peak resident set size of the largest process, in KiB
+    max_rss_kb: int = 0
+    rss_floor_kb: int = 0
+    stdout_bytes: int = 0
+    stderr_bytes: int = 0
+
+
+@dataclasses.dataclass
+class ProcessResult:
+    """Outcome of run_with_pipes and run_supervised.
+
+    returncode is None when the process did not finish within the timeout or was stopped
+    early; stopped then tells why (STOPPED_MISMATCH or STOPPED_OUTPUT_CAP). strays counts
+    the processes the command left behind in its process group that had to be killed.
+    stdout/stderr are None when the output was not captured. limit is the ResourceLimits
+    limit (LIMIT_MEMORY, LIMIT_CPU or LIMIT_PROCESSES) the command was seen running into.
+    """
+    returncode: int | None
+    stdout: SpooledTemporaryFile | None
+    stderr: SpooledTemporaryFile | None
+    timed_out: bool = False
+    stopped: str | None = None
+    strays: int = 0
+    usage: ResourceUsage = dataclasses.field(default_factory=ResourceUsage)
+    limit: str | None = None
+
+    def close(self):
+        for buffer in (self.stdout, self.stderr):
+            if buffer is not None:
+                buffer.close()
+
+
+def read_buffer(buffer) -> bytes:
+    """Return the full content of a captured stream."""
+    buffer.seek(0)
+    return buffer.read()
+
+
+def buffer_size(buffer) -> int:
+    """Return the number of bytes captured in a stream."""
+    return buffer.seek(0, os.SEEK_END)
+
+
+def buffer_equals(buffer, expected: bytes) -> bool:
+    """Compare a captured stream with expected bytes without loading a large buffer at once."""
+    if buffer_size(buffer) != len(expected):
+        return False
+    buffer.seek(0)
+    offset = 0
+    while offset < len(expected):
+        chunk = buffer.read(_READ_SIZE)
+        if chunk != expected[offset:offset + len(chunk)]:
+            return False
+        offset += len(chunk)
+    return True
+
+
+def _group_members(pgid):
+    """Return the pids of the live processes in process group pgid."""
+    members = []
+    try:
+        pids = [int(name) for name in os.listdir("/proc") if name.isdigit()]
+    except OSError:
+        # No /proc: only tell whether the group still exists
+        try:
+            os.killpg(pgid, 0)
+        except (ProcessLookupError, PermissionError):
+            return []
+        return [pgid]
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat", "rb") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # The command name is in parentheses and may contain spaces
+        fields = stat[stat.rfind(b")") + 2:].split()
+        if len(fields) > 2 and fields[0] != b"Z" and int(fields[2]) == pgid:
+            members.append(pid)
+    return members
+
+
+def kill_process_group(pgid, leader=None):
+    """Kill every process in process group pgid.
+
+    Arguments:
+        pgid: the process group, the pid of a process started with start_new_session=True
+        leader: pid of the process the group was started for; it is not counted as a stray
+
+    Returns:
+        the number of other processes that were still running in the group
+    """
+    strays = len([pid for pid in _group_members(pgid) if pid != leader])
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+    return strays
+
+
+def stop_process_group(proc, grace=1.0):
+    """Stop a process started with start_new_session=True and everything in its group.
+
+    The group gets SIGTERM, so a server can shut down cleanly, and SIGKILL once proc has
+    not exited within grace seconds (or right after it exited, for what it left behind).
+
+    Returns:
+        the number of other processes that were still running in the group
+    """
+    strays = len([pid for pid in _group_members(proc.pid) if pid != proc.pid])
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except (ProcessLookupError, PermissionError):
+        pass
+    try:
+        proc.wait(timeout=grace)
+    except subprocess.TimeoutExpired:
+        pass
+    kill_process_group(proc.pid)
+    proc.wait()
+    return strays
+
+
+def _reap(proc, block):
+    """Collect proc's exit status with wait4.
+
+    Returns:
+        the resource usage of proc, None if it has not exited yet and block is False
+    """
+    pid, status, rusage = os.wait4(proc.pid, 0 if block else os.WNOHANG)
+    if pid == 0:
+        return None
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    return rusage
+
+
+def _wait(proc, timeout):
+    """Like _reap(proc, True), but give up and return None after timeout seconds."""
+    if timeout is None:
+        return _reap(proc, True)
+    deadline = time.monotonic() + timeout
+    delay = 0.0005
+    while (rusage := _reap(proc, False)) is None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return None
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, _POLL_INTERVAL)
+    return rusage
+
+
+def _max_rss_kb(rusage):
+    if sys.platform == "darwin":
+        # reported in bytes instead of KiB
+        return rusage.ru_maxrss // 1024
+    return rusage.ru_maxrss
+
+
+def _rss_floor():
+    """Return the peak RSS a process started now inherits from this one."""
+    return _max_rss_kb(resource.getrusage(resource.RUSAGE_SELF))
+
+
+def _usage(rusage, rss_floor, wall_time, stdout_bytes=0, stderr_bytes=0):
+    return ResourceUsage(wall_time, rusage.ru_utime, rusage.ru_stime, _max_rss_kb(rusage),
+                         rss_floor, stdout_bytes, stderr_bytes)
+
+
+class _Cgroup:
+    """A transient cgroup v2 child of parent that holds a single command."""
+
+    _count = itertools.count()
+
+    def __init__(self, parent, limits):
+        self.path = os.path.join(parent, f"codeval-{os.getpid()}-{next(self._count)}")
+        os.mkdir(self.path)
+        try:
+            if limits.memory_mb is not None:
+                self._write("memory.max", limits.memory_mb * 1024 * 1024)
+                # Without swap, going over memory.max ends in the OOM killer instead of paging
+                if os.path.exists(os.path.join(self.path, "memory.swap.max")):
+                    self._write("memory.swap.max", 0)
+            if limits.processes is not None:
+                self._write("pids.max", limits.processes)
+        except OSError:
+            self.remove()
+            raise
+
+    def _write(self, name, value):
+        with open(os.path.join(self.path, name), "w") as f:
+            f.write(f"{value}\n")
+
+    def enter_command(self):
+        """Return the shell command that moves the shell running it into the cgroup."""
+        return f"echo 0 > {shlex.quote(os.path.join(self.path, 'cgroup.procs'))}"
+
+    def _events(self, name):
+        try:
+            with open(os.path.join(self.path, name)) as f:
+                return {key: int(value) for key, value in (line.split() for line in f if line.strip())}
+        except (OSError, ValueError):
+            return {}
+
+    def limit_hit(self):
+        """Return the limit the processes in the cgroup ran into, if any."""
+        if self._events("memory.events").get("oom_kill", 0):
+            return LIMIT_MEMORY
+        if self._events("pids.events").get("max", 0):
+            return LIMIT_PROCESSES
+        return None
+
+    def remove(self):
+        # Killed processes leave the cgroup only once they are reaped, which may take a moment
+        for _ in range(50):
+            try:
+                os.rmdir(self.path)
+                return
+            except FileNotFoundError:
+                return
+            except OSError:
+                time.sleep(0.01)
+
+
+# Sets rlimits of the process argv[1] to the (resource, soft, hard) triples that follow
+_PRLIMIT_SCRIPT = ("import resource, sys; args = [int(arg) for arg in sys.argv[1:]]; "
+                   "[resource.prlimit(args[0], args[i], (args[i + 1], args[i + 2])) for i in range(1, len(args), 3)]")
+
+_PRLIMIT_OPTIONS = {resource.RLIMIT_CPU: "cpu", resource.RLIMIT_AS: "as", resource.RLIMIT_NPROC: "nproc"}
+
+
+def _cpu_rlimit(limits):
+    """Return the soft RLIMIT_CPU for limits.cpu_seconds; the hard limit is a second more."""
+    return max(math.ceil(limits.cpu_seconds), 1)
+
+
+def _limit_prefix(limits, cgroup):
+    """Return the shell lines that apply limits to the shell running the command, "" if there is nothing to do.
+
+    Each line exits with 126 (cannot execute) if it fails, so a command never runs without
+    its limits.
+    """
+    rlimits = []
+    if limits.cpu_seconds is not None:
+        seconds = _cpu_rlimit(limits)
+        rlimits.append((resource.RLIMIT_CPU, seconds, seconds + 1))
+    if limits.memory_mb is not None and cgroup is None:
+        size = limits.memory_mb * 1024 * 1024
+        rlimits.append((resource.RLIMIT_AS, size, size))
+    if limits.processes is not None and cgroup is None:
+        rlimits.append((resource.RLIMIT_NPROC, limits.processes, limits.processes))
+
+    lines = []
+    if cgroup is not None:
+        lines.append(cgroup.enter_command())
+    if rlimits:
+        prlimit = shutil.which("prlimit")
+        if prlimit is not None:
+            lines.append(f"{shlex.quote(prlimit)} --pid $$ " +
+                         " ".join(f"--{_PRLIMIT_OPTIONS[which]}={soft}:{hard}" for which, soft, hard in rlimits))
+        else:
+            lines.append(f"{shlex.quote(sys.executable)} -S -c {shlex.quote(_PRLIMIT_SCRIPT)} $$ " +
+                         " ".join(f"{which} {soft} {hard}" for which, soft, hard in rlimits))
+    return "".join(f"{line} || exit 126\n" for line in lines)
+
+
+def _start(command, limits, cgroup_parent, **kwargs):
+    """Start command in its own session with limits applied.
+
+    Returns:
+        the Popen object and the _Cgroup it runs in, None when it does not run in one
+    """
+    cgroup = None
+    if limits and cgroup_parent is not None and (limits.memory_mb is not None or limits.processes is not None):
+        try:
+            cgroup = _Cgroup(cgroup_parent, limits)
+        except OSError:
+            # Not delegated to us after all; the rlimits still apply
+            cgroup = None
+    if limits:
+        command = _limit_prefix(limits, cgroup) + command
+    try:
+        proc = subprocess.Popen(command, shell=True, start_new_session=True, **kwargs)
+    except BaseException:
+        if cgroup is not None:
+            cgroup.remove()
+        raise
+    return proc, cgroup
+
+
+def _killed_by(returncode, signum):
+    """Tell whether a shell command's returncode means it was killed by signum.
+
+    -signum when the command itself was killed, 128 + signum when the shell reports it.
+    """
+    return returncode in (-signum, 128 + signum)
+
+
+def _stderr_tail(stderr):
+    """Return the last _ERROR_TAIL bytes of a captured stderr, b"" if it was not captured."""
+    if stderr is None:
+        return b""
+    stderr.seek(max(buffer_size(stderr) - _ERROR_TAIL, 0))
+    return stderr.read()
+
+
+def _limit_hit(limits, cgroup, returncode, usage, stderr=None):
+    """Tell which of limits a finished command ran into, None if none or it cannot tell.
+
+    In a cgroup, its memory and pids events tell. Otherwise the CPU rlimit sends SIGXCPU,
+    then SIGKILL a second later, and an exceeded memory or process rlimit only makes
+    allocations or forks fail, so the command's stderr is searched for the error it printed.
+    """
+    if not limits or returncode is None:
+        return None
+    if cgroup is not None and (hit := cgroup.limit_hit()) is not None:
+        return hit
+    if returncode == 0:
+        return None
+    if limits.cpu_seconds is not None:
+        if _killed_by(returncode, signal.SIGXCPU) or (
+                _killed_by(returncode, signal.SIGKILL)
+                and usage.user_time + usage.system_time >= _cpu_rlimit(limits)):
+            return LIMIT_CPU
+    if cgroup is None and (limits.memory_mb is not None or limits.processes is not None):
+        tail = _stderr_tail(stderr)
+        if limits.memory_mb is not None and any(error in tail for error in _OUT_OF_MEMORY_ERRORS):
+            return LIMIT_MEMORY
+        if limits.processes is not None and any(error in tail for error in _CANNOT_FORK_ERRORS):
+            return LIMIT_PROCESSES
+    return None
+
+
+def run_supervised(command, limits=None, cgroup_parent=None, **kwargs):
+    """Run a shell command in its own process group and wait for it; output is not captured.
+
+    Arguments:
+        command: the shell command to run
+        limits: ResourceLimits for the command, None for no limits
+        cgroup_parent: cgroup v2 directory to create the command's cgroup in, None for rlimits only
+        kwargs: passed on to subprocess.Popen
+
+    Returns:
+        ProcessResult without stdout/stderr
+    """
+    start = time.monotonic()
+    proc, cgroup = _start(command, limits, cgroup_parent, **kwargs)
+    # Measured after the fork, so it is at least what the command inherited
+    rss_floor = _rss_floor()
+    try:
+        rusage = _reap(proc, True)
+    finally:
+        strays = kill_process_group(proc.pid, proc.pid)
+    usage = _usage(rusage, rss_floor, time.monotonic() - start)
+    limit = _limit_hit(limits, cgroup, proc.returncode, usage)
+    if cgroup is not None:
+        cgroup.remove()
+    return ProcessResult(proc.returncode, None, None, strays=strays, usage=usage, limit=limit)
+
+
+class _StreamWatch:
+    """Tracks a captured stream against the output it is expected to produce."""
+
+    def __init__(self, expected, mismatch_slack, output_cap):
+        self.expected = expected
+        self.mismatch_slack = mismatch_slack
+        # Never stop a stream that is still on its way to the expected output
+        if output_cap is not None and expected is not None:
+            output_cap = max(output_cap, len(expected))
+        self.output_cap = output_cap
+        self.size = 0
+        self.mismatch_at = None
+
+    def feed(self, data):
+        """Account for data read from the stream; return why to stop the command, if at all."""
+        if self.mismatch_at is None and self.expected is not None:
+            expected = self.expected[self.size:self.size + len(data)]
+            if data != expected:
+                offset = 0
+                while offset < len(expected) and data[offset] == expected[offset]:
+                    offset += 1
+                self.mismatch_at = self.size + offset
+        self.size += len(data)
+        if self.output_cap is not None and self.size > self.output_cap:
+            return STOPPED_OUTPUT_CAP
+        if self.mismatch_at is not None and self.size >= self.mismatch_at + self.mismatch_slack:
+            return STOPPED_MISMATCH
+        return None
+
+
+def run_with_pipes(command, input_data: bytes = b"", timeout=None, spool_threshold=SPOOL_THRESHOLD,
+                   expected_stdout=None, expected_stderr=None, mismatch_slack=0, output_cap=None,
+                   limits=None, cgroup_parent=None):
+    """Run a shell command, feeding input_data on stdin and capturing stdout/stderr.
+
+    Arguments:
+        command: the shell command to run
+        input_data: bytes written to the command's stdin, which is then closed
+        timeout: seconds to wait for the command to finish, None to wait forever
+        spool_threshold: bytes of each stream kept in memory before spilling to disk
+        expected_stdout: bytes stdout must match, None to not check stdout while running
+        expected_stderr: bytes stderr must match, None to not check stderr while running
+        mismatch_slack: bytes still captured after a stream stopped matching, so the
+            failure report has output to show, before the command is stopped
+        output_cap: maximum bytes captured per stream, but at least the expected output's
+            length; None for no limit
+        limits: ResourceLimits for the command, None for no limits
+        cgroup_parent: cgroup v2 directory to create the command's cgroup in, None for rlimits only
+
+    Returns:
+        ProcessResult; a timed out or stopped process is killed along with its process
+        group and has returncode None
+    """
+    start = time.monotonic()
+    deadline = None if timeout is None else start + timeout
+    stdout = SpooledTemporaryFile(max_size=spool_threshold)
+    stderr = SpooledTemporaryFile(max_size=spool_threshold)
+
+    proc, cgroup = _start(command, limits, cgroup_parent,
+                          stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # Measured after the fork, so it is at least what the command inherited
+    rss_floor = _rss_floor()
+
+    timed_out = False
+    stopped = None
+    strays = None
+    rusage = None
+    input_view = memoryview(input_data)
+    input_offset = 0
+    with selectors.DefaultSelector() as selector:
+        if input_data:
+            selector.register(proc.stdin, selectors.EVENT_WRITE)
+        else:
+            proc.stdin.close()
+        selector.register(proc.stdout, selectors.EVENT_READ,
+                          (stdout, _StreamWatch(expected_stdout, mismatch_slack, output_cap)))
+        selector.register(proc.stderr, selectors.EVENT_READ,
+                          (stderr, _StreamWatch(expected_stderr, mismatch_slack, output_cap)))
+
+        while selector.get_map() and stopped is None:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                timed_out = True
+                break
+            if rusage is None and (rusage := _reap(proc, False)) is not None:
+                # Processes forked by the command may hold the pipes open; the command is
+                # done, so kill them and read what is left
+                strays = kill_process_group(proc.pid, proc.pid)
+            timeout = _POLL_INTERVAL if remaining is None else min(remaining, _POLL_INTERVAL)
+            for key, _ in selector.select(timeout):
+                if key.fileobj is proc.stdin:
+                    chunk = input_view[input_offset:input_offset + select.PIPE_BUF]
+                    try:
+                        input_offset += os.write(key.fd, chunk)
+                    except BrokenPipeError:
+                        input_offset = len(input_view)
+                    if input_offset >= len(input_view):
+                        selector.unregister(key.fileobj)
+                        key.fileobj.close()
+                    continue
+
+                data = os.read(key.fd, _READ_SIZE)
+                buffer, watch = key.data
+                if data:
+                    buffer.write(data)
+                    stopped = watch.feed(data)
+                    if stopped is not None:
+                        break
+                else:
+                    selector.unregister(key.fileobj)
+                    key.fileobj.close()
+
+    if not timed_out and stopped is None and rusage is None:
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        rusage = _wait(proc, remaining)
+        timed_out = rusage is None
+
+    # Whatever is left of the process group goes too, also after a normal exit
+    group_strays = kill_process_group(proc.pid, proc.pid)
+    if strays is None:
+        strays = group_strays
+    if rusage is None:
+        rusage = _reap(proc, True)
+    if timed_out or stopped is not None:
+        for pipe in (proc.stdin, proc.stdout, proc.stderr):
+            if not pipe.closed:
+                pipe.close()
+
+    returncode = None if timed_out or stopped is not None else proc.returncode
+    usage = _usage(rusage, rss_floor, time.monotonic() - start, buffer_size(stdout), buffer_size(stderr))
+    limit = _limit_hit(limits, cgroup, returncode, usage, stderr)
+    if cgroup is not None:
+        cgroup.remove()
+    return ProcessResult(returncode, stdout, stderr, timed_out, stopped, strays, usage, limit)
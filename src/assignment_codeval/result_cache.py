@@ -0,0 +1,143 @@
+"""Cache of test case outcomes for run-evaluation --result-cache.
+
+An entry is keyed by the state of the working directory the test case runs in (the content
+and mode of every file, which covers the sources as well as the compiled artifacts) and by
+everything the test case itself is made of: its command, input, expected output and error,
+expected exit code, compared files, timeout, output limits and resource limits. When the key
+comes up again, the outcome is replayed instead of running the command.
+
+Only outcomes that would come out the same when run again are stored: the test case must
+not have run into its timeout or a resource limit, must not have left stray processes
+behind, and must leave the working directory as it found it, since later steps of the spec
+would otherwise see different files. A test whose program reads the clock or random data
+is replayed with the outcome of its first run.
+
+Every lookup is appended to stats.log, as for the compile cache.
+"""
+import dataclasses
+import hashlib
+import json
+import os
+import time
+
+from assignment_codeval.commons import debug, sha256_file, walk_files
+
+# Bump whenever the key or the entry layout changes so old entries are not used
+CACHE_VERSION = 1
+
+
+def case_fields(case):
+    """Return what the key of a test case is made of, apart from the working directory.
+
+    The number of the test case and its testing directory (which has the number in it with
+    --jobs) are left out, so inserting a test case into a spec does not change the keys of
+    the ones after it, and a test case has the same key with and without --jobs.
+    """
+    fields = {
+        "command": case.command,
+        "timeout": case.timeout,
+        "output_length_limit": case.output_length_limit,
+        "output_cap": case.output_cap,
+        "limits": dataclasses.asdict(case.limits),
+        "expected_exit_code": case.expected_exit_code,
+        "cmps": case.cmps,
+        "hint": case.hint,
+        "hidden": case.hidden,
+    }
+    for name in ("input", "expected_output", "expected_error"):
+        fields[name] = hashlib.sha256(getattr(case, name)).hexdigest()
+    return fields
+
+
+class ResultCache:
+    """A cache of test case outcomes stored in the directory root, which may be shared by several evaluations.
+
+    Entries are written to temporary names and renamed into place, so concurrent evaluations
+    never see partial entries.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(os.path.join(root, "entries"), exist_ok=True)
+        # path -> ((size, mtime_ns, inode), sha256), so unchanged files are hashed once
+        self._file_digests = {}
+
+    def tree_key(self, workdir=".", exclude=()):
+        """Return a digest of the content and mode of every file in workdir.
+
+        Arguments:
+            workdir: the directory test cases run in
+            exclude: glob patterns of files in workdir that are not part of the state
+
+        Returns:
+            the digest as a hex string
+        """
+        digest = hashlib.sha256()
+        for path in walk_files(workdir, exclude):
+            full_path = os.path.join(workdir, path)
+            try:
+                stat = os.stat(full_path)
+                version = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+                known = self._file_digests.get(full_path)
+                if known is None or known[0] != version:
+                    known = (version, sha256_file(full_path))
+                    self._file_digests[full_path] = known
+            except OSError:
+                continue
+            digest.update(f"{path}\0{stat.st_mode & 0o7777:o}\0{known[1]}\n".encode())
+        return digest.hexdigest()
+
+    def key(self, tree, fields):
+        """Return the key of running a test case with fields (see case_fields) in the tree with key tree."""
+        digest = hashlib.sha256()
+        digest.update(f"{CACHE_VERSION}\n{tree}\n".encode())
+        digest.update(json.dumps(fields, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.root, "entries", key[:2], f"{key}.json")
+
+    def lookup(self, key):
+        """Return the stored outcome with key, None if there is no usable entry."""
+        try:
+            with open(self._entry_path(key)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or entry.get("version") != CACHE_VERSION:
+            return None
+        return entry
+
+    def store(self, key, entry):
+        """Store the outcome of a test case.
+
+        Arguments:
+            key: the key of the test case
+            entry: a dict that can be written as JSON
+
+        Returns:
+            True if the entry was stored, False if it could not be written
+        """
+        path = self._entry_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump({"version": CACHE_VERSION, **entry}, f)
+            os.replace(tmp_path, path)
+            return True
+        except OSError as e:
+            debug(f"could not store test result {key} in {self.root}: {e}")
+            return False
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def record(self, key, hit):
+        """Append a lookup to stats.log; appends of a single short line do not interleave."""
+        line = f"{time.time():.3f} {'hit' if hit else 'miss'} {key}\n"
+        try:
+            with open(os.path.join(self.root, "stats.log"), "a") as f:
+                f.write(line)
+        except OSError as e:
+            debug(f"could not record result cache lookup: {e}")
@@ -0,0 +1,178 @@
+"""Split the test cases of one evaluation across shards and merge the shards' outputs.
+
+`run-evaluation --shard I/N` runs only the test cases of shard I (test case k belongs to
+shard (k - 1) % N + 1) and everything every shard needs (C, CMD, SS and TCMD lines, and
+the tags that set limits or expected data). Output that is not part of a test case, such as
+CF or PRINT lines, is printed by the shard of the test case before it (shard 1 before the
+first test case), so each line of the spec is reported exactly once across the shards.
+
+A shard ends its output with a marker line that tells where it stopped, followed by its
+trailer (usage, stray processes, totals, run time). `merge-shards` puts the test cases of
+all shards back in spec order, cuts the stream where an evaluation without shards would
+have stopped, and writes one trailer for all of them.
+"""
+import json
+import re
+import sys
+
+import click
+
+SHARD_MARKER = "### codeval shard"
+
+_MARKER_RE = re.compile(rf"^{re.escape(SHARD_MARKER)} (\d+)/(\d+) stopped at test case (\d+) of (\d+) "
+                        r"with exit code (-?\d+)$")
+_HEADER_RE = re.compile(r"^Test case (?:count )?(\d+) of \d+$")
+_PASSED_RE = re.compile(r"^Passed (\d+) of \d+ test cases, (\d+) failed$")
+_STRAYS_RE = re.compile(r"^Killed (\d+) stray processes left running by tests$")
+_TOOK_RE = re.compile(r"^took ([0-9.eE+-]+) seconds$")
+
+
+def parse_shard(text):
+    """Parse a shard selector I/N.
+
+    Returns:
+        (I, N)
+
+    Raises:
+        ValueError if text is not I/N with 1 <= I <= N
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*/\s*(\d+)\s*", text)
+    if not match or not 1 <= int(match.group(1)) <= int(match.group(2)):
+        raise ValueError(f"expected I/N with 1 <= I <= N, got {text!r}")
+    return int(match.group(1)), int(match.group(2))
+
+
+def shard_of(test_case, count):
+    """Return the shard that runs test_case (numbered from 1); shard 1 owns what precedes test case 1."""
+    return (max(test_case, 1) - 1) % count + 1
+
+
+def marker_line(index, count, stopped_at, total, exit_code):
+    """Return the line a shard prints when it stops, before its trailer."""
+    return f"{SHARD_MARKER} {index}/{count} stopped at test case {stopped_at} of {total} with exit code {exit_code}"
+
+
+class _ShardOutput:
+    """The output of one shard, split into the part before test case 1, test case blocks and the trailer."""
+
+    def __init__(self, text):
+        lines = text.splitlines(keepends=True)
+        marker = next((i for i in range(len(lines) - 1, -1, -1) if _MARKER_RE.match(lines[i].rstrip("\n"))), None)
+        if marker is None:
+            raise click.ClickException("shard output without a shard marker; was it run with --shard?")
+        index, count, stopped_at, total, exit_code = map(int, _MARKER_RE.match(lines[marker].rstrip("\n")).groups())
+        self.index, self.count, self.stopped_at, self.total, self.exit_code = \
+            index, count, stopped_at, total, exit_code
+        self.trailer = lines[marker + 1:]
+        self.preamble = []
+        self.blocks = {}
+        current = self.preamble
+        for line in lines[:marker]:
+            header = _HEADER_RE.match(line.rstrip("\n"))
+            if header:
+                current = self.blocks.setdefault(int(header.group(1)), [])
+            current.append(line)
+
+
+def merge_shard_outputs(texts):
+    """Merge the outputs of all shards of one evaluation into the output of an unsharded run.
+
+    Arguments:
+        texts: the output of each shard, in any order
+
+    Returns:
+        (the merged output, the exit code of the merged evaluation, the last test case reported)
+    """
+    shards = sorted((_ShardOutput(text) for text in texts), key=lambda shard: shard.index)
+    count = shards[0].count if shards else 0
+    if [shard.index for shard in shards] != list(range(1, count + 1)) or \
+            any(shard.count != count or shard.total != shards[0].total for shard in shards):
+        raise click.ClickException(f"need the output of each of the {count} shards of one evaluation exactly once")
+    total = shards[0].total
+
+    # An unsharded evaluation stops where the first shard stopped
+    stopped_at = min(shard.stopped_at if shard.exit_code else total for shard in shards)
+    out = list(shards[0].preamble)
+    for number in range(1, stopped_at + 1):
+        out.extend(shards[shard_of(number, count) - 1].blocks.get(number, []))
+    exit_code = next((shard.exit_code for shard in shards
+                      if shard.exit_code and shard.stopped_at == stopped_at), 0)
+
+    passed = failed = strays = 0
+    kept_going = False
+    took = 0.0
+    for shard in shards:
+        for line in shard.trailer:
+            stripped = line.rstrip("\n")
+            if match := _PASSED_RE.match(stripped):
+                kept_going = True
+                passed += int(match.group(1))
+                failed += int(match.group(2))
+            elif match := _STRAYS_RE.match(stripped):
+                strays += int(match.group(1))
+            elif match := _TOOK_RE.match(stripped):
+                took = max(took, float(match.group(1)))
+            else:
+                out.append(line)
+    if strays:
+        out.append(f"Killed {strays} stray processes left running by tests\n")
+    if kept_going:
+        out.append(f"Passed {passed} of {total} test cases, {failed} failed\n")
+        if failed and not exit_code:
+            exit_code = 2
+    out.append(f"took {took} seconds\n")
+    return "".join(out), exit_code, stopped_at
+
+
+def merge_shard_results(results, stopped_at):
+    """Merge the results files (see run-evaluation --results-file) of all shards.
+
+    Arguments:
+        results: the parsed results file of each shard
+        stopped_at: the last test case of the merged evaluation
+
+    Returns:
+        the merged results
+    """
+    tests = sorted((test for result in results for test in result["tests"] if test["test_case"] <= stopped_at),
+                   key=lambda test: test["test_case"])
+    total = results[0]["test_case_total"]
+    passed = sum(1 for test in tests if test["status"] == "passed")
+    merged = {
+        "codeval_file": results[0]["codeval_file"],
+        "status": "passed" if passed == len(tests) == total else "failed",
+        "test_case_total": total,
+        "passed": passed,
+        "failed": len(tests) - passed,
+        "tests": tests,
+    }
+    for name in ("compile_cache", "result_cache"):
+        caches = [result[name] for result in results if name in result]
+        if caches:
+            merged[name] = {"hits": sum(cache["hits"] for cache in caches),
+                            "misses": sum(cache["misses"] for cache in caches)}
+    return merged
+
+
+@click.command("merge-shards")
+@click.argument("outputs", nargs=-1, required=True, type=click.File("r"))
+@click.option("--results", "results_in", multiple=True, type=click.File("r"),
+              help="results file of a shard (run-evaluation --results-file), repeat for each shard")
+@click.option("--results-file", type=click.Path(dir_okay=False, writable=True),
+              help="write the merged results of the shards as JSON to this file")
+def merge_shards(outputs, results_in, results_file):
+    """
+    Merge the outputs of the shards of a `run-evaluation --shard I/N` evaluation.
+
+    Prints the output an evaluation without shards would have printed, with the test cases
+    in spec order, and exits with its exit code.
+    """
+    merged, exit_code, stopped_at = merge_shard_outputs([f.read() for f in outputs])
+    sys.stdout.write(merged)
+    if results_file:
+        if not results_in:
+            raise click.UsageError("--results-file needs the --results of the shards")
+        merged_results = merge_shard_results([json.load(f) for f in results_in], stopped_at)
+        with open(results_file, "w") as f:
+            json.dump(merged_results, f, indent=2)
+    sys.exit(exit_code)
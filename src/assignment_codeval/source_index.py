@@ -0,0 +1,232 @@
+"""Index the identifiers of source files, for the CO and CC tags and the CF source checks.
+
+Each file is scanned once into tokens, with comments dropped and string and character
+literals kept as opaque tokens, so neither can make a check pass. C, C++ and Java files (and
+any file that is not a script) use // and /* */ comments; Python and shell scripts use #
+comments. From the tokens, three sets of identifiers are built:
+
+  - calls: identifiers followed by `(`, as in `printf (...)` or `obj.size()`
+  - streams: identifiers followed by `<<` or `>>`, as in `cout << x` or `fin >> y`
+  - types: identifiers followed by `<`, or by a token on the same line after whitespace,
+    as in `vector<int>` or `std::string name`
+
+Qualified names are indexed along with their last identifier, so `std::vector` can be
+checked as well as `vector`. Every check is a set lookup.
+
+Python files are analyzed with the ast module instead: one walk collects the name of every
+call (`f()` and `obj.f()`) together with the function or method it is made from, which gives
+both the set of called names and the call graph of the file.
+
+An index is reused until the file's mtime or size changes.
+"""
+import ast
+import glob
+import os
+import re
+
+_HASH_COMMENT_EXTS = ('.py', '.sh', '.bash', '.rb', '.pl')
+
+_OPERATORS = ("<<=", ">>=", "...", "->*", "<=>", "<<", ">>", "->", "::", "++", "--", "&&", "||",
+              "==", "!=", "<=", ">=", "+=", "-=", "*=", "/=", "%=", "&=", "|=", "^=", ".*")
+
+_COMMON_TOKENS = (
+    r"(?P<newline>\n)"
+    r"|(?P<space>[ \t\r\f\v]+)"
+    r"|(?P<number>\.?\d(?:[eEpP][+-]|[\w.'])*)"
+    r"|(?P<identifier>[A-Za-z_$][\w$]*)"
+    r"|(?P<operator>" + "|".join(re.escape(operator) for operator in _OPERATORS) + r"|[^\w\s])"
+)
+
+_C_TOKENS = re.compile(
+    r"(?P<comment>//[^\n]*|/\*.*?(?:\*/|\Z))"
+    r"|(?P<literal>R\"(?P<delimiter>[^()\\\s]{0,16})\(.*?\)(?P=delimiter)\""
+    r"|\"\"\".*?(?:\"\"\"|\Z)"
+    r"|\"(?:\\.|[^\"\\\n])*(?:\"|$)"
+    r"|'(?:\\.|[^'\\\n])*(?:'|$))"
+    r"|" + _COMMON_TOKENS,
+    re.DOTALL | re.MULTILINE)
+
+_HASH_TOKENS = re.compile(
+    r"(?P<comment>#[^\n]*)"
+    r"|(?P<literal>\"\"\".*?(?:\"\"\"|\Z)|'''.*?(?:'''|\Z)"
+    r"|\"(?:\\.|[^\"\\\n])*(?:\"|$)"
+    r"|'(?:\\.|[^'\\\n])*(?:'|$))"
+    r"|" + _COMMON_TOKENS,
+    re.DOTALL | re.MULTILINE)
+
+
+def tokenize(text, hash_comments=False):
+    """Split source text into tokens, leaving out comments and whitespace.
+
+    Arguments:
+        text: the source text
+        hash_comments: True for # comments, False for // and /* */ comments
+
+    Returns:
+        a list of (kind, text, spaced) tuples where kind is "identifier", "number", "literal"
+        or "operator", and spaced tells whether whitespace or a comment separates the token
+        from a following token on the same line
+    """
+    tokens = []
+    gap = False
+    for match in (_HASH_TOKENS if hash_comments else _C_TOKENS).finditer(text):
+        kind = match.lastgroup
+        if kind == "newline":
+            gap = False
+            if tokens and tokens[-1][2] is None:
+                tokens[-1] = tokens[-1][:2] + (False,)
+            continue
+        if kind in ("space", "comment"):
+            gap = True
+            continue
+        if tokens and tokens[-1][2] is None:
+            tokens[-1] = tokens[-1][:2] + (gap,)
+        tokens.append((kind, match.group(), None))
+        gap = False
+    if tokens and tokens[-1][2] is None:
+        tokens[-1] = tokens[-1][:2] + (False,)
+    return tokens
+
+
+class _SourceTokens:
+    """The identifier sets of one source file."""
+
+    def __init__(self, tokens):
+        self.calls = set()
+        self.streams = set()
+        self.types = set()
+        # qualified names ending at the current identifier, as in std::vector or java.util.List
+        names = []
+        for index, (kind, text, spaced) in enumerate(tokens):
+            if kind != "identifier":
+                if text not in ("::", "."):
+                    names = []
+                continue
+            if index >= 1 and tokens[index - 1][1] in ("::", ".") and names:
+                names = [f"{name}{tokens[index - 1][1]}{text}" for name in names] + [text]
+            else:
+                names = [text]
+            following = tokens[index + 1][1] if index + 1 < len(tokens) else None
+            if following == "(":
+                self.calls.update(names)
+            elif following in ("<<", ">>"):
+                self.streams.update(names)
+            if following == "<" or spaced:
+                self.types.update(names)
+
+
+_EMPTY = _SourceTokens([])
+
+# Caller name of the calls made outside any function
+MODULE_SCOPE = "<module>"
+
+
+class _CallCollector(ast.NodeVisitor):
+    def __init__(self):
+        self.call_graph = {}
+        self._scope = []
+
+    def _visit_scope(self, node):
+        self._scope.append(node.name)
+        self.generic_visit(node)
+        self._scope.pop()
+
+    visit_FunctionDef = visit_AsyncFunctionDef = visit_ClassDef = _visit_scope
+
+    def visit_Call(self, node):
+        func = node.func
+        name = func.id if isinstance(func, ast.Name) else func.attr if isinstance(func, ast.Attribute) else None
+        if name is not None:
+            caller = ".".join(self._scope) or MODULE_SCOPE
+            self.call_graph.setdefault(caller, set()).add(name)
+        self.generic_visit(node)
+
+
+class PythonCalls:
+    """The calls made in one Python file.
+
+    call_graph maps each function, as its dotted name within the file (`main`,
+    `Stack.push`, `outer.inner`), or MODULE_SCOPE, to the names it calls; calls in class
+    bodies belong to the class. calls holds every called name.
+    """
+
+    def __init__(self, tree=None):
+        collector = _CallCollector()
+        if tree is not None:
+            collector.visit(tree)
+        self.call_graph = collector.call_graph
+        self.calls = set().union(*self.call_graph.values())
+
+    def calls_from(self, caller, name):
+        """Tell whether the function caller calls name."""
+        return name in self.call_graph.get(caller, ())
+
+
+_NO_CALLS = PythonCalls()
+
+
+def _python_calls(path, text):
+    try:
+        return PythonCalls(ast.parse(text))
+    except (SyntaxError, ValueError):
+        return _NO_CALLS
+
+
+def _source_tokens(path, text):
+    return _SourceTokens(tokenize(text, path.endswith(_HASH_COMMENT_EXTS)))
+
+
+class SourceIndex:
+    """Token indexes and Python call analyses of source files by path, rebuilt when a file changes."""
+
+    def __init__(self):
+        self._entries = {}
+
+    def _lookup(self, path, build, empty):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return empty
+        version = (stat.st_mtime_ns, stat.st_size)
+        entry = self._entries.get((path, build))
+        if entry is None or entry[0] != version:
+            try:
+                with open(path, encoding="utf-8", errors="replace") as f:
+                    text = f.read()
+            except OSError:
+                return empty
+            entry = (version, build(path, text))
+            self._entries[(path, build)] = entry
+        return entry[1]
+
+    def tokens(self, path):
+        """Return the identifier sets of a source file; a file that cannot be read has none."""
+        return self._lookup(path, _source_tokens, _EMPTY)
+
+    def python_calls(self, path):
+        """Return the PythonCalls of a Python file; a file that cannot be read or parsed has none."""
+        return self._lookup(path, _python_calls, _NO_CALLS)
+
+    def _any(self, files, select, name):
+        for pattern in files:
+            # the shell expanded globs in the file arguments of these checks
+            for path in sorted(glob.glob(pattern)) or [pattern]:
+                if name in select(path):
+                    return True
+        return False
+
+    def calls(self, files, name):
+        """Tell whether any of files calls name."""
+        return self._any(files, lambda path: self.tokens(path).calls, name)
+
+    def python_calls_any(self, files, name):
+        """Tell whether any of the Python files calls name, as name() or obj.name()."""
+        return self._any(files, lambda path: self.python_calls(path).calls, name)
+
+    def streams(self, files, name):
+        """Tell whether any of files uses name with a stream operator (<< or >>)."""
+        return self._any(files, lambda path: self.tokens(path).streams, name)
+
+    def declares_with(self, files, name):
+        """Tell whether any of files uses name as a type, with a template argument or a declarator."""
+        return self._any(files, lambda path: self.tokens(path).types, name)
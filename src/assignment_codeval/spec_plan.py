@@ -0,0 +1,393 @@
+"""Compile codeval specification files into reusable test plans.
+
+A plan is the validated, ordered list of tag steps of a spec together with the number of
+test cases and a per-test summary (inputs, expected outputs, limits and checks). Plans are
+cached as JSON next to the spec, keyed by the sha256 of the spec's content, so the spec is
+only interpreted once no matter how many submissions are evaluated against it.
+"""
+import dataclasses
+import hashlib
+import json
+import os
+import re
+
+from assignment_codeval.commons import debug
+
+# Bump whenever the plan layout or the compilation rules change so stale caches are ignored
+PLAN_VERSION = 2
+
+# Tags that start a test case and count towards "Test case N of M"
+TEST_TAGS = ("T", "HT", "TCMD")
+
+# Tags that run the pending test case before doing their own work (they call check_test)
+BARRIER_TAGS = {"C", "CF", "CO", "CC", "NCF", "PRINT", "CMD", "TCMD", "T", "HT"}
+
+# Tags to silently ignore (used by other tools but not by run-evaluation)
+IGNORED_TAGS = {"CD", "CTO", "Z", "RUN"}
+
+# Shell commands that likely indicate a missing CMD prefix when found untagged
+_BARE_SHELL_COMMANDS = {
+    'echo', 'rm', 'cp', 'mv', 'mkdir', 'rmdir', 'cat', 'ls', 'grep',
+    'sed', 'awk', 'find', 'chmod', 'chown', 'touch', 'ln', 'diff',
+    'sort', 'head', 'tail', 'cut', 'tr', 'wc', 'bash', 'sh', 'python',
+    'python3', 'make', 'export', 'source', 'kill', 'pkill', 'sleep',
+    'printf', 'read', 'unzip', 'tar', 'curl', 'wget',
+}
+
+# Pattern matches: TAG arguments (arguments required)
+# Use single space separator to preserve leading whitespace in values
+_TAG_PATTERN = re.compile(r"([A-Z_]+) (.*)")
+# Pattern for tag with optional arguments
+_TAG_ONLY_PATTERN = re.compile(r"([A-Z_]+)\s*$")
+
+
+def _is_block_delimiter(stripped):
+    """Return True for ASSIGNMENT START/END (or legacy CRT_HW) lines."""
+    return (stripped.startswith("CRT_HW") or stripped.startswith("ASSIGNMENT START")
+            or stripped.startswith("ASSIGNMENT END"))
+
+
+@dataclasses.dataclass
+class PlanStep:
+    """One step of a plan.
+
+    kind is "tag" for a tag to execute, or "warning"/"error" for a diagnostic whose
+    messages are printed when the step is reached (an error also ends the evaluation).
+    """
+    kind: str
+    line: int
+    text: str
+    tag: str = ""
+    args: str = ""
+    messages: list = dataclasses.field(default_factory=list)
+
+
+@dataclasses.dataclass
+class PlannedTest:
+    """Summary of a single test case as described by the spec.
+
+    input, expected_output and expected_error are lists of [source, value] pairs where
+    source is "text" for literal data and "file" for a file that is read at run time.
+    output_length_limit is None when it depends on the size of an OF file.
+    """
+    number: int
+    tag: str
+    line: int
+    command: str
+    hidden: bool
+    input: list = dataclasses.field(default_factory=list)
+    expected_output: list = dataclasses.field(default_factory=list)
+    expected_error: list = dataclasses.field(default_factory=list)
+    expected_exit_code: int = -1
+    hint: str = ""
+    cmps: list = dataclasses.field(default_factory=list)
+    temp_files: list = dataclasses.field(default_factory=list)
+    timeout: float = 10
+    output_length_limit: int | None = 4096
+    memory_limit_mb: int | None = None
+    cpu_limit_sec: float | None = None
+    process_limit: int | None = None
+
+
+@dataclasses.dataclass
+class SpecPlan:
+    """A compiled codeval specification."""
+    spec_hash: str
+    test_case_total: int
+    steps: list
+    tests: list
+    version: int = PLAN_VERSION
+
+    def to_json(self):
+        return json.dumps(dataclasses.asdict(self))
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        data["steps"] = [PlanStep(**step) for step in data["steps"]]
+        data["tests"] = [PlannedTest(**test) for test in data["tests"]]
+        return cls(**data)
+
+
+def spec_hash(content: str) -> str:
+    """Return the content hash that keys cached plans."""
+    return hashlib.sha256(f"{PLAN_VERSION}\n{content}".encode("utf-8")).hexdigest()
+
+
+def plan_path_for(spec_path: str) -> str:
+    """Return the path of the cached plan that sits next to spec_path."""
+    directory, name = os.path.split(spec_path)
+    return os.path.join(directory, f".{name}.plan.json")
+
+
+class _TestSummarizer:
+    """Follows the data tags the same way the evaluate tag functions do to summarize each test.
+
+    Data tags (I/O/E, X, CMP) accumulate until the pending test is run by a barrier tag,
+    HINT is cleared when a new T/HT starts, TO/OLEN/MEM/CPU/NPROC persist until changed, and TEMP files
+    are claimed by the next T/HT/TCMD.
+    """
+
+    def __init__(self):
+        self.tests = []
+        self.current = None
+        self.count = 0
+        self.timeout = 10
+        self.output_length_limit = 4096
+        self.memory_limit_mb = None
+        self.cpu_limit_sec = None
+        self.process_limit = None
+        self.temp_files = []
+        self._reset_data()
+
+    def _reset_data(self):
+        self.input = []
+        self.expected_output = []
+        self.expected_error = []
+        self.expected_exit_code = -1
+        self.cmps = []
+
+    def _finish_current(self):
+        if self.current is None:
+            return
+        test = self.current
+        test.input = self.input
+        test.expected_output = self.expected_output
+        test.expected_error = self.expected_error
+        test.expected_exit_code = self.expected_exit_code
+        test.cmps = self.cmps
+        self._apply_limits(test)
+        self.tests.append(test)
+        self.current = None
+        self._reset_data()
+
+    def _apply_limits(self, test):
+        test.timeout = self.timeout
+        test.output_length_limit = self.output_length_limit
+        test.memory_limit_mb = self.memory_limit_mb
+        test.cpu_limit_sec = self.cpu_limit_sec
+        test.process_limit = self.process_limit
+
+    def add(self, line_num, tag, args):
+        if tag in BARRIER_TAGS:
+            self._finish_current()
+
+        if tag in TEST_TAGS:
+            self.count += 1
+            test = PlannedTest(number=self.count, tag=tag, line=line_num, command=args,
+                               hidden=tag == "HT", temp_files=[f.strip() for f in self.temp_files])
+            self.temp_files = []
+            if tag == "TCMD":
+                self._apply_limits(test)
+                self.tests.append(test)
+            else:
+                self.current = test
+        elif tag == "I":
+            self.input.append(["text", args + "\n"])
+        elif tag == "IB":
+            self.input.append(["text", args])
+        elif tag == "IF":
+            self.input.append(["file", args])
+        elif tag == "O":
+            self.expected_output.append(["text", args + "\n"])
+        elif tag == "OB":
+            self.expected_output.append(["text", args])
+        elif tag == "OF":
+            self.expected_output.append(["file", args])
+            self.output_length_limit = None
+        elif tag == "E":
+            self.expected_error.append(["text", args + "\n"])
+        elif tag == "EB":
+            self.expected_error.append(["text", args])
+        elif tag == "X":
+            self.expected_exit_code = int(args)
+        elif tag == "HINT" and self.current is not None:
+            self.current.hint = args
+        elif tag == "CMP":
+            self.cmps.append(args.split())
+        elif tag == "TO":
+            self.timeout = float(args)
+        elif tag == "OLEN":
+            self.output_length_limit = int(args)
+        elif tag == "MEM":
+            self.memory_limit_mb = int(args) or None
+        elif tag == "CPU":
+            self.cpu_limit_sec = float(args) or None
+        elif tag == "NPROC":
+            self.process_limit = int(args) or None
+        elif tag == "TEMP":
+            self.temp_files.append(args)
+
+    def finish(self):
+        self._finish_current()
+        return self.tests
+
+
+def compile_spec(lines: list[str], valid_tags, content_hash: str = "") -> SpecPlan:
+    """Compile the lines of a codeval spec into a SpecPlan.
+
+    Validation mirrors what run-evaluation has always reported: the first invalid line
+    becomes an "error" step (nothing after it is executed) and bare shell commands become
+    "warning" steps, both with the exact messages printed when they are reached.
+
+    Arguments:
+        lines: the lines of the spec
+        valid_tags: the tags run-evaluation knows how to execute
+        content_hash: the spec hash recorded in the plan
+
+    Returns:
+        SpecPlan
+    """
+    valid_tags = set(valid_tags)
+    steps = []
+    summarizer = _TestSummarizer()
+    test_case_total = 0
+    failed = False
+
+    # Track if we're inside a CRT_HW block (content to ignore)
+    in_crt_hw_block = False
+
+    def error(line_num, tag_line, *messages):
+        steps.append(PlanStep("error", line_num, tag_line.rstrip(), messages=list(messages)))
+
+    for line_num, tag_line in enumerate(lines, start=1):
+        stripped = tag_line.strip()
+
+        # Check for ASSIGNMENT START/END (or legacy CRT_HW) block delimiter
+        if _is_block_delimiter(stripped):
+            in_crt_hw_block = not in_crt_hw_block
+            continue
+
+        # Skip lines inside assignment description block
+        if in_crt_hw_block:
+            continue
+
+        # The test case total covers the whole spec, even lines after an error
+        if tag_line.split(" ", 1)[0] in TEST_TAGS:
+            test_case_total += 1
+
+        # Skip empty lines and comments
+        if failed or not stripped or stripped.startswith("#"):
+            continue
+
+        tag_match = _TAG_PATTERN.match(tag_line)
+        tag_only_match = _TAG_ONLY_PATTERN.match(tag_line)
+        valid_list = f"  Valid tags are: {', '.join(sorted(valid_tags))}"
+
+        # Check for tag without arguments
+        if tag_only_match and not tag_match:
+            tag = tag_only_match.group(1)
+            if tag in IGNORED_TAGS:
+                continue
+            if tag in valid_tags:
+                error(line_num, tag_line,
+                      f"Error on line {line_num}: Tag '{tag}' requires arguments",
+                      f"  {line_num}: {tag_line.rstrip()}")
+                failed = True
+            elif tag.isupper():
+                error(line_num, tag_line,
+                      f"Error on line {line_num}: Unknown tag '{tag}'",
+                      f"  {line_num}: {tag_line.rstrip()}",
+                      valid_list)
+                failed = True
+            continue
+
+        # If line does not match tag format, skip non-tag lines
+        if not tag_match:
+            # Check if it looks like an invalid tag (starts with uppercase letters)
+            potential_tag = re.match(r"([A-Z]+)", tag_line)
+            if potential_tag:
+                tag = potential_tag.group(1)
+                if tag in IGNORED_TAGS:
+                    continue
+                if tag not in valid_tags and len(tag) <= 4:
+                    error(line_num, tag_line,
+                          f"Error on line {line_num}: Unknown tag '{tag}'",
+                          f"  {line_num}: {tag_line.rstrip()}",
+                          valid_list)
+                    failed = True
+            else:
+                # Check if this looks like a bare shell command missing a CMD prefix
+                first_word = tag_line.split()[0] if tag_line.split() else ""
+                if first_word.lower() in _BARE_SHELL_COMMANDS:
+                    steps.append(PlanStep("warning", line_num, tag_line.rstrip(), messages=[
+                        f"Warning on line {line_num}: bare shell command without CMD prefix, "
+                        "shell commands will be ignored",
+                        f"  {line_num}: {tag_line.rstrip()}",
+                        f"  Did you mean: CMD {tag_line.rstrip()}",
+                    ]))
+            continue
+
+        tag = tag_match.group(1)
+        args = tag_match.group(2)
+
+        if tag in IGNORED_TAGS:
+            continue
+
+        # Check for unknown tag
+        if tag not in valid_tags:
+            error(line_num, tag_line,
+                  f"Error on line {line_num}: Unknown tag '{tag}'",
+                  f"  {line_num}: {tag_line.rstrip()}",
+                  valid_list)
+            failed = True
+            continue
+
+        # Check for empty arguments
+        if not args.strip():
+            error(line_num, tag_line,
+                  f"Error on line {line_num}: Tag '{tag}' requires arguments",
+                  f"  {line_num}: {tag_line.rstrip()}")
+            failed = True
+            continue
+
+        steps.append(PlanStep("tag", line_num, tag_line.rstrip(), tag=tag, args=args))
+        try:
+            summarizer.add(line_num, tag, args)
+        except ValueError:
+            # Reported by the tag function itself when the step runs
+            pass
+
+    return SpecPlan(content_hash, test_case_total, steps, summarizer.finish())
+
+
+def load_spec_plan(spec_path: str, valid_tags) -> SpecPlan:
+    """Return the plan for spec_path, from the cache next to it when it is current.
+
+    A missing, unreadable or outdated cache is recompiled and rewritten; failing to write
+    the cache (e.g. a read-only directory) is not an error.
+    """
+    with open(spec_path, "r") as infile:
+        content = infile.read()
+    content_hash = spec_hash(content)
+
+    cache_path = plan_path_for(spec_path)
+    try:
+        with open(cache_path, "r") as infile:
+            plan = SpecPlan.from_json(infile.read())
+        if plan.version == PLAN_VERSION and plan.spec_hash == content_hash:
+            debug(f"using cached plan {cache_path}")
+            return plan
+    except (OSError, ValueError, TypeError, KeyError):
+        pass
+
+    plan = compile_spec(content.splitlines(keepends=True), valid_tags, content_hash)
+    save_spec_plan(plan, cache_path)
+    return plan
+
+
+def save_spec_plan(plan: SpecPlan, cache_path: str) -> bool:
+    """Write plan to cache_path atomically. Returns False if it could not be written."""
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as outfile:
+            outfile.write(plan.to_json())
+        os.replace(tmp_path, cache_path)
+        return True
+    except OSError as e:
+        debug(f"could not write plan cache {cache_path}: {e}")
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return False
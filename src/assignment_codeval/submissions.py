@@ -1,20 +1,106 @@
+import dataclasses
+import hashlib
+import json
 import os
+import queue
 import re
 import shutil
 import subprocess
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from configparser import ConfigParser
 from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 from functools import cache
-from tempfile import TemporaryDirectory
+from tempfile import mkdtemp
 from zipfile import ZipFile
 
 import click
 import requests
 
 from assignment_codeval.canvas_utils import connect_to_canvas, get_course, get_courses, get_assignment
-from assignment_codeval.commons import debug, error, info, warn, despace
+from assignment_codeval.commons import debug, error, info, warn, despace, sha256_file
+from assignment_codeval.compile_cache import read_stats
+from assignment_codeval.container_pool import DEFAULT_EXEC_COMMAND, DEFAULT_STOP_COMMAND, FAILED_EXIT_CODE, \
+    ContainerPool
+from assignment_codeval.evaluate import TESTING_DIR, tag_func_map
+from assignment_codeval.spec_plan import load_spec_plan, plan_path_for, save_spec_plan
+from assignment_codeval.support_templates import SupportTemplates
+
+# Written by run-evaluation --usage-file and kept next to comments.txt
+RESOURCE_USAGE_FILE = "resource_usage.json"
+# Written by run-evaluation --results-file and kept next to comments.txt
+RESULTS_FILE = "results.json"
+# Written by evaluate-submissions next to comments.txt, describes the last evaluation
+FINGERPRINT_FILE = "evaluation.json"
+# Bump whenever the layout of FINGERPRINT_FILE changes
+FINGERPRINT_VERSION = 1
+
+
+@dataclasses.dataclass
+class _CodevalSpec:
+    """What evaluating submissions and writing their results pages needs from a codeval file.
+
+    Read once per assignment by _load_codeval_spec instead of once (or three times) per student.
+    """
+    path: str
+    # (size, mtime_ns) of the file when it was read
+    version: tuple
+    # sha256 of the content
+    digest: bytes
+    compile_timeout: int
+    # CD arguments, in order, each relative to the one before
+    cd_dirs: list
+    # Z archives, relative to the codeval directory
+    zip_files: list
+    # OF and IF files, copied next to codeval.txt when they are in the codeval directory
+    ref_files: list
+    # see _parse_codeval_test_info
+    test_info: dict
+    # the compiled spec, loaded by evaluate-submissions
+    plan: object = None
+    # OF file -> content or None, filled by _read_of_file_content
+    of_contents: dict = dataclasses.field(default_factory=dict)
+
+
+# path -> _CodevalSpec, reloaded when the file changes
+_codeval_specs = {}
+
+
+def _load_codeval_spec(codeval_file):
+    """Return the _CodevalSpec of a codeval file, reading it only if it changed since it was last read."""
+    stat = os.stat(codeval_file)
+    version = (stat.st_size, stat.st_mtime_ns)
+    spec = _codeval_specs.get(codeval_file)
+    if spec is not None and spec.version == version:
+        return spec
+
+    with open(codeval_file, "rb") as f:
+        content = f.read()
+    lines = content.decode("utf-8", errors="replace").splitlines()
+    compile_timeout = 20
+    cd_dirs = []
+    zip_files = []
+    ref_files = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith("CTO"):
+            try:
+                compile_timeout = int(line.split(None, 1)[1])
+            except Exception:
+                warn(f"could not parse compile timeout from {line}, using default {compile_timeout}")
+        if line.startswith("CD"):
+            cd_dirs.append(line.split()[1].strip())
+        if line.startswith("Z"):
+            zip_files.append(line.split(None, 1)[1])
+        parts = line.split(None, 1)
+        if len(parts) == 2 and parts[0] in ("OF", "IF"):
+            ref_files.append(parts[1].strip())
+    spec = _CodevalSpec(codeval_file, version, hashlib.sha256(content).digest(), compile_timeout, cd_dirs,
+                        zip_files, ref_files, _parse_test_info(lines))
+    _codeval_specs[codeval_file] = spec
+    return spec
 
 
 def _parse_codeval_test_info(codeval_file):
@@ -23,34 +109,38 @@ def _parse_codeval_test_info(codeval_file):
     Returns dict: {test_case_num: {'hidden': bool, 'of_file': str or None}}
     Only T, HT, and TCMD tags increment the test case counter (matching evaluate.py).
     """
+    return _load_codeval_spec(codeval_file).test_info
+
+
+def _parse_test_info(lines):
+    """Return the test metadata of the lines of a codeval file, see _parse_codeval_test_info."""
     test_info = {}
     test_num = 0
     in_crt_hw_block = False
 
-    with open(codeval_file, 'r', encoding='utf-8', errors='replace') as f:
-        for line in f:
-            stripped = line.strip()
-            if not stripped:
-                continue
-            if stripped.startswith('CRT_HW'):
-                in_crt_hw_block = not in_crt_hw_block
-                continue
-            if in_crt_hw_block:
-                continue
+    for line in lines:
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped.startswith('CRT_HW'):
+            in_crt_hw_block = not in_crt_hw_block
+            continue
+        if in_crt_hw_block:
+            continue
 
-            parts = stripped.split(None, 1)
-            tag = parts[0]
-            args = parts[1].strip() if len(parts) > 1 else ''
+        parts = stripped.split(None, 1)
+        tag = parts[0]
+        args = parts[1].strip() if len(parts) > 1 else ''
 
-            if tag in ('T', 'HT', 'TCMD'):
-                test_num += 1
-                test_info[test_num] = {
-                    'hidden': tag == 'HT',
-                    'of_file': None,
-                    'tag': tag,
-                }
-            elif tag == 'OF' and test_num > 0 and test_info[test_num]['of_file'] is None:
-                test_info[test_num]['of_file'] = args
+        if tag in ('T', 'HT', 'TCMD'):
+            test_num += 1
+            test_info[test_num] = {
+                'hidden': tag == 'HT',
+                'of_file': None,
+                'tag': tag,
+            }
+        elif tag == 'OF' and test_num > 0 and test_info[test_num]['of_file'] is None:
+            test_info[test_num]['of_file'] = args
 
     return test_info
 
@@ -59,9 +149,17 @@ def _read_of_file_content(of_file, codeval_file):
     """Try to read the content of an OF file referenced in a codeval file.
 
     Looks in the codeval directory first, then inside any Z zip files.
-    Returns the file content as a string, or None if not found.
+    Returns the file content as a string, or None if not found. The content is kept with
+    the spec, so the results pages of an assignment read each OF file once.
     """
-    codeval_dir = os.path.dirname(codeval_file)
+    spec = _load_codeval_spec(codeval_file)
+    if of_file not in spec.of_contents:
+        spec.of_contents[of_file] = _find_of_file_content(of_file, spec)
+    return spec.of_contents[of_file]
+
+
+def _find_of_file_content(of_file, spec):
+    codeval_dir = os.path.dirname(spec.path)
 
     # Try direct path relative to codeval directory
     candidate = os.path.join(codeval_dir, of_file)
@@ -73,21 +171,8 @@ def _read_of_file_content(of_file, codeval_file):
             pass
 
     # Try inside Z zip files referenced in the codeval file
-    zip_files = []
-    in_crt_hw_block = False
-    with open(codeval_file, 'r', encoding='utf-8', errors='replace') as f:
-        for line in f:
-            stripped = line.strip()
-            if stripped.startswith('CRT_HW'):
-                in_crt_hw_block = not in_crt_hw_block
-                continue
-            if in_crt_hw_block:
-                continue
-            if stripped.startswith('Z '):
-                zip_files.append(stripped.split(None, 1)[1].strip())
-
     of_basename = os.path.basename(of_file)
-    for zf_name in zip_files:
+    for zf_name in spec.zip_files:
         zf_path = os.path.join(codeval_dir, zf_name)
         if not os.path.isfile(zf_path):
             continue
@@ -175,6 +260,301 @@ def get_github_repo_url(course, user_id, config_parser, github_field="github"):
         return None
 
 
+def _load_results(dirpath):
+    """Return the structured results run-evaluation wrote for a submission.
+
+    Returns None when there are none, for example for submissions evaluated by an older
+    version or when the evaluation was killed before it finished.
+    """
+    try:
+        with open(os.path.join(dirpath, RESULTS_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _submission_digest(submission_dir, codeval_file, exclude=(), generated=None):
+    """Return a digest of a submission together with the codeval file it is evaluated with.
+
+    Covers the names, modes and content of the files and directories in the submission (and
+    symlink targets), so two submissions with the same digest evaluate the same. The content
+    of .git directories is left out, only their presence counts, since clones of the same
+    commit differ there. The testing directories of run-evaluation are left out as well.
+
+    Arguments:
+        submission_dir: the submission
+        codeval_file: the codeval file
+        exclude: paths of files relative to submission_dir to leave out, such as the support
+            files an earlier evaluation put into the submission
+        generated: what an earlier evaluation generated in the submission, as returned by
+            _generated_files; a file is left out while it has the content it was generated with
+    """
+    exclude = {os.path.normpath(path) for path in exclude}
+    generated = generated or {}
+    digest = hashlib.sha256()
+    digest.update(_load_codeval_spec(codeval_file).digest)
+    for dirpath, dirnames, filenames in os.walk(submission_dir):
+        rel_dir = os.path.relpath(dirpath, submission_dir)
+        if ".git" in dirnames:
+            dirnames.remove(".git")
+            digest.update(f"git {os.path.join(rel_dir, '.git')}\n".encode())
+        if TESTING_DIR in dirnames:
+            dirnames.remove(TESTING_DIR)
+        dirnames.sort()
+        for name in dirnames:
+            rel_path = os.path.join(rel_dir, name)
+            if generated.get(os.path.normpath(rel_path), "") is not None:
+                digest.update(f"dir {rel_path}\n".encode())
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            rel_path = os.path.join(rel_dir, name)
+            if os.path.normpath(rel_path) in exclude:
+                continue
+            if os.path.islink(path):
+                digest.update(f"link {rel_path} {os.readlink(path)}\n".encode())
+                continue
+            file_digest = sha256_file(path)
+            if generated.get(os.path.normpath(rel_path)) == file_digest:
+                continue
+            digest.update(f"file {rel_path} {os.stat(path).st_mode & 0o7777:o} {file_digest}\n".encode())
+    return digest.hexdigest()
+
+
+def _submission_paths(submission_dir):
+    """Return the relative paths of the files and directories in a submission, without .git and testing directories."""
+    paths = set()
+    for dirpath, dirnames, filenames in os.walk(submission_dir):
+        rel_dir = os.path.relpath(dirpath, submission_dir)
+        dirnames[:] = [name for name in dirnames if name not in (".git", TESTING_DIR)]
+        paths.update(os.path.normpath(os.path.join(rel_dir, name)) for name in dirnames + filenames)
+    return paths
+
+
+def _generated_files(submission_dir, before, previous, support_files):
+    """Return what an evaluation generated in a submission, such as compile outputs.
+
+    Arguments:
+        submission_dir: the submission
+        before: the _submission_paths of the submission before the evaluation
+        previous: what earlier evaluations generated, which counts as generated while it exists
+        support_files: the support files the evaluation put into the submission, which are not generated
+
+    Returns:
+        {path relative to submission_dir: sha256 of the file, or None for a directory}
+    """
+    support_files = {os.path.normpath(path) for path in support_files}
+    after = _submission_paths(submission_dir)
+    generated = {}
+    for path in sorted((after - before) | (previous.keys() & after)):
+        full_path = os.path.join(submission_dir, path)
+        if path in support_files or os.path.islink(full_path):
+            continue
+        generated[path] = None if os.path.isdir(full_path) else sha256_file(full_path)
+    return generated
+
+
+def _copy_evaluation(from_dirpath, to_dirpath):
+    """Copy the files an evaluation leaves next to comments.txt, other than comments.txt, to another submission."""
+    for name in ("SUBSTITUTIONS.txt", RESULTS_FILE, RESOURCE_USAGE_FILE):
+        if os.path.exists(os.path.join(from_dirpath, name)):
+            shutil.copy(os.path.join(from_dirpath, name), os.path.join(to_dirpath, name))
+
+
+def _append_comments(dirpath, out, prefix=None):
+    """Append out to the comments.txt of a submission.
+
+    The new comments.txt is written next to it and renamed into place, so an upload running
+    at the same time never reads a half written file.
+
+    Arguments:
+        dirpath: the directory of comments.txt
+        out: the bytes to append
+        prefix: the number of bytes of comments.txt to keep, all of them if None
+    """
+    path = os.path.join(dirpath, "comments.txt")
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as fd:
+            if os.path.exists(path):
+                with open(path, "rb") as old:
+                    fd.write(old.read() if prefix is None else old.read(prefix))
+            fd.write(out)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _support_digest(spec, codeval_dir):
+    """Return a digest of the codeval file of spec and of the Z archives and OF/IF files it puts into submissions."""
+    digest = hashlib.sha256(spec.digest)
+    for kind, directory, names in (("Z", codeval_dir, spec.zip_files),
+                                   ("R", os.path.dirname(spec.path), spec.ref_files)):
+        for name in names:
+            path = os.path.join(directory, name)
+            file_digest = sha256_file(path) if os.path.isfile(path) else "-"
+            digest.update(f"{kind} {name} {file_digest}\n".encode())
+    return digest.hexdigest()
+
+
+def _load_fingerprint(dirpath):
+    """Return what evaluate-submissions recorded about the last evaluation of a submission, None if nothing.
+
+    A fingerprint without "submission" belongs to an evaluation that did not finish.
+    """
+    try:
+        with open(os.path.join(dirpath, FINGERPRINT_FILE), "r") as f:
+            fingerprint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(fingerprint, dict) or fingerprint.get("version") != FINGERPRINT_VERSION:
+        return None
+    return fingerprint
+
+
+def _write_fingerprint(dirpath, fingerprint):
+    """Replace the FINGERPRINT_FILE of a submission in one step."""
+    path = os.path.join(dirpath, FINGERPRINT_FILE)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump({"version": FINGERPRINT_VERSION, **fingerprint}, f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+@dataclasses.dataclass
+class _Submission:
+    """A submission found by evaluate-submissions, with the codeval file it is evaluated with."""
+    dirpath: str
+    assignment_name: str
+    submission_dir: str
+    spec: _CodevalSpec
+    # _submission_digest, None with --no-dedup and --force
+    digest: str | None
+    # the bytes of comments.txt written before the first evaluation, such as the clone log of a GitHub submission
+    comments_prefix: int = 0
+    # the files the evaluation put into submission_dir, relative to it, which are not part of the submission
+    support_files: list = dataclasses.field(default_factory=list)
+    # what earlier evaluations generated in submission_dir, see _generated_files
+    generated: dict = dataclasses.field(default_factory=dict)
+    # the _submission_paths of submission_dir before the evaluation
+    paths_before: set = dataclasses.field(default_factory=set)
+
+
+def _evaluate_submission(submission, command, codeval_dir, link_dirs, pool, templates, resource_usage, results):
+    """Extract the Z files of the spec into a submission and run the RUN command on it.
+
+    Runs in a worker of evaluate-submissions; the submissions link is made in a link
+    directory taken from link_dirs and given back afterwards. With a pool, the submission
+    is copied into the job directory of a warm container and evaluated there instead.
+
+    Arguments:
+        submission: the _Submission to evaluate
+        command: the RUN command with EVALUATE replaced
+        codeval_dir: the directory of the Z files
+        link_dirs: queue.Queue of link directories
+        pool: the ContainerPool to evaluate in, None to run the command of each submission
+        templates: the SupportTemplates the Z files and OF/IF files are put into the submission from
+        resource_usage: move the resource usage file next to comments.txt
+        results: move the results file next to comments.txt
+
+    Returns:
+        (the output to append to comments.txt, the seconds the evaluation took)
+    """
+    start_time = time.time()
+    dirpath = submission.dirpath
+    assignment_name = submission.assignment_name
+    submission_dir = submission.submission_dir
+    spec = submission.spec
+    compile_timeout = spec.compile_timeout
+    info(f"processing {dirpath}")
+
+    # Follow the CD tags before extracting the Z files into the working directory
+    assignment_working_dir = "."
+    for cd_dir in spec.cd_dirs:
+        if cd_dir == "GITHUB_DIRECTORY":
+            cd_dir = assignment_name
+        assignment_working_dir = os.path.normpath(os.path.join(assignment_working_dir, cd_dir))
+        if not os.path.isdir(os.path.join(submission_dir, assignment_working_dir)):
+            out = f"{assignment_working_dir} does not exist or is not a directory\n".encode('utf-8')
+            return out, time.time() - start_time
+
+    # If no CD tag and this is a GitHub submission (has .git), use assignment name as working dir
+    if not spec.cd_dirs and os.path.exists(os.path.join(submission_dir, ".git")):
+        assignment_working_dir = assignment_name
+        if not os.path.isdir(os.path.join(submission_dir, assignment_working_dir)):
+            out = f"{assignment_working_dir} does not exist or is not a directory\n".encode('utf-8')
+            return out, time.time() - start_time
+
+    # Now put the files of the zip files into the correct working directory
+    for zf_name in spec.zip_files:
+        template = templates.archive(os.path.join(codeval_dir, zf_name))
+        if os.path.isfile(os.path.join(template, "SUBSTITUTIONS.txt")):
+            shutil.copyfile(os.path.join(template, "SUBSTITUTIONS.txt"), os.path.join(dirpath, "SUBSTITUTIONS.txt"))
+        placed = templates.materialize(template, os.path.join(submission_dir, assignment_working_dir))
+        submission.support_files += [os.path.join(assignment_working_dir, path) for path in placed]
+
+    if not os.path.isdir(os.path.join(submission_dir, assignment_working_dir)):
+        return b"no submission directory found", time.time() - start_time
+    if pool is None:
+        link_dir = link_dirs.get()
+        submission_link = os.path.join(link_dir, "submissions")
+    else:
+        container = pool.acquire()
+    failed = True
+    try:
+        if pool is None:
+            os.symlink(submission_dir, submission_link)
+            full_assignment_working_dir = os.path.join(submission_link, assignment_working_dir)
+        else:
+            # the container sees a fresh copy of the submission, the submission itself is not changed
+            full_assignment_working_dir = pool.prepare(container, os.path.join(submission_dir, assignment_working_dir))
+            command = command.replace("NAME", container.name)
+        shutil.copy(spec.path, os.path.join(full_assignment_working_dir, "codeval.txt"))
+        # run-evaluation picks up the plan instead of parsing codeval.txt again
+        save_spec_plan(spec.plan, plan_path_for(os.path.join(full_assignment_working_dir, "codeval.txt")))
+        placed = templates.materialize(templates.files(os.path.dirname(spec.path), spec.ref_files),
+                                       full_assignment_working_dir)
+        if pool is None:
+            submission.support_files += [os.path.join(assignment_working_dir, path)
+                                         for path in ["codeval.txt", plan_path_for("codeval.txt")] + placed]
+
+        command = command.replace("SUBMISSIONS", full_assignment_working_dir)
+        info(f"command to execute: {command}")
+        p = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        try:
+            out, err = p.communicate(timeout=compile_timeout)
+            failed = p.returncode >= FAILED_EXIT_CODE or p.returncode < 0
+        except subprocess.TimeoutExpired:
+            p.kill()
+            out, err = p.communicate()
+            out += bytes(f"\nTOOK LONGER THAN {compile_timeout} seconds to run. FAILED\n", encoding='utf-8')
+        except Exception as e:
+            error(f"exception {e} running evaluation for {dirpath}")
+            p.kill()
+            out, err = p.communicate()
+            out += bytes(f"\nFAILED with exception {e}\n", encoding='utf-8')
+        finally:
+            info("finished executing docker")
+        usage_file = os.path.join(full_assignment_working_dir, RESOURCE_USAGE_FILE)
+        if resource_usage and os.path.exists(usage_file):
+            shutil.move(usage_file, os.path.join(dirpath, RESOURCE_USAGE_FILE))
+        results_file = os.path.join(full_assignment_working_dir, RESULTS_FILE)
+        if results and os.path.exists(results_file):
+            shutil.move(results_file, os.path.join(dirpath, RESULTS_FILE))
+        return out, time.time() - start_time
+    finally:
+        if pool is None:
+            if os.path.lexists(submission_link):
+                os.remove(submission_link)
+            link_dirs.put(link_dir)
+        else:
+            pool.release(container, failed)
+
+
 def _get_canvas_config():
     """Get Canvas URL and token from config."""
     parser = ConfigParser()
@@ -201,6 +581,7 @@ def write_html_file(dirpath):
 
     with open(f"{dirpath}/comments.txt", "r") as f:
         comments_content = f.read()
+    results = _load_results(dirpath)
 
     # Load test case info and OF file contents from the codeval file
     of_contents = {}  # test_num -> file content string (only non-hidden T tests)
@@ -220,6 +601,10 @@ def write_html_file(dirpath):
                 codeval_file = find_codeval_file(parser['CODEVAL']['directory'], assignment_name)
         if codeval_file:
             test_info = _parse_codeval_test_info(codeval_file)
+            if results is not None:
+                # Only the failed tests get a link, so only their expected output is read
+                failed = {t['test_case'] for t in results['tests'] if t['status'] == 'failed'}
+                test_info = {num: info for num, info in test_info.items() if num in failed}
             for test_num, info in test_info.items():
                 if not info['hidden'] and info['of_file'] and info['tag'] == 'T':
                     content = _read_of_file_content(info['of_file'], codeval_file)
@@ -284,8 +669,12 @@ def write_html_file(dirpath):
     except (ValueError, TypeError):
         pass
 
-    pass_count = sum(1 for l in comments_content.split('\n') if l.startswith('Passed'))
-    fail_count = sum(1 for l in comments_content.split('\n') if l.startswith('FAIL'))
+    if results is not None:
+        pass_count = results['passed']
+        fail_count = results['failed']
+    else:
+        pass_count = sum(1 for l in comments_content.split('\n') if l.startswith('Passed'))
+        fail_count = sum(1 for l in comments_content.split('\n') if l.startswith('FAIL'))
 
     template_path = os.path.join(os.path.dirname(__file__), 'test_template.html')
     with open(template_path, "r", encoding="utf-8") as f:
@@ -432,12 +821,16 @@ def upload_submission_comments(submissions_dir, codeval_prefix, delete):
                         if all_comments:
                             last_comment_id = all_comments[-1]["id"]
                             delete_submission_comment(canvas, course.id, assignment.id, student_id, last_comment_id)
+                    header = codeval_prefix.rstrip()
+                    results = _load_results(dirpath)
+                    if results is not None:
+                        header += f" passed {results['passed']} of {results['test_case_total']} test cases"
                     canvas_url, canvas_token = _get_canvas_config()
                     requests.put(
                         f'{canvas_url}/api/v1/courses/{course.id}/assignments/{assignment.id}/submissions/{student_id}',
                         headers={'Authorization': f'Bearer {canvas_token}'},
                         data={
-                            'comment[text_comment]': f'{codeval_prefix.rstrip()}\n<pre>{comment}</pre>',
+                            'comment[text_comment]': f'{header}\n<pre>{comment}</pre>',
                             'comment[file_ids][]': file_id,
                         }
                     ).raise_for_status()
@@ -451,12 +844,72 @@ def upload_submission_comments(submissions_dir, codeval_prefix, delete):
 @click.argument('codeval_dir', metavar="CODEVAL_DIR", required=False)
 @click.option("--submissions-dir", help="directory containing submissions COURSE/ASSIGNMENT/STUDENT_ID",
               default='./submissions', show_default=True)
-def evaluate_submissions(codeval_dir, submissions_dir):
+@click.option("--resource-usage", is_flag=True,
+              help=f"save the resource usage of each test as {RESOURCE_USAGE_FILE} next to comments.txt")
+@click.option("--results/--no-results", default=True, show_default=True,
+              help=f"save the outcome of each test as {RESULTS_FILE} next to comments.txt; turn off for "
+                   "containers with a run-evaluation that does not have --results-file")
+@click.option("--keep-going", is_flag=True,
+              help="run every test of a submission instead of stopping at the first failed one")
+@click.option("--compile-cache", type=click.Path(file_okay=False),
+              help="compile cache directory passed on to run-evaluation; it has to be at the same path "
+                   "inside the container as outside, so that it is shared by all submissions")
+@click.option("--result-cache", type=click.Path(file_okay=False),
+              help="test result cache directory passed on to run-evaluation, at the same path inside the "
+                   "container as outside like --compile-cache")
+@click.option("--dedup/--no-dedup", default=True, show_default=True,
+              help="evaluate identical submissions of an assignment once and give each the same comments")
+@click.option("--jobs", "-j", type=click.IntRange(min=1), default=1, show_default=True,
+              help="number of submissions to evaluate at the same time")
+@click.option("--pool", "use_pool", is_flag=True,
+              help="evaluate in a warm container per job, started with pool_command under [RUN], "
+                   "instead of running the RUN command for each submission")
+@click.option("--recycle-after", type=click.IntRange(min=1), default=50, show_default=True,
+              help="with --pool, replace a container after this many submissions")
+@click.option("--hardlink-support", is_flag=True,
+              help="hardlink the files of Z archives and OF/IF files into submissions when they cannot be "
+                   "reflinked; they are read-only, but an evaluation running as root can still change them "
+                   "for every submission")
+@click.option("--force", is_flag=True,
+              help="evaluate submissions again even if nothing changed since their last evaluation")
+def evaluate_submissions(codeval_dir, submissions_dir, resource_usage, results, keep_going, compile_cache,
+                         result_cache, dedup, jobs, use_pool, recycle_after, hardlink_support, force):
     """
     Evaluate submissions stored in the form COURSE/ASSIGNMENT/STUDENT_ID.
 
     CODEVAL_DIR specifies a directory that has the codeval files named after the assignment with the .codeval suffix.
     If not specified, uses the directory from [CODEVAL] section in codeval.ini.
+
+    The structured results are used by upload-submission-comments for the results page and
+    the comment header instead of scanning comments.txt.
+
+    Submissions whose files are identical (starter code, group work, re-uploads) are
+    evaluated once: the others get the output, results and resource usage of the first one,
+    and the number of submissions that did not need an evaluation is printed at the end.
+
+    With --jobs N, N submissions are evaluated at the same time, each worker with its own
+    link directory. comments.txt is replaced in one step, so it is never seen half written.
+    The throughput and the slowest submissions are printed at the end.
+
+    With --pool, each worker keeps a container running, started with pool_command under
+    [RUN] (NAME is the container name, SUBMISSIONS the host directory to mount at
+    /submissions). Each submission is copied into that directory and evaluated with
+    pool_exec (default: docker exec -i NAME bash -c "EVALUATE"). A container is replaced
+    after --recycle-after submissions, or when an evaluation times out or docker fails;
+    pool_stop (default: docker rm -f NAME) removes it.
+
+    The Z archives of an assignment are extracted once, and its OF/IF files copied once,
+    into templates next to the submissions directory; each submission gets their files by
+    reflink where the file system allows, by copy otherwise. With --hardlink-support they
+    are hardlinked instead of copied and are read-only. Only use it when evaluations do not
+    run as root: root can write to a hardlinked file, which changes it for every submission.
+
+    Each evaluation is recorded in evaluation.json next to comments.txt: the digest of
+    the submission after the evaluation, without the support files it put there, the digest
+    of the codeval file, Z archives and OF/IF files, and the RUN command. A
+    submission whose fingerprint still matches is skipped unless --force is given, so an
+    interrupted run can be restarted cheaply. An evaluation replaces the output of the
+    previous one in comments.txt instead of appending to it.
     """
     parser = ConfigParser()
     config_file = click.get_app_dir("codeval.ini")
@@ -472,116 +925,164 @@ def evaluate_submissions(codeval_dir, submissions_dir):
     raw_command = parser["RUN"]["command"]
     if not raw_command:
         warn(f"commands section under [RUN] in {parser.config_file} is empty")
+    evaluate_command = "cd /submissions 2>/dev/null || true; assignment-codeval run-evaluation codeval.txt"
+    if resource_usage:
+        evaluate_command += f" --usage-file {RESOURCE_USAGE_FILE}"
+    if results:
+        evaluate_command += f" --results-file {RESULTS_FILE}"
+    if keep_going:
+        evaluate_command += " --keep-going"
+    if compile_cache:
+        evaluate_command += f" --compile-cache {os.path.abspath(compile_cache)}"
+    if result_cache:
+        evaluate_command += f" --result-cache {os.path.abspath(result_cache)}"
+    command = raw_command.replace("EVALUATE", evaluate_command)
+    pool = None
+    if use_pool:
+        if not parser["RUN"].get("pool_command"):
+            raise click.UsageError(f"--pool needs pool_command under [RUN] in {config_file}")
+        command = parser["RUN"].get("pool_exec", DEFAULT_EXEC_COMMAND).replace("EVALUATE", evaluate_command)
+        pool = ContainerPool(parser["RUN"]["pool_command"], parser["RUN"].get("pool_stop", DEFAULT_STOP_COMMAND),
+                             jobs, recycle_after, mkdtemp("cepool", dir="/var/tmp"))
+
+    # _CodevalSpec by assignment name (None if there is no codeval file), so each spec is found and read once per run
+    specs = {}
+    # _support_digest by assignment name
+    support_digests = {}
+    # the first submission of an assignment with each _submission_digest, and the submissions identical to it,
+    # by (assignment name, digest)
+    to_evaluate = []
+    duplicates = {}
+    submission_count = 0
+    skipped_count = 0
     for dirpath, dirnames, filenames in os.walk(submissions_dir):
         match = re.match(fr'^{submissions_dir}/([^/]+)/([^/]+)/([^/]+)$', dirpath)
         if not match:
             continue
 
-        info(f"processing {dirpath}")
-
         assignment_name = match.group(2)
         submission_dir = os.path.abspath(os.path.join(dirpath, "submission"))
 
-        codeval_file = find_codeval_file(codeval_dir, assignment_name)
-        if not codeval_file:
+        if assignment_name not in specs:
+            codeval_file = find_codeval_file(codeval_dir, assignment_name)
+            if codeval_file:
+                specs[assignment_name] = _load_codeval_spec(codeval_file)
+                specs[assignment_name].plan = load_spec_plan(codeval_file, tag_func_map.keys())
+                support_digests[assignment_name] = _support_digest(specs[assignment_name], codeval_dir)
+            else:
+                specs[assignment_name] = None
+        spec = specs[assignment_name]
+        if spec is None:
             warn(f"no codeval file found for {assignment_name} in {codeval_dir}")
             continue
 
+        # Before the Z files are extracted into the submission and it is compiled; the support files an
+        # earlier evaluation put there are left out, they are covered by the support digest, and so is
+        # what it generated, such as compile outputs
+        previous = _load_fingerprint(dirpath)
+        previous_support_files = (previous or {}).get("support_files", [])
+        previous_generated = (previous or {}).get("generated", {})
+        digest = _submission_digest(submission_dir, spec.path, previous_support_files, previous_generated) \
+            if dedup or not force else None
+        support = support_digests[assignment_name]
+        if not force and previous is not None and previous.get("submission") == digest \
+                and previous.get("support") == support and previous.get("command") == command:
+            info(f"skipping {dirpath}, it did not change since its last evaluation")
+            skipped_count += 1
+            continue
+
         with open(os.path.join(dirpath, "codeval_path.txt"), "w") as f:
-            f.write(os.path.abspath(codeval_file))
-
-        # First pass: get CTO, CD tags, and collect Z files (don't extract yet)
-        compile_timeout = 20
-        assignment_working_dir = "."
-        has_cd_tag = False
-        zip_files = []
-        move_to_next_submission = False
-        with open(codeval_file, "r") as fd:
-            for line in fd:
-                line = line.strip()
-                if line.startswith("CTO"):
-                    try:
-                        compile_timeout = int(line.split(None, 1)[1])
-                    except Exception:
-                        warn(f"could not parse compile timeout from {line}, using default {compile_timeout}")
-                if line.startswith("CD"):
-                    has_cd_tag = True
-                    cd_dir = line.split()[1].strip()
-                    if cd_dir == "GITHUB_DIRECTORY":
-                        cd_dir = assignment_name
-                    assignment_working_dir = os.path.normpath(
-                        os.path.join(assignment_working_dir, cd_dir))
-                    if not os.path.isdir(os.path.join(submission_dir, assignment_working_dir)):
-                        out = f"{assignment_working_dir} does not exist or is not a directory\n".encode('utf-8')
-                        move_to_next_submission = True
-                        break
-                if line.startswith("Z"):
-                    zip_files.append(line.split(None, 1)[1])
-
-        # If no CD tag and this is a GitHub submission (has .git), use assignment name as working dir
-        if not has_cd_tag and os.path.exists(os.path.join(submission_dir, ".git")):
-            assignment_working_dir = assignment_name
-            if not os.path.isdir(os.path.join(submission_dir, assignment_working_dir)):
-                out = f"{assignment_working_dir} does not exist or is not a directory\n".encode('utf-8')
-                move_to_next_submission = True
-
-        # Now extract zip files to the correct working directory
-        if not move_to_next_submission:
-            for zf_name in zip_files:
-                with ZipFile(os.path.join(codeval_dir, zf_name)) as zf:
-                    if "SUBSTITUTIONS.txt" in zf.namelist():
-                        with open(os.path.join(dirpath, "SUBSTITUTIONS.txt"), "wb") as out_f:
-                            out_f.write(zf.read("SUBSTITUTIONS.txt"))
-                    for f in zf.infolist():
-                        dest_dir = os.path.join(submission_dir, assignment_working_dir)
-                        zf.extract(f, dest_dir)
-                        if not f.is_dir():
-                            perms = f.external_attr >> 16
-                            if perms:
-                                os.chmod(os.path.join(dest_dir, f.filename), perms)
-
-        if not move_to_next_submission:
-            command = raw_command.replace("EVALUATE", "cd /submissions 2>/dev/null || true; assignment-codeval run-evaluation codeval.txt")
-
-            with TemporaryDirectory("cedir", dir="/var/tmp") as link_dir:
-                submission_link = os.path.join(link_dir, "submissions")
-                os.symlink(submission_dir, submission_link)
-                full_assignment_working_dir = os.path.join(submission_link, assignment_working_dir)
-                if not os.path.isdir(full_assignment_working_dir):
-                    out = b"no submission directory found"
-                else:
-                    shutil.copy(codeval_file, os.path.join(full_assignment_working_dir, "codeval.txt"))
-                    codeval_source_dir = os.path.dirname(codeval_file)
-                    with open(codeval_file, "r") as cf:
-                        for cf_line in cf:
-                            parts = cf_line.strip().split(None, 1)
-                            if len(parts) == 2 and parts[0] in ("OF", "IF"):
-                                ref_file = parts[1].strip()
-                                src = os.path.join(codeval_source_dir, ref_file)
-                                if os.path.isfile(src):
-                                    shutil.copy(src, os.path.join(full_assignment_working_dir, ref_file))
-
-                    command = command.replace("SUBMISSIONS", full_assignment_working_dir)
-                    info(f"command to execute: {command}")
-                    p = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-                    try:
-                        out, err = p.communicate(timeout=compile_timeout)
-                    except subprocess.TimeoutExpired:
-                        p.kill()
-                        out, err = p.communicate()
-                        out += bytes(f"\nTOOK LONGER THAN {compile_timeout} seconds to run. FAILED\n", encoding='utf-8')
-                    except Exception as e:
-                        error(f"exception {e} running evaluation for {dirpath}")
-                        p.kill()
-                        out, err = p.communicate()
-                        out += bytes(f"\nFAILED with exception {e}\n", encoding='utf-8')
-                    finally:
-                        info("finished executing docker")
-
-        info("writing results")
-        with open(f"{dirpath}/comments.txt", "ab") as fd:
-            fd.write(out)
-        info("continuing")
+            f.write(os.path.abspath(spec.path))
+        # Results of an earlier evaluation would not describe this one
+        if os.path.exists(os.path.join(dirpath, RESULTS_FILE)):
+            os.remove(os.path.join(dirpath, RESULTS_FILE))
+
+        # The output of an earlier evaluation is replaced, what came before it is kept
+        comments_path = os.path.join(dirpath, "comments.txt")
+        if previous is not None:
+            comments_prefix = previous["comments_prefix"]
+        else:
+            comments_prefix = os.path.getsize(comments_path) if os.path.exists(comments_path) else 0
+        _write_fingerprint(dirpath, {"comments_prefix": comments_prefix, "command": command})
+
+        submission_count += 1
+        submission = _Submission(dirpath, assignment_name, submission_dir, spec, digest, comments_prefix,
+                                 list(previous_support_files), previous_generated, _submission_paths(submission_dir))
+        if dedup and (assignment_name, submission.digest) in duplicates:
+            duplicates[assignment_name, submission.digest].append(submission)
+        else:
+            to_evaluate.append(submission)
+            if dedup:
+                duplicates[assignment_name, submission.digest] = []
+
+    # stats.log of the compile cache counts every lookup, the ones of this run are those added from now on
+    cache_stats = read_stats(compile_cache) if compile_cache else None
+    duplicate_count = 0
+    durations = []
+    start_time = time.time()
+    # one directory for the submissions link of each worker
+    link_dirs = queue.Queue()
+    for _ in range(jobs):
+        link_dirs.put(mkdtemp("cedir", dir="/var/tmp"))
+    # next to the submissions, so they can be hardlinked from it
+    templates = SupportTemplates(mkdtemp(".codeval-support", dir=os.path.dirname(os.path.abspath(submissions_dir))),
+                                 hardlink_support)
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(_evaluate_submission, submission, command, codeval_dir, link_dirs, pool,
+                                       templates, resource_usage, results):
+                       submission for submission in to_evaluate}
+            for future in as_completed(futures):
+                submission = futures[future]
+                out, seconds = future.result()
+                durations.append((seconds, submission.dirpath))
+
+                info(f"writing results of {submission.dirpath}")
+                _append_comments(submission.dirpath, out, submission.comments_prefix)
+                # the Z files and what the evaluation generated are in the submission now
+                support_files = list(dict.fromkeys(submission.support_files))
+                generated = _generated_files(submission.submission_dir, submission.paths_before,
+                                             submission.generated, support_files)
+                _write_fingerprint(submission.dirpath, {
+                    "comments_prefix": submission.comments_prefix, "command": command,
+                    "support": support_digests[submission.assignment_name],
+                    "support_files": support_files, "generated": generated,
+                    "submission": _submission_digest(submission.submission_dir, submission.spec.path,
+                                                     support_files, generated)})
+                for duplicate in duplicates.get((submission.assignment_name, submission.digest), ()):
+                    info(f"{duplicate.dirpath} is identical to {submission.dirpath}, reusing its evaluation")
+                    duplicate_count += 1
+                    _copy_evaluation(submission.dirpath, duplicate.dirpath)
+                    _append_comments(duplicate.dirpath, out, duplicate.comments_prefix)
+                    _write_fingerprint(duplicate.dirpath, {
+                        "comments_prefix": duplicate.comments_prefix, "command": command,
+                        "support": support_digests[duplicate.assignment_name],
+                        "support_files": duplicate.support_files, "generated": duplicate.generated,
+                        "submission": duplicate.digest})
+    finally:
+        while not link_dirs.empty():
+            shutil.rmtree(link_dirs.get(), ignore_errors=True)
+        if pool is not None:
+            pool.close()
+        templates.close()
+
+    if durations:
+        elapsed = time.time() - start_time
+        info(f"evaluated {len(durations)} submissions in {elapsed:.1f} seconds with {jobs} jobs, "
+             f"{len(durations) / elapsed * 60:.1f} submissions per minute")
+        info("slowest submissions: " + ", ".join(f"{dirpath} {seconds:.1f}s"
+                                                 for seconds, dirpath in sorted(durations, reverse=True)[:5]))
+    if skipped_count:
+        info(f"skipped {skipped_count} submissions that did not change since their last evaluation")
+    if duplicate_count:
+        info(f"deduplicated {duplicate_count} of {submission_count} submissions, evaluated "
+             f"{submission_count - duplicate_count} ({duplicate_count / submission_count:.0%} dedup ratio)")
+    if any(templates.methods.values()):
+        info("support files: " + ", ".join(f"{count} by {method}" for method, count in templates.methods.items()))
+    if cache_stats is not None:
+        hits, misses = (now - before for now, before in zip(read_stats(compile_cache), cache_stats))
+        if hits + misses:
+            info(f"compile cache: {hits} hits, {misses} misses, {hits / (hits + misses):.0%} hit rate")
 
 
 @click.command()
@@ -0,0 +1,197 @@
+"""Support files shared by the submissions of an assignment, for evaluate-submissions.
+
+The Z archives of a spec are extracted once into a template tree keyed by the sha256 of the
+archive, and the OF/IF files it references are copied once into a template keyed by their
+names and content. Each submission then gets the files of the templates by reflink where
+the file system supports it and by copying otherwise, with the mode they have in the
+archive, so they can be changed by the evaluation as before.
+
+Hardlinks are only used when asked for. A hardlinked file is the template file itself: it is
+read-only so a program cannot change what other submissions see, but a program running as
+root (as it usually does in a container) can still write to it, and every submission linked
+to the template, including the ones being evaluated at the same time, sees the change.
+Before a template is used, the size, mode and mtime of its files are compared with what
+they were when it was made, and a template that was changed is made again in a new
+directory, which only protects the submissions that get its files afterwards. The changed
+one stays until close, as other submissions may still be getting their files from it.
+"""
+import fcntl
+import hashlib
+import itertools
+import os
+import shutil
+import stat
+import threading
+from zipfile import ZipFile
+
+from assignment_codeval.commons import debug, sha256_file
+
+# ioctl that makes a copy-on-write clone of a file on btrfs, xfs and similar file systems
+_FICLONE = 0x40049409
+
+_WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+
+class SupportTemplates:
+    """Templates of support files in the directory root, made on first use and removed by close.
+
+    Safe to use from several threads. The counts of files reflinked, hardlinked and copied
+    are kept in the attribute methods.
+
+    Arguments:
+        root: the directory the templates are made in
+        hardlink: hardlink files when they cannot be reflinked, instead of copying them
+    """
+
+    def __init__(self, root, hardlink=False):
+        self.root = root
+        self.hardlink = hardlink
+        self.methods = {"reflink": 0, "hardlink": 0, "copy": 0}
+        self._lock = threading.Lock()
+        # key -> the template directory currently made for it
+        self._current = {}
+        self._generations = itertools.count()
+        # template directory -> {path: ((size, mode, mtime_ns), mode before it was made read-only),
+        # or None for a directory} when it was made
+        self._manifests = {}
+        # path -> ((size, mtime_ns, inode), sha256), so an archive is hashed once per version
+        self._file_digests = {}
+        # (method, st_dev) of the file systems a method failed on, so it is not tried there again
+        self._unsupported = set()
+
+    def _digest(self, path):
+        st = os.stat(path)
+        version = (st.st_size, st.st_mtime_ns, st.st_ino)
+        known = self._file_digests.get(path)
+        if known is None or known[0] != version:
+            known = (version, sha256_file(path))
+            self._file_digests[path] = known
+        return known[1]
+
+    def _intact(self, template):
+        manifest = self._manifests.get(template)
+        if manifest is None:
+            return False
+        for path, version in manifest.items():
+            if version is None:
+                continue
+            try:
+                st = os.lstat(os.path.join(template, path))
+            except OSError:
+                return False
+            if (st.st_size, st.st_mode, st.st_mtime_ns) != version[0]:
+                debug(f"support template {template} changed at {path}, making it again")
+                return False
+        return True
+
+    def _seal(self, template):
+        """Make the files of a new template read-only and remember their state."""
+        manifest = {}
+        for dirpath, dirnames, filenames in os.walk(template):
+            rel_dir = os.path.relpath(dirpath, template)
+            for name in sorted(dirnames):
+                manifest[os.path.normpath(os.path.join(rel_dir, name))] = None
+            for name in sorted(filenames):
+                full_path = os.path.join(dirpath, name)
+                mode = stat.S_IMODE(os.stat(full_path).st_mode)
+                os.chmod(full_path, mode & ~_WRITE_BITS)
+                st = os.lstat(full_path)
+                manifest[os.path.normpath(os.path.join(rel_dir, name))] = \
+                    ((st.st_size, st.st_mode, st.st_mtime_ns), mode)
+        self._manifests[template] = manifest
+
+    def _make(self, key, fill):
+        """Return the template with key, calling fill(directory) to make it if there is no intact one."""
+        with self._lock:
+            template = self._current.get(key)
+            if template is None or not self._intact(template):
+                template = os.path.join(self.root, f"{key}-{next(self._generations)}")
+                os.makedirs(template)
+                fill(template)
+                self._seal(template)
+                self._current[key] = template
+            return template
+
+    def archive(self, zip_path):
+        """Return the template with the files of the zip archive zip_path, extracting it if needed.
+
+        Files get the permissions stored in the archive, as zip members extracted into a
+        submission always did; in the template itself they are read-only.
+        """
+        def extract(template):
+            with ZipFile(zip_path) as zf:
+                for f in zf.infolist():
+                    zf.extract(f, template)
+                    if not f.is_dir():
+                        perms = f.external_attr >> 16
+                        if perms:
+                            os.chmod(os.path.join(template, f.filename), perms)
+
+        return self._make(f"zip-{self._digest(zip_path)}", extract)
+
+    def files(self, source_dir, names):
+        """Return the template with the files names of source_dir that exist, copying them if needed."""
+        # names that lead out of the directory would lead out of the template as well
+        names = [name for name in dict.fromkeys(names)
+                 if not os.path.isabs(name) and not os.path.normpath(name).startswith(os.pardir)
+                 and os.path.isfile(os.path.join(source_dir, name))]
+        digest = hashlib.sha256()
+        for name in names:
+            digest.update(f"{name}\0{self._digest(os.path.join(source_dir, name))}\n".encode())
+
+        def copy(template):
+            for name in names:
+                os.makedirs(os.path.dirname(os.path.join(template, name)), exist_ok=True)
+                shutil.copy(os.path.join(source_dir, name), os.path.join(template, name))
+
+        return self._make(f"files-{digest.hexdigest()}", copy)
+
+    def _place(self, src, dest, mode, device):
+        """Put the template file src at dest; a reflink or copy gets mode, a hardlink stays read-only."""
+        if ("reflink", device) not in self._unsupported:
+            try:
+                with open(src, "rb") as src_f, open(dest, "wb") as dest_f:
+                    fcntl.ioctl(dest_f.fileno(), _FICLONE, src_f.fileno())
+                os.chmod(dest, mode)
+                return "reflink"
+            except OSError:
+                self._unsupported.add(("reflink", device))
+                os.remove(dest)
+        if self.hardlink and ("hardlink", device) not in self._unsupported:
+            try:
+                os.link(src, dest)
+                return "hardlink"
+            except OSError:
+                self._unsupported.add(("hardlink", device))
+        shutil.copyfile(src, dest)
+        os.chmod(dest, mode)
+        return "copy"
+
+    def materialize(self, template, dest_dir):
+        """Put the files of template into dest_dir, replacing files of the same name.
+
+        A file is removed before it is replaced, never written to, since it may be a
+        hardlink into another template.
+
+        Returns:
+            the paths of the files put into dest_dir, relative to it
+        """
+        os.makedirs(dest_dir, exist_ok=True)
+        device = os.stat(dest_dir).st_dev
+        with self._lock:
+            manifest = self._manifests[template]
+        for path, version in manifest.items():
+            dest = os.path.join(dest_dir, path)
+            if version is None:
+                os.makedirs(dest, exist_ok=True)
+                continue
+            if os.path.lexists(dest) and not os.path.isdir(dest):
+                os.remove(dest)
+            method = self._place(os.path.join(template, path), dest, version[1], device)
+            with self._lock:
+                self.methods[method] += 1
+        return [path for path, version in manifest.items() if version is not None]
+
+    def close(self):
+        """Remove every template."""
+        shutil.rmtree(self.root, ignore_errors=True)
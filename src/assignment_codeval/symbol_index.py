@@ -0,0 +1,269 @@
+"""Index the names defined in and used by compiled artifacts, for the CF and NCF tags.
+
+ELF files (executables, shared libraries and object files) are indexed from their symbol
+table (.symtab), which is what `objdump -t` lists: every symbol name, with C++ names
+demangled by a single c++filt run over all of them, plus the names of the sections the
+symbols are in. Java class files are indexed from the constant pool and the member tables:
+the names of the classes, methods and fields they declare or reference.
+
+Each artifact is read once and its index is reused until its mtime or size changes, so
+any number of function checks over the same artifact costs one read.
+"""
+import os
+import re
+import shutil
+import struct
+import subprocess
+
+_ELF_MAGIC = b"\x7fELF"
+_SHT_SYMTAB = 2
+_STT_SECTION = 3
+_SHN_UNDEF = 0
+_SHN_LORESERVE = 0xff00
+_SHN_ABS = 0xfff1
+_SHN_COMMON = 0xfff2
+_SHN_XINDEX = 0xffff
+# What objdump prints in the section column for the special section indexes
+_SPECIAL_SECTIONS = {_SHN_UNDEF: "*UND*", _SHN_ABS: "*ABS*", _SHN_COMMON: "*COM*"}
+
+_CLASS_MAGIC = 0xCAFEBABE
+
+_WORD = re.compile(r"\w+")
+
+
+class _Symbols:
+    """The names found in one artifact."""
+
+    def __init__(self, lines):
+        self.text = "\n".join(lines)
+        self.words = set(_WORD.findall(self.text))
+
+    def contains_word(self, name):
+        """Tell whether name occurs as a whole word, the way `grep -w` matches it."""
+        if _WORD.fullmatch(name):
+            return name in self.words
+        return re.search(rf"(?<!\w){re.escape(name)}(?!\w)", self.text) is not None
+
+
+def _demangle(names):
+    """Demangle C++ names with one c++filt run; names stay as they are without c++filt."""
+    mangled = [name for name in names if name.startswith("_Z")]
+    c_filt = shutil.which("c++filt")
+    if not mangled or c_filt is None:
+        return list(names)
+    result = subprocess.run([c_filt], input="\n".join(mangled) + "\n", stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, text=True)
+    demangled = result.stdout.split("\n")
+    if result.returncode != 0 or len(demangled) < len(mangled):
+        return list(names)
+    lookup = dict(zip(mangled, demangled))
+    return [lookup.get(name, name) for name in names]
+
+
+def _read_at(f, offset, size):
+    f.seek(offset)
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("truncated ELF file")
+    return data
+
+
+def _string_at(table, offset):
+    end = table.find(b"\0", offset)
+    return table[offset:end if end >= 0 else len(table)].decode("utf-8", errors="replace")
+
+
+def read_elf_symbols(path):
+    """Return the symbol table of an ELF file as (symbol name, section name) pairs.
+
+    Like `objdump -t`, section symbols are named after their section and the null symbol
+    is left out. A file without a symbol table (stripped) has no symbols.
+
+    Returns:
+        the list of pairs, None if path is not an ELF file that can be read
+    """
+    try:
+        with open(path, "rb") as f:
+            ident = f.read(16)
+            if len(ident) < 16 or ident[:4] != _ELF_MAGIC or ident[4] not in (1, 2) or ident[5] not in (1, 2):
+                return None
+            is_64 = ident[4] == 2
+            order = "<" if ident[5] == 1 else ">"
+            if is_64:
+                shoff, = struct.unpack(order + "Q", _read_at(f, 0x28, 8))
+                shentsize, shnum, shstrndx = struct.unpack(order + "HHH", _read_at(f, 0x3A, 6))
+                section_format, symbol_format = order + "IIQQQQIIQQ", order + "IBBHQQ"
+            else:
+                shoff, = struct.unpack(order + "I", _read_at(f, 0x20, 4))
+                shentsize, shnum, shstrndx = struct.unpack(order + "HHH", _read_at(f, 0x2E, 6))
+                section_format, symbol_format = order + "IIIIIIIIII", order + "IIIBBH"
+            if shoff == 0:
+                return []
+
+            def section(index):
+                fields = struct.unpack(section_format, _read_at(f, shoff + index * shentsize,
+                                                                struct.calcsize(section_format)))
+                # name, type, offset, size, link, entsize
+                return fields[0], fields[1], fields[4], fields[5], fields[6], fields[9]
+
+            first = section(0)
+            if shnum == 0:
+                shnum = first[3]
+            if shstrndx == _SHN_XINDEX:
+                shstrndx = first[4]
+            sections = [section(index) for index in range(shnum)]
+            shstrtab = _read_at(f, sections[shstrndx][2], sections[shstrndx][3]) if shstrndx < shnum else b""
+            section_names = [_string_at(shstrtab, sh[0]) for sh in sections]
+
+            symbols = []
+            for sh_name, sh_type, sh_offset, sh_size, sh_link, sh_entsize in sections:
+                if sh_type != _SHT_SYMTAB or sh_link >= shnum:
+                    continue
+                strtab = _read_at(f, sections[sh_link][2], sections[sh_link][3])
+                table = _read_at(f, sh_offset, sh_size)
+                entsize = sh_entsize or struct.calcsize(symbol_format)
+                for offset in range(entsize, len(table) - entsize + 1, entsize):
+                    fields = struct.unpack_from(symbol_format, table, offset)
+                    if is_64:
+                        st_name, st_info, _, st_shndx, _, _ = fields
+                    else:
+                        st_name, _, _, st_info, _, st_shndx = fields
+                    if st_shndx in _SPECIAL_SECTIONS:
+                        section_name = _SPECIAL_SECTIONS[st_shndx]
+                    elif st_shndx < min(shnum, _SHN_LORESERVE):
+                        section_name = section_names[st_shndx]
+                    else:
+                        section_name = ""
+                    if st_info & 0xf == _STT_SECTION:
+                        name = section_name
+                    else:
+                        name = _string_at(strtab, st_name)
+                    symbols.append((name, section_name))
+            return symbols
+    except (OSError, ValueError, struct.error, IndexError):
+        return None
+
+
+def read_class_names(path):
+    """Return the names a Java class file declares or references.
+
+    That is the names of its own and every referenced class (as internal name with dots and
+    as each simple name), of the methods and fields it declares, and of the methods and
+    fields it refers to (including invokedynamic call sites).
+
+    Returns:
+        the set of names, None if path is not a class file that can be read
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, _, _, count = struct.unpack_from(">IHHH", data, 0)
+        if magic != _CLASS_MAGIC:
+            return None
+        offset = 10
+        utf8 = {}
+        class_refs = []
+        name_refs = []
+        index = 1
+        while index < count:
+            tag = data[offset]
+            if tag == 1:
+                length, = struct.unpack_from(">H", data, offset + 1)
+                utf8[index] = data[offset + 3:offset + 3 + length].decode("utf-8", errors="replace")
+                offset += 3 + length
+            elif tag in (3, 4):
+                offset += 5
+            elif tag in (5, 6):
+                offset += 9
+                # longs and doubles take up two constant pool entries
+                index += 1
+            elif tag == 7:
+                class_refs.append(struct.unpack_from(">H", data, offset + 1)[0])
+                offset += 3
+            elif tag in (8, 16, 19, 20):
+                offset += 3
+            elif tag in (9, 10, 11, 17, 18):
+                offset += 5
+            elif tag == 12:
+                name_refs.append(struct.unpack_from(">H", data, offset + 1)[0])
+                offset += 5
+            elif tag == 15:
+                offset += 4
+            else:
+                return None
+            index += 1
+
+        # access flags, this class, super class, interfaces
+        interfaces, = struct.unpack_from(">H", data, offset + 6)
+        offset += 8 + 2 * interfaces
+        for _ in range(2):
+            members, = struct.unpack_from(">H", data, offset)
+            offset += 2
+            for _ in range(members):
+                _, name_index, _, attributes = struct.unpack_from(">HHHH", data, offset)
+                name_refs.append(name_index)
+                offset += 8
+                for _ in range(attributes):
+                    length, = struct.unpack_from(">I", data, offset + 2)
+                    offset += 6 + length
+        if offset > len(data):
+            return None
+    except (OSError, struct.error, IndexError):
+        return None
+
+    names = {utf8[ref] for ref in name_refs if ref in utf8}
+    for ref in class_refs:
+        internal = utf8.get(ref)
+        if internal:
+            names.add(internal.replace("/", "."))
+            names.update(part for part in re.split(r"[/$;\[]", internal) if part)
+    return names
+
+
+class SymbolIndex:
+    """Indexes of compiled artifacts by path, rebuilt when an artifact changes."""
+
+    def __init__(self):
+        self._entries = {}
+
+    def _lookup(self, path, build):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        version = (stat.st_mtime_ns, stat.st_size)
+        entry = self._entries.get(path)
+        if entry is None or entry[0] != version:
+            entry = (version, build(path))
+            self._entries[path] = entry
+        return entry[1]
+
+    def elf_uses(self, path, name):
+        """Tell whether name occurs as a word in the demangled symbol table of an ELF file.
+
+        Returns:
+            True or False, None if path is not a readable ELF file
+        """
+        def build(elf_path):
+            symbols = read_elf_symbols(elf_path)
+            if symbols is None:
+                return None
+            names = _demangle([symbol for symbol, _ in symbols])
+            return _Symbols([f"{section} {symbol}" for symbol, (_, section) in zip(names, symbols)])
+
+        symbols = self._lookup(path, build)
+        return None if symbols is None else symbols.contains_word(name)
+
+    def class_uses(self, path, name):
+        """Tell whether a Java class file declares or references a method, field or class named like name.
+
+        Like the search of the `javap -c` output this replaces, name only has to be part of a
+        name, so print matches a call of println.
+
+        Returns:
+            True or False, None if path is not a readable class file
+        """
+        names = self._lookup(path, read_class_names)
+        if names is None:
+            return None
+        return name in names or any(name in declared for declared in names)
@@ -0,0 +1,635 @@
+"""In-process replacement for `diff -U1 -a` on test case output.
+
+This follows the algorithm of GNU diffutils step by step so that the report is byte
+identical to what the diff command prints:
+
+  1. trim the identical prefix and suffix (find_identical_ends in io.c), keeping
+     `horizon` lines of each so the hunks can still shift,
+  2. discard lines that cannot match anything (discard_confusing_lines in analyze.c),
+  3. find the edit script with the divide and conquer middle snake search
+     (compareseq/diag in diffseq.h),
+  4. slide runs of changes to their canonical position (shift_boundaries in analyze.c),
+  5. group changes into hunks and print them (find_hunk/pr_unidiff_hunk in context.c).
+
+Output is generated lazily, so printing stops as soon as `limit` bytes were produced.
+Long outputs that differ almost everywhere would take the pure Python search a long
+time; after WORK_LIMIT steps such comparisons are handed to the diff command itself.
+"""
+import os
+import subprocess
+import tempfile
+import time
+
+# Lines kept around the changes; -U1
+DEFAULT_CONTEXT = 1
+
+_CHUNK = 65536
+_OFFSET_MAX = float("inf")
+
+# Diagonals the middle snake search may visit before the comparison is handed to the
+# diff command; only long outputs that differ almost everywhere get there
+WORK_LIMIT = 2_000_000
+
+
+class _TooExpensive(Exception):
+    pass
+
+
+def _common_prefix_length(a: bytes, b: bytes) -> int:
+    """Return the number of leading bytes a and b have in common."""
+    n = min(len(a), len(b))
+    pos = 0
+    while pos < n:
+        end = min(pos + _CHUNK, n)
+        if a[pos:end] == b[pos:end]:
+            pos = end
+            continue
+        # Binary search the first mismatch inside this chunk
+        lo, hi = pos, end
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if a[lo:mid] == b[lo:mid]:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+    return n
+
+
+def _common_suffix_length(a: bytes, b: bytes, limit: int) -> int:
+    """Return the number of trailing bytes a and b have in common, at most limit."""
+    pos = 0
+    na, nb = len(a), len(b)
+    while pos < limit:
+        step = min(_CHUNK, limit - pos)
+        if a[na - pos - step:na - pos] == b[nb - pos - step:nb - pos]:
+            pos += step
+            continue
+        # Binary search the mismatch closest to the end inside this chunk
+        lo, hi = pos, pos + step
+        while hi - lo > 1:
+            mid = (lo + hi) // 2
+            if a[na - mid:na - lo] == b[nb - mid:nb - lo]:
+                lo = mid
+            else:
+                hi = mid
+        return lo
+    return limit
+
+
+def _split_lines(data: bytes) -> list:
+    """Split data into lines that keep their newline; a last line without one stays bare."""
+    parts = data.split(b"\n")
+    lines = [part + b"\n" for part in parts[:-1]]
+    if parts[-1]:
+        lines.append(parts[-1])
+    return lines
+
+
+def _identical_ends(a: bytes, b: bytes, horizon: int):
+    """Return (prefix_lines, suffix_lines) of a and b that take no part in the comparison."""
+    missing0 = 1 if a and not a.endswith(b"\n") else 0
+    missing1 = 1 if b and not b.endswith(b"\n") else 0
+    buf0 = a + b"\n" if missing0 else a
+    buf1 = b + b"\n" if missing1 else b
+    n0, n1 = len(buf0), len(buf1)
+
+    # Find identical prefix
+    p = _common_prefix_length(buf0, buf1)
+    # Don't mistakenly count missing newline as part of prefix
+    if (n0 - missing0 < p) != (n1 - missing1 < p):
+        p -= 1
+
+    # Skip back to last line-beginning in the prefix, then keep `horizon` more lines
+    p = buf0.rfind(b"\n", 0, p) + 1
+    for _ in range(horizon):
+        if p == 0:
+            break
+        p = buf0.rfind(b"\n", 0, p - 1) + 1
+    prefix_end = p
+
+    # Find identical suffix
+    suffix_begin0 = n0
+    if missing0 == missing1:
+        beg0 = prefix_end + (0 if n0 < n1 else n0 - n1)
+        common = _common_suffix_length(buf0, buf1, n0 - beg0)
+        p0, p1 = n0 - common, n1 - common
+        # Finish a partial line, then give back `horizon` lines of the suffix
+        at_line_start = (p0 == 0 or buf0[p0 - 1] == 0x0A) and (p1 == 0 or buf1[p1 - 1] == 0x0A)
+        i = horizon + (0 if at_line_start else 1)
+        while i > 0 and p0 != n0:
+            i -= 1
+            p0 = buf0.index(b"\n", p0) + 1
+        suffix_begin0 = p0
+
+    prefix_lines = buf0.count(b"\n", 0, prefix_end)
+    suffix_lines = buf0.count(b"\n", suffix_begin0)
+    return prefix_lines, suffix_lines
+
+
+def _discard_confusing_lines(equivs0, equivs1):
+    """Return the discard flags of both files (1 = discard, 0 = keep)."""
+    counts = ({}, {})
+    for f, equivs in enumerate((equivs0, equivs1)):
+        for e in equivs:
+            counts[f][e] = counts[f].get(e, 0) + 1
+
+    discarded = []
+    for f, equivs in enumerate((equivs0, equivs1)):
+        other_counts = counts[1 - f]
+        end = len(equivs)
+        many = 5
+        tem = end // 64
+        # Multiply MANY by approximate square root of number of lines
+        tem >>= 2
+        while tem > 0:
+            many *= 2
+            tem >>= 2
+        discards = [0] * end
+        for i, e in enumerate(equivs):
+            nmatch = other_counts.get(e, 0)
+            if nmatch == 0:
+                discards[i] = 1
+            elif nmatch > many:
+                discards[i] = 2
+        discarded.append(discards)
+
+    # Don't really discard the provisional lines except when they occur in a run of
+    # discardables, with nonprovisionals at the beginning and end
+    for discards in discarded:
+        end = len(discards)
+        i = 0
+        while i < end:
+            if discards[i] == 2:
+                discards[i] = 0
+            elif discards[i] != 0:
+                provisional = 0
+                j = i
+                while j < end:
+                    if discards[j] == 0:
+                        break
+                    if discards[j] == 2:
+                        provisional += 1
+                    j += 1
+                # Cancel provisional discards at end, and shrink the run
+                while j > i and discards[j - 1] == 2:
+                    j -= 1
+                    discards[j] = 0
+                    provisional -= 1
+                length = j - i
+                if provisional * 4 > length:
+                    # If 1/4 of the lines in the run are provisional, keep them all
+                    while j > i:
+                        j -= 1
+                        if discards[j] == 2:
+                            discards[j] = 0
+                else:
+                    minimum = 1
+                    tem = length >> 2
+                    tem >>= 2
+                    while tem > 0:
+                        minimum <<= 1
+                        tem >>= 2
+                    minimum += 1
+                    # Cancel any subrun of MINIMUM or more provisionals within the larger run
+                    j = 0
+                    consec = 0
+                    while j < length:
+                        if discards[i + j] != 2:
+                            consec = 0
+                        else:
+                            consec += 1
+                            if minimum == consec:
+                                # Back up to start of subrun, to cancel it all
+                                j -= consec
+                            elif minimum < consec:
+                                discards[i + j] = 0
+                        j += 1
+                    # Cancel provisionals until 3 nonprovisionals in a row, or 8 lines in
+                    j = 0
+                    consec = 0
+                    while j < length:
+                        if j >= 8 and discards[i + j] == 1:
+                            break
+                        if discards[i + j] == 2:
+                            consec = 0
+                            discards[i + j] = 0
+                        elif discards[i + j] == 0:
+                            consec = 0
+                        else:
+                            consec += 1
+                        if consec == 3:
+                            break
+                        j += 1
+                    # I advances to the last line of the run
+                    i += length - 1
+                    # Same thing, from end
+                    j = 0
+                    consec = 0
+                    while j < length:
+                        if j >= 8 and discards[i - j] == 1:
+                            break
+                        if discards[i - j] == 2:
+                            consec = 0
+                            discards[i - j] = 0
+                        elif discards[i - j] == 0:
+                            consec = 0
+                        else:
+                            consec += 1
+                        if consec == 3:
+                            break
+                        j += 1
+            i += 1
+    return discarded
+
+
+def _diag(xv, yv, xoff, xlim, yoff, ylim, find_minimal, fd, bd, too_expensive, work):
+    """Find the midpoint of the shortest edit script for a part of the sequences.
+
+    Returns (xmid, ymid, lo_minimal, hi_minimal). fd/bd are dicts of diagonal -> x,
+    work is a one element list counting down the diagonals left to visit.
+    """
+    dmin = xoff - ylim
+    dmax = xlim - yoff
+    fmid = xoff - yoff
+    bmid = xlim - ylim
+    fmin = fmax = fmid
+    bmin = bmax = bmid
+    odd = (fmid - bmid) & 1
+
+    fd[fmid] = xoff
+    bd[bmid] = xlim
+
+    c = 1
+    while True:
+        work[0] -= fmax - fmin + bmax - bmin + 4
+        if work[0] < 0:
+            raise _TooExpensive()
+
+        # Extend the top-down search by an edit step in each diagonal
+        if fmin > dmin:
+            fmin -= 1
+            fd[fmin - 1] = -1
+        else:
+            fmin += 1
+        if fmax < dmax:
+            fmax += 1
+            fd[fmax + 1] = -1
+        else:
+            fmax -= 1
+        for d in range(fmax, fmin - 1, -2):
+            tlo = fd[d - 1]
+            thi = fd[d + 1]
+            x = thi if tlo < thi else tlo + 1
+            y = x - d
+            while x < xlim and y < ylim and xv[x] == yv[y]:
+                x += 1
+                y += 1
+            fd[d] = x
+            if odd and bmin <= d <= bmax and bd[d] <= x:
+                return x, y, True, True
+
+        # Similarly extend the bottom-up search
+        if bmin > dmin:
+            bmin -= 1
+            bd[bmin - 1] = _OFFSET_MAX
+        else:
+            bmin += 1
+        if bmax < dmax:
+            bmax += 1
+            bd[bmax + 1] = _OFFSET_MAX
+        else:
+            bmax -= 1
+        for d in range(bmax, bmin - 1, -2):
+            tlo = bd[d - 1]
+            thi = bd[d + 1]
+            x = tlo if tlo < thi else thi - 1
+            y = x - d
+            while xoff < x and yoff < y and xv[x - 1] == yv[y - 1]:
+                x -= 1
+                y -= 1
+            bd[d] = x
+            if not odd and fmin <= d <= fmax and x <= fd[d]:
+                return x, y, True, True
+
+        if not find_minimal and c >= too_expensive:
+            # Gone well beyond the call of duty: report halfway between the best results
+            fxybest = -1
+            fxbest = 0
+            for d in range(fmax, fmin - 1, -2):
+                x = min(fd[d], xlim)
+                y = x - d
+                if ylim < y:
+                    x = ylim + d
+                    y = ylim
+                if fxybest < x + y:
+                    fxybest = x + y
+                    fxbest = x
+            bxybest = _OFFSET_MAX
+            bxbest = 0
+            for d in range(bmax, bmin - 1, -2):
+                x = max(xoff, bd[d])
+                y = x - d
+                if y < yoff:
+                    x = yoff + d
+                    y = yoff
+                if x + y < bxybest:
+                    bxybest = x + y
+                    bxbest = x
+            if (xlim + ylim) - bxybest < fxybest - (xoff + yoff):
+                return fxbest, fxybest - fxbest, True, False
+            return bxbest, bxybest - bxbest, False, True
+        c += 1
+
+
+def _compareseq(xv, yv, changed0, changed1, real0, real1, work_limit):
+    """Mark the lines of the shortest edit script between xv and yv as changed."""
+    diags = len(xv) + len(yv) + 3
+    too_expensive = 1
+    while diags:
+        too_expensive <<= 1
+        diags >>= 2
+    too_expensive = max(4096, too_expensive)
+    fd = {}
+    bd = {}
+    work = [work_limit]
+
+    stack = [(0, len(xv), 0, len(yv), False)]
+    while stack:
+        xoff, xlim, yoff, ylim, find_minimal = stack.pop()
+
+        # Slide down the bottom initial diagonal
+        while xoff < xlim and yoff < ylim and xv[xoff] == yv[yoff]:
+            xoff += 1
+            yoff += 1
+        # Slide up the top initial diagonal
+        while xoff < xlim and yoff < ylim and xv[xlim - 1] == yv[ylim - 1]:
+            xlim -= 1
+            ylim -= 1
+
+        if xoff == xlim:
+            for y in range(yoff, ylim):
+                changed1[real1[y] + 1] = 1
+        elif yoff == ylim:
+            for x in range(xoff, xlim):
+                changed0[real0[x] + 1] = 1
+        else:
+            xmid, ymid, lo_minimal, hi_minimal = _diag(
+                xv, yv, xoff, xlim, yoff, ylim, find_minimal, fd, bd, too_expensive, work)
+            stack.append((xmid, xlim, ymid, ylim, hi_minimal))
+            stack.append((xoff, xmid, yoff, ymid, lo_minimal))
+
+
+def _shift_boundaries(changed, other_changed, equivs):
+    """Slide each run of changes to its canonical position.
+
+    changed/other_changed are indexed with an offset of one so that index 0 and n + 1
+    are the always-zero sentinels.
+    """
+    i_end = len(equivs)
+    i = 0
+    j = 0
+    while True:
+        # Scan forwards to find beginning of another run of changes
+        while i < i_end and not changed[i + 1]:
+            while other_changed[j + 1]:
+                j += 1
+            j += 1
+            i += 1
+        if i == i_end:
+            break
+        start = i
+
+        # Find the end of this run of changes
+        i += 1
+        while changed[i + 1]:
+            i += 1
+        while other_changed[j + 1]:
+            j += 1
+
+        while True:
+            runlength = i - start
+
+            # Move the changed region back, so long as the previous unchanged line
+            # matches the last changed one
+            while start and equivs[start - 1] == equivs[i - 1]:
+                start -= 1
+                changed[start + 1] = 1
+                i -= 1
+                changed[i + 1] = 0
+                while changed[start]:
+                    start -= 1
+                j -= 1
+                while other_changed[j + 1]:
+                    j -= 1
+
+            # CORRESPONDING is the end of the run at the last point where it lines up
+            # with a changed run in the other file
+            corresponding = i if other_changed[j] else i_end
+
+            # Move the changed region forward, so long as the first changed line
+            # matches the following unchanged one
+            while i != i_end and equivs[start] == equivs[i]:
+                changed[start + 1] = 0
+                start += 1
+                changed[i + 1] = 1
+                i += 1
+                while changed[i + 1]:
+                    i += 1
+                j += 1
+                while other_changed[j + 1]:
+                    j += 1
+                    corresponding = i
+
+            if runlength == i - start:
+                break
+
+        # If possible, move the fully-merged run of changes back to a corresponding
+        # run in the other file
+        while corresponding < i:
+            start -= 1
+            changed[start + 1] = 1
+            i -= 1
+            changed[i + 1] = 0
+            j -= 1
+            while other_changed[j + 1]:
+                j -= 1
+
+
+def _build_script(changed0, changed1, n0, n1):
+    """Return the changes as (line0, line1, deleted, inserted) tuples in order."""
+    script = []
+    i0, i1 = n0, n1
+    while i0 >= 0 or i1 >= 0:
+        if changed0[i0] or changed1[i1]:
+            line0, line1 = i0, i1
+            while changed0[i0]:
+                i0 -= 1
+            while changed1[i1]:
+                i1 -= 1
+            script.append((i0, i1, line0 - i0, line1 - i1))
+        i0 -= 1
+        i1 -= 1
+    script.reverse()
+    return script
+
+
+def _edit_script(lines0, lines1, horizon, work_limit):
+    """Return the GNU diff edit script of two line lists, in absolute line numbers."""
+    a = b"".join(lines0)
+    b = b"".join(lines1)
+    prefix_lines, suffix_lines = _identical_ends(a, b, horizon)
+    region0 = lines0[prefix_lines:len(lines0) - suffix_lines]
+    region1 = lines1[prefix_lines:len(lines1) - suffix_lines]
+
+    # Real equivalence classes start at 1
+    classes = {}
+    equivs0 = [classes.setdefault(line, len(classes) + 1) for line in region0]
+    equivs1 = [classes.setdefault(line, len(classes) + 1) for line in region1]
+
+    discarded = _discard_confusing_lines(equivs0, equivs1)
+
+    # changed[k + 1] is the flag of line k; both ends are zero sentinels
+    changed0 = [0] * (len(region0) + 2)
+    changed1 = [0] * (len(region1) + 2)
+    real0 = [i for i, d in enumerate(discarded[0]) if d == 0]
+    real1 = [i for i, d in enumerate(discarded[1]) if d == 0]
+    for i, d in enumerate(discarded[0]):
+        if d:
+            changed0[i + 1] = 1
+    for i, d in enumerate(discarded[1]):
+        if d:
+            changed1[i + 1] = 1
+
+    _compareseq([equivs0[i] for i in real0], [equivs1[i] for i in real1],
+                changed0, changed1, real0, real1, work_limit)
+
+    _shift_boundaries(changed0, changed1, equivs0)
+    _shift_boundaries(changed1, changed0, equivs1)
+
+    return [(line0 + prefix_lines, line1 + prefix_lines, deleted, inserted)
+            for line0, line1, deleted, inserted
+            in _build_script(changed0, changed1, len(region0), len(region1))]
+
+
+def _range(first, last):
+    """Format a unified diff line range (print_unidiff_number_range in context.c)."""
+    trans_a, trans_b = first + 1, last + 1
+    if trans_b < trans_a:
+        return f"{trans_b},0"
+    if trans_b == trans_a:
+        return f"{trans_b}"
+    return f"{trans_a},{trans_b - trans_a + 1}"
+
+
+def _format_line(mark, line):
+    if line.endswith(b"\n"):
+        return mark + line
+    return mark + line + b"\n\\ No newline at end of file\n"
+
+
+def _hunks(lines0, lines1, script, context):
+    """Yield the unified diff hunks piece by piece: a header, then one printed line at a time."""
+    thresh = 2 * context + 1
+    k = 0
+    while k < len(script):
+        # Group changes that are within the threshold distance of each other
+        end = k
+        while end + 1 < len(script):
+            top0 = script[end][0] + script[end][2]
+            if script[end + 1][0] - top0 >= thresh:
+                break
+            end += 1
+        hunk = script[k:end + 1]
+        k = end + 1
+
+        first0 = hunk[0][0]
+        first1 = hunk[0][1]
+        last0 = hunk[-1][0] + hunk[-1][2] - 1
+        last1 = hunk[-1][1] + hunk[-1][3] - 1
+
+        # Include a context's width before and after
+        first0 = max(first0 - context, 0)
+        first1 = max(first1 - context, 0)
+        last0 = min(last0 + context, len(lines0) - 1)
+        last1 = min(last1 + context, len(lines1) - 1)
+
+        yield f"@@ -{_range(first0, last0)} +{_range(first1, last1)} @@\n".encode()
+        i, j = first0, first1
+        changes = iter(hunk)
+        change = next(changes, None)
+        while i <= last0 or j <= last1:
+            if change is None or i < change[0]:
+                yield _format_line(b" ", lines0[i])
+                i += 1
+                j += 1
+                continue
+            for _ in range(change[2]):
+                yield _format_line(b"-", lines0[i])
+                i += 1
+            for _ in range(change[3]):
+                yield _format_line(b"+", lines1[j])
+                j += 1
+            change = next(changes, None)
+
+
+def format_label(path, mtime_ns=None):
+    """Return a header label like diff prints for a file: the path and its modification time."""
+    if mtime_ns is None:
+        mtime_ns = time.time_ns()
+    seconds, nanoseconds = divmod(mtime_ns, 1_000_000_000)
+    tm = time.localtime(seconds)
+    return (f"{path}\t{time.strftime('%Y-%m-%d %H:%M:%S', tm)}.{nanoseconds:09d} "
+            f"{time.strftime('%z', tm)}")
+
+
+def _run_diff(a: bytes, b: bytes, label_a: str, label_b: str, context: int) -> bytes:
+    """Compare a and b with the diff command."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = []
+        for name, data in (("a", a), ("b", b)):
+            path = os.path.join(tmpdir, name)
+            with open(path, "wb") as f:
+                f.write(data)
+            paths.append(path)
+        return subprocess.run(
+            ["diff", f"-U{context}", "-a", "--label", label_a, "--label", label_b, *paths],
+            stdout=subprocess.PIPE,
+        ).stdout
+
+
+def unified_diff(a: bytes, b: bytes, label_a: str, label_b: str,
+                 context: int = DEFAULT_CONTEXT, limit: int | None = None,
+                 work_limit: int = WORK_LIMIT) -> bytes:
+    """Return what `diff -U<context> -a` prints when comparing a with b.
+
+    Arguments:
+        a: content of the first ("---") file
+        b: content of the second ("+++") file
+        label_a: header label of the first file, see format_label
+        label_b: header label of the second file
+        context: number of context lines around each change
+        limit: stop once at least this many bytes have been produced
+        work_limit: search effort after which the diff command is run instead
+
+    Returns:
+        the diff output, empty when a and b are identical
+    """
+    if a == b:
+        return b""
+
+    lines0 = _split_lines(a)
+    lines1 = _split_lines(b)
+    try:
+        script = _edit_script(lines0, lines1, context, work_limit)
+    except _TooExpensive:
+        return _run_diff(a, b, label_a, label_b, context)
+
+    out = [f"--- {label_a}\n+++ {label_b}\n".encode()]
+    size = len(out[0])
+    for piece in _hunks(lines0, lines1, script, context):
+        if limit is not None and size >= limit:
+            break
+        out.append(piece)
+        size += len(piece)
+    return b"".join(out)
@@ -0,0 +1,184 @@
+"""Unit tests for compile_cache.py (content-addressed cache of C tag results)."""
+import json
+import os
+import shutil
+
+import pytest
+from click.testing import CliRunner
+
+import assignment_codeval.evaluate as ev_mod
+from assignment_codeval.compile_cache import CompileCache, read_stats, toolchain_version
+from assignment_codeval.evaluate import run_evaluation
+
+needs_gcc = pytest.mark.skipif(shutil.which("gcc") is None, reason="gcc not installed")
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    work = tmp_path / "work"
+    work.mkdir()
+    monkeypatch.chdir(work)
+    # run-evaluation leaves the cache of its last run behind
+    monkeypatch.setattr(ev_mod, "compile_cache", None)
+    return work
+
+
+class TestKey:
+    def test_same_inputs_same_key(self, workdir, tmp_path):
+        (workdir / "a.c").write_text("int main() {}\n")
+        cache = CompileCache(str(tmp_path / "cache"))
+        assert cache.key("gcc a.c -o a", ["a.c"]) == cache.key("gcc a.c -o a", ["a.c"])
+
+    def test_source_content_changes_key(self, workdir, tmp_path):
+        cache = CompileCache(str(tmp_path / "cache"))
+        (workdir / "a.c").write_text("int main() {}\n")
+        before = cache.key("gcc a.c -o a", ["a.c"])
+        (workdir / "a.c").write_text("int main() { return 1; }\n")
+        assert cache.key("gcc a.c -o a", ["a.c"]) != before
+
+    def test_command_changes_key(self, workdir, tmp_path):
+        cache = CompileCache(str(tmp_path / "cache"))
+        (workdir / "a.c").write_text("int main() {}\n")
+        assert cache.key("gcc a.c -o a", ["a.c"]) != cache.key("gcc -O2 a.c -o a", ["a.c"])
+
+    def test_headers_are_inputs(self, workdir, tmp_path):
+        cache = CompileCache(str(tmp_path / "cache"))
+        (workdir / "a.c").write_text('#include "a.h"\n')
+        (workdir / "a.h").write_text("#define X 1\n")
+        before = cache.key("gcc a.c -o a", ["a.c"])
+        (workdir / "a.h").write_text("#define X 2\n")
+        assert cache.key("gcc a.c -o a", ["a.c"]) != before
+
+    def test_other_files_ignored_when_sources_named(self, workdir, tmp_path):
+        cache = CompileCache(str(tmp_path / "cache"))
+        (workdir / "a.c").write_text("int main() {}\n")
+        before = cache.key("gcc a.c -o a", ["a.c"])
+        (workdir / "notes.txt").write_text("not compiled\n")
+        assert cache.key("gcc a.c -o a", ["a.c"]) == before
+
+    def test_build_tool_hashes_whole_tree(self, workdir, tmp_path):
+        cache = CompileCache(str(tmp_path / "cache"))
+        (workdir / "Makefile").write_text("all:\n")
+        before = cache.key("make", [])
+        (workdir / "data.txt").write_text("used by the build\n")
+        assert cache.key("make", []) != before
+
+    def test_known_outputs_ignored_by_build_tools(self, workdir, tmp_path):
+        cache = CompileCache(str(tmp_path / "cache"))
+        (workdir / "Makefile").write_text("all:\n")
+        key = cache.key("make", [])
+        before = cache.snapshot()
+        (workdir / "prog").write_text("built")
+        cache.store(key, "make", before)
+        assert cache.key("make", []) == key
+
+    def test_excluded_files_ignored(self, workdir, tmp_path):
+        cache = CompileCache(str(tmp_path / "cache"))
+        (workdir / "Makefile").write_text("all:\n")
+        before = cache.key("make", [], exclude=["codeval.txt", ".testing"])
+        (workdir / "codeval.txt").write_text("T ./prog\n")
+        (workdir / ".testing").mkdir()
+        (workdir / ".testing" / "compilelog").write_text("log\n")
+        assert cache.key("make", [], exclude=["codeval.txt", ".testing"]) == before
+
+    def test_toolchain_version(self):
+        versions = toolchain_version("cd src && CC=clang make -j2; ./run")
+        assert versions.startswith("make: ")
+        assert "\ncc: " in versions
+        assert "\nrun: " in versions
+        assert "cd:" not in versions
+
+
+class TestStoreRestore:
+    def test_round_trip(self, workdir, tmp_path):
+        cache = CompileCache(str(tmp_path / "cache"))
+        (workdir / "old.o").write_text("stale")
+        before = cache.snapshot()
+        (workdir / "prog").write_text("#!/bin/sh\necho built\n")
+        os.chmod(workdir / "prog", 0o755)
+        (workdir / "build").mkdir()
+        (workdir / "build" / "lib.a").write_text("archive")
+        os.remove(workdir / "old.o")
+        assert cache.store("k" * 64, "make", before, "warning: unused\n")
+
+        shutil.rmtree(workdir / "build")
+        os.remove(workdir / "prog")
+        (workdir / "old.o").write_text("stale")
+        assert cache.restore("k" * 64) == "warning: unused\n"
+        assert (workdir / "prog").read_text() == "#!/bin/sh\necho built\n"
+        assert os.access(workdir / "prog", os.X_OK)
+        assert (workdir / "build" / "lib.a").read_text() == "archive"
+        assert not (workdir / "old.o").exists()
+
+    def test_miss(self, workdir, tmp_path):
+        assert CompileCache(str(tmp_path / "cache")).restore("0" * 64) is None
+
+    def test_identical_outputs_share_a_blob(self, workdir, tmp_path):
+        cache = CompileCache(str(tmp_path / "cache"))
+        for key in ("a" * 64, "b" * 64):
+            before = cache.snapshot()
+            (workdir / f"prog-{key[0]}").write_text("same bytes")
+            cache.store(key, "make", before)
+        blobs = [name for _, _, names in os.walk(tmp_path / "cache" / "blobs") for name in names]
+        assert len(blobs) == 1
+
+    def test_stats(self, tmp_path):
+        cache = CompileCache(str(tmp_path / "cache"))
+        cache.record("a" * 64, False)
+        cache.record("a" * 64, True)
+        cache.record("a" * 64, True)
+        assert read_stats(str(tmp_path / "cache")) == (2, 1)
+
+
+class TestRunEvaluationCompileCache:
+    def _run(self, workdir, cache_dir):
+        ev_mod.test_case_count = 0
+        results_file = workdir.parent / "results.json"
+        result = CliRunner().invoke(run_evaluation, [
+            "codeval.txt", "--compile-cache", str(cache_dir), "--results-file", str(results_file)])
+        return result, json.loads(results_file.read_text())
+
+    def test_second_compile_restored(self, workdir, tmp_path):
+        (workdir / "prog.src").write_text("echo hi\n")
+        (workdir / "codeval.txt").write_text(
+            "C echo compiled >> ../count && cp prog.src prog && chmod +x prog\nT ./prog\nO hi\n")
+        result, results = self._run(workdir, tmp_path / "cache")
+        assert result.exit_code == 0, result.output
+        assert results["compile_cache"] == {"hits": 0, "misses": 1}
+
+        (workdir / "prog").write_text("left over from the last run")
+        # a spec change alone does not invalidate the compile
+        (workdir / "codeval.txt").write_text(
+            "C echo compiled >> ../count && cp prog.src prog && chmod +x prog\nT ./prog\nO hi\nT ./prog\nO hi\n")
+        result, results = self._run(workdir, tmp_path / "cache")
+        assert result.exit_code == 0, result.output
+        assert results["compile_cache"] == {"hits": 1, "misses": 0}
+        assert (tmp_path / "count").read_text() == "compiled\n"
+        assert (workdir / "prog").read_text() == "echo hi\n"
+
+    def test_changed_source_recompiled(self, workdir, tmp_path):
+        (workdir / "prog.src").write_text("echo hi\n")
+        (workdir / "codeval.txt").write_text("C cp prog.src prog && chmod +x prog\nT ./prog\nO hi\n")
+        self._run(workdir, tmp_path / "cache")
+        (workdir / "prog.src").write_text("echo bye\n")
+        result, results = self._run(workdir, tmp_path / "cache")
+        assert result.exit_code == 2
+        assert results["compile_cache"] == {"hits": 0, "misses": 1}
+
+    def test_failed_compile_not_cached(self, workdir, tmp_path):
+        (workdir / "codeval.txt").write_text("C echo broken && false\nT true\n")
+        self._run(workdir, tmp_path / "cache")
+        result, results = self._run(workdir, tmp_path / "cache")
+        assert result.exit_code == 1
+        assert "broken" in result.output
+        assert results["compile_cache"] == {"hits": 0, "misses": 1}
+
+    @needs_gcc
+    def test_gcc(self, workdir, tmp_path):
+        (workdir / "hello.c").write_text('#include <stdio.h>\nint main() { puts("hi"); return 0; }\n')
+        (workdir / "codeval.txt").write_text("C gcc hello.c -o hello\nT ./hello\nO hi\n")
+        self._run(workdir, tmp_path / "cache")
+        os.remove(workdir / "hello")
+        result, results = self._run(workdir, tmp_path / "cache")
+        assert result.exit_code == 0, result.output
+        assert results["compile_cache"]["hits"] == 1
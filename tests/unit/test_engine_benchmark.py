@@ -0,0 +1,97 @@
+"""Unit tests for engine_benchmark.py (benchmark-evaluation on synthetic specs)."""
+import json
+import shutil
+
+import pytest
+from click.testing import CliRunner
+
+import assignment_codeval.evaluate as ev_mod
+from assignment_codeval.engine_benchmark import (
+    BASELINE_VERSION,
+    Scenario,
+    benchmark_evaluation,
+    find_regressions,
+    write_scenario,
+)
+from assignment_codeval.evaluate import run_evaluation
+
+
+def _result(wall, **phases):
+    return {"wall": wall, "total": wall, "phases": phases}
+
+
+class TestWriteScenario:
+    @pytest.mark.parametrize("compile_source", [
+        pytest.param(True, marks=pytest.mark.skipif(shutil.which("g++") is None, reason="g++ not installed")),
+        False,
+    ])
+    def test_spec_passes(self, tmp_path, monkeypatch, compile_source):
+        monkeypatch.chdir(tmp_path)
+        write_scenario(Scenario("small", tests=4, io_bytes=300, function_checks=5, object_checks=3), str(tmp_path),
+                       compile_source)
+        ev_mod.test_case_count = 0
+        result = CliRunner().invoke(run_evaluation, ["codeval.txt", "--timings-file", "timings.json"])
+        assert result.exit_code == 0, result.output
+        assert result.output.count("Passed") == 4
+        assert result.output.count("PASSED") == 8
+        assert "FAILED" not in result.output
+        assert len((tmp_path / "data/case1.txt").read_text()) == 300
+        # CF reads the symbol table of the object file when there is one
+        assert (tmp_path / "prog.o").exists() == compile_source
+
+        timings = json.loads((tmp_path / "timings.json").read_text())
+        assert {"plan", "compile", "tests", "checks", "spec"} <= set(timings["phases"])
+        assert sum(timings["phases"].values()) <= timings["total"]
+
+    def test_scaled(self):
+        scenario = Scenario("s", tests=200, io_bytes=64, function_checks=40).scaled(0.01)
+        assert (scenario.tests, scenario.function_checks, scenario.io_bytes) == (2, 0, 64)
+
+
+class TestFindRegressions:
+    def test_slower_phase(self):
+        regressions = find_regressions({"a": _result(1.0, tests=0.9)}, {"a": _result(1.0, tests=0.5)}, 0.25, 0.05)
+        assert len(regressions) == 1
+        assert regressions[0].startswith("a phase/tests: 0.900s, baseline 0.500s")
+
+    def test_within_threshold_or_min_delta(self):
+        assert not find_regressions({"a": _result(1.2, tests=0.02)}, {"a": _result(1.0, tests=0.01)}, 0.25, 0.05)
+
+    def test_unknown_scenario_and_phase_ignored(self):
+        assert not find_regressions({"a": _result(1.0, checks=5.0), "b": _result(9.0)}, {"a": _result(1.0)}, 0.25, 0.05)
+
+
+class TestBenchmarkCommand:
+    def test_save_and_compare(self, tmp_path):
+        runner = CliRunner()
+        baseline = tmp_path / "baseline.json"
+        args = ["--scenario", "many-tests", "--scale", "0.02", "--repeat", "1"]
+        result = runner.invoke(benchmark_evaluation, args + ["--save-baseline", str(baseline)])
+        assert result.exit_code == 0, result.output
+        saved = json.loads(baseline.read_text())
+        assert set(saved["scenarios"]) == {"many-tests"}
+        assert saved["scenarios"]["many-tests"]["phases"]["tests"] > 0
+
+        result = runner.invoke(benchmark_evaluation, args + ["--baseline", str(baseline), "--threshold", "100",
+                                                             "--min-delta", "10"])
+        assert result.exit_code == 0, result.output
+        assert "no regressions" in result.output
+
+        for times in [saved["scenarios"]["many-tests"]] + [saved["scenarios"]["many-tests"]["phases"]]:
+            for name in times:
+                if isinstance(times[name], float):
+                    times[name] /= 1000
+        baseline.write_text(json.dumps(saved))
+        result = runner.invoke(benchmark_evaluation, args + ["--baseline", str(baseline), "--min-delta", "0"])
+        assert result.exit_code == 1
+        assert "REGRESSION many-tests wall" in result.output
+
+    @pytest.mark.parametrize("change, message", [({"version": 0}, "version"), ({"scale": 1.0}, "--scale"),
+                                                 ({"compiled": shutil.which("g++") is None}, "g++")])
+    def test_incompatible_baseline(self, tmp_path, change, message):
+        baseline = tmp_path / "baseline.json"
+        baseline.write_text(json.dumps({"version": BASELINE_VERSION, "scale": 0.02,
+                                        "compiled": shutil.which("g++") is not None, "scenarios": {}, **change}))
+        result = CliRunner().invoke(benchmark_evaluation, ["--scale", "0.02", "--baseline", str(baseline)])
+        assert result.exit_code == 2
+        assert message in result.output
@@ -1,5 +1,6 @@
 """Unit tests for pure helper functions in evaluate.py."""
 import os
+import random
 import pytest
 
 from assignment_codeval.evaluate import (
@@ -225,3 +226,89 @@ class TestRenderDiffOutputEdgeCases:
 
     def test_single_newline(self):
         assert _render_diff_output(b"\n") == "$\n"
+
+
+def _reference_render(raw_bytes):
+    """The byte-at-a-time _render_diff_output that the chunked one replaced."""
+    result = []
+    i = 0
+    n = len(raw_bytes)
+    while i < n:
+        b = raw_bytes[i]
+        if b == 0x0A:
+            result.append("$\n")
+            i += 1
+        elif 0x20 <= b <= 0x7E:
+            result.append(chr(b))
+            i += 1
+        elif b <= 0x1F:
+            result.append("^" + chr(b + 0x40))
+            i += 1
+        elif b == 0x7F:
+            result.append("^?")
+            i += 1
+        else:
+            seq_len = 0
+            if (b & 0xE0) == 0xC0:
+                seq_len = 2
+            elif (b & 0xF0) == 0xE0:
+                seq_len = 3
+            elif (b & 0xF8) == 0xF0:
+                seq_len = 4
+            decoded_char = None
+            if seq_len >= 2 and i + seq_len <= n:
+                try:
+                    decoded_char = raw_bytes[i:i + seq_len].decode("utf-8")
+                except UnicodeDecodeError:
+                    pass
+            if decoded_char and len(decoded_char) == 1 and decoded_char.isprintable():
+                result.append(decoded_char)
+                i += seq_len
+            elif decoded_char and len(decoded_char) == 1:
+                for j in range(seq_len):
+                    result.append(f"\\x{raw_bytes[i + j]:02X}")
+                i += seq_len
+            else:
+                result.append(f"\\x{b:02X}")
+                i += 1
+    output = "".join(result)
+    if output and not output.endswith("\n"):
+        output += "$"
+    return output
+
+
+class TestRenderDiffOutputMatchesReference:
+    CASES = [
+        b"", b"\n", b"plain text\nsecond line\n", b"no newline", b"\t\x00\x1b[31mred\x1b[0m\r\n",
+        b"\x7f\x80\xff", "é€😀\n".encode(), "\u0085​  x\n".encode(),
+        b"\xc3", b"\xc3\xc3\xa9", b"\xe2\x82", b"\xe2\x82A", b"\xf0\x9f\x98", b"\xf0\x9f\x98\x80\x80",
+        b"\xc0\xaf", b"\xe0\x80\x80", b"\xed\xa0\x80", b"\xf4\x90\x80\x80", b"\xf5\x80\x80\x80",
+        b"\xf8\x88\x80\x80\x80", b"a\\x41b", "﻿BOM\n".encode(), "\U000e0001tag".encode(),
+    ]
+
+    @pytest.mark.parametrize("raw", CASES)
+    def test_cases(self, raw):
+        assert _render_diff_output(raw) == _reference_render(raw)
+
+    def test_every_byte_value(self):
+        raw = bytes(range(256))
+        assert _render_diff_output(raw) == _reference_render(raw)
+        for b in range(256):
+            assert _render_diff_output(bytes([b, 0x0A])) == _reference_render(bytes([b, 0x0A]))
+
+    def test_random_bytes(self):
+        rng = random.Random(1234)
+        alphabet = list(range(256)) + [0x41] * 200 + [0x0A] * 20 + [0x80, 0xBF, 0xC3, 0xE2, 0xF0] * 20
+        for _ in range(3000):
+            raw = bytes(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+            assert _render_diff_output(raw) == _reference_render(raw), raw
+
+    def test_random_text(self):
+        rng = random.Random(5678)
+        for _ in range(2000):
+            text = "".join(chr(rng.choice([rng.randint(0, 0x7F), rng.randint(0x80, 0x10FFFF)]))
+                           for _ in range(rng.randint(0, 20)))
+            raw = text.encode("utf-8", errors="surrogatepass")
+            cut = rng.randint(0, len(raw))
+            for chunk in (raw, raw[:cut]):
+                assert _render_diff_output(chunk) == _reference_render(chunk), chunk
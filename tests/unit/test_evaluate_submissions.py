@@ -1,6 +1,7 @@
 """Tests for evaluate_submissions command."""
 
 import os
+import re
 import tempfile
 import zipfile
 
@@ -310,3 +311,466 @@ class TestApplySubstitutions:
 
     def test_deletion(self):
         assert _apply_substitutions("hello world", [("world", "")]) == "hello "
+
+
+def _setup_evaluation(tmp_path, monkeypatch, codeval, students=("12345",)):
+    """Create a codeval dir and submissions tree, with a RUN command that runs locally."""
+    codeval_dir = tmp_path / "codeval"
+    codeval_dir.mkdir()
+    (codeval_dir / "HW1.codeval").write_text(codeval)
+    submissions_dir = tmp_path / "submissions"
+    for student in students:
+        (submissions_dir / "Course" / "HW1" / student / "submission").mkdir(parents=True)
+    app_dir = tmp_path / "app"
+    app_dir.mkdir()
+    (app_dir / "codeval.ini").write_text("[RUN]\ncommand = cd SUBMISSIONS && EVALUATE\n")
+    monkeypatch.setattr(click, "get_app_dir", lambda name: str(app_dir / name))
+    monkeypatch.chdir(tmp_path)
+    return codeval_dir, submissions_dir
+
+
+class TestEvaluateSubmissionsRun:
+    """Runs evaluate_submissions end to end without docker."""
+
+    def test_comments_written(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        _setup_evaluation(tmp_path, monkeypatch, "T echo hi\nO hi\n")
+        result = CliRunner().invoke(evaluate_submissions, ["codeval", "--submissions-dir", "submissions"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        comments = (tmp_path / "submissions/Course/HW1/12345/comments.txt").read_text()
+        assert "Test case 1 of 1" in comments
+        assert "Passed" in comments
+        assert not (tmp_path / "submissions/Course/HW1/12345/resource_usage.json").exists()
+
+    def test_resource_usage_saved(self, tmp_path, monkeypatch):
+        import json
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        _setup_evaluation(tmp_path, monkeypatch, "T echo hi\nO hi\n")
+        result = CliRunner().invoke(evaluate_submissions,
+                                    ["codeval", "--submissions-dir", "submissions", "--resource-usage"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        student_dir = tmp_path / "submissions/Course/HW1/12345"
+        usage = json.loads((student_dir / "resource_usage.json").read_text())
+        assert [t["test_case"] for t in usage["tests"]] == [1]
+        assert not (student_dir / "submission/resource_usage.json").exists()
+
+    def test_results_saved(self, tmp_path, monkeypatch):
+        import json
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        _setup_evaluation(tmp_path, monkeypatch, "T echo hi\nO hi\nHT echo bye\nO hello\n")
+        student_dir = tmp_path / "submissions/Course/HW1/12345"
+        (student_dir / "results.json").write_text("stale")
+        result = CliRunner().invoke(evaluate_submissions, ["codeval", "--submissions-dir", "submissions"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        results = json.loads((student_dir / "results.json").read_text())
+        assert (results["passed"], results["failed"]) == (1, 1)
+        assert [(t["test_case"], t["status"], t["hidden"]) for t in results["tests"]] == [
+            (1, "passed", False), (2, "failed", True)]
+
+    def test_no_results(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        _setup_evaluation(tmp_path, monkeypatch, "T echo hi\nO hi\n")
+        result = CliRunner().invoke(evaluate_submissions,
+                                    ["codeval", "--submissions-dir", "submissions", "--no-results"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        assert not (tmp_path / "submissions/Course/HW1/12345/results.json").exists()
+
+    def test_keep_going(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        _setup_evaluation(tmp_path, monkeypatch, "T echo hi\nO bye\nT echo hi\nO hi\n")
+        result = CliRunner().invoke(evaluate_submissions,
+                                    ["codeval", "--submissions-dir", "submissions", "--keep-going"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        comments = (tmp_path / "submissions/Course/HW1/12345/comments.txt").read_text()
+        assert "Test case 2 of 2" in comments
+        assert "Passed 1 of 2 test cases, 1 failed" in comments
+
+    def test_compile_cache_shared_by_submissions(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        _, submissions_dir = _setup_evaluation(tmp_path, monkeypatch,
+                                               "C cp prog.src prog && chmod +x prog\nT ./prog\nO hi\n",
+                                               students=("1", "2"))
+        for student in ("1", "2"):
+            (submissions_dir / "Course/HW1" / student / "submission/prog.src").write_text("echo hi\n")
+        result = CliRunner().invoke(evaluate_submissions, ["codeval", "--submissions-dir", "submissions",
+                                                           "--compile-cache", "cache", "--no-dedup"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        assert "compile cache: 1 hits, 1 misses, 50% hit rate" in result.output
+        for student in ("1", "2"):
+            assert "Passed" in (submissions_dir / "Course/HW1" / student / "comments.txt").read_text()
+
+        # only the lookups of this run count
+        result = CliRunner().invoke(evaluate_submissions, ["codeval", "--submissions-dir", "submissions",
+                                                           "--compile-cache", "cache", "--no-dedup", "--force"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        assert "compile cache: 2 hits, 0 misses, 100% hit rate" in result.output
+
+    def test_identical_submissions_evaluated_once(self, tmp_path, monkeypatch):
+        import json
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        _, submissions_dir = _setup_evaluation(tmp_path, monkeypatch,
+                                               f"T echo run >> {tmp_path}/runs; cat answer\nO 42\n",
+                                               students=("1", "2", "3", "4"))
+        for student, answer in (("1", "42"), ("2", "42"), ("3", "41"), ("4", "42")):
+            (submissions_dir / "Course/HW1" / student / "submission/answer").write_text(f"{answer}\n")
+        result = CliRunner().invoke(evaluate_submissions, ["codeval", "--submissions-dir", "submissions"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        assert "deduplicated 2 of 4 submissions, evaluated 2 (50% dedup ratio)" in result.output
+        assert (tmp_path / "runs").read_text() == "run\nrun\n"
+        comments = {student: (submissions_dir / "Course/HW1" / student / "comments.txt").read_text()
+                    for student in ("1", "2", "3", "4")}
+        assert comments["1"] == comments["2"] == comments["4"]
+        assert "Passed" in comments["1"]
+        assert "FAILED" in comments["3"]
+        for student in ("2", "4"):
+            results = json.loads((submissions_dir / "Course/HW1" / student / "results.json").read_text())
+            assert (results["passed"], results["failed"]) == (1, 0)
+
+    def test_earlier_evaluation_outputs_do_not_prevent_dedup(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        _, submissions_dir = _setup_evaluation(tmp_path, monkeypatch,
+                                               f"C cp prog.src prog && chmod +x prog\n"
+                                               f"T echo run >> {tmp_path}/runs; ./prog\nO hi\n",
+                                               students=("1",))
+        (submissions_dir / "Course/HW1/1/submission/prog.src").write_text("echo hi\n")
+        result = CliRunner().invoke(evaluate_submissions, ["codeval", "--submissions-dir", "submissions"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        assert (submissions_dir / "Course/HW1/1/submission/prog").exists()
+        # a testing directory left behind, as after a failed test with --keep-going
+        (submissions_dir / "Course/HW1/1/submission/.testing").mkdir(exist_ok=True)
+        (submissions_dir / "Course/HW1/1/submission/.testing/log").write_text("left over\n")
+
+        (submissions_dir / "Course/HW1/2/submission").mkdir(parents=True)
+        (submissions_dir / "Course/HW1/2/submission/prog.src").write_text("echo hi\n")
+        result = CliRunner().invoke(evaluate_submissions, ["codeval", "--submissions-dir", "submissions", "--force"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        assert "deduplicated 1 of 2 submissions" in result.output
+        assert (tmp_path / "runs").read_text() == "run\nrun\n"
+
+        # what the evaluation generated does not count as a change of the submission either
+        result = CliRunner().invoke(evaluate_submissions, ["codeval", "--submissions-dir", "submissions"],
+                                    catch_exceptions=False)
+        assert "skipped 2 submissions" in result.output
+        (submissions_dir / "Course/HW1/1/submission/prog").write_text("echo changed\n")
+        result = CliRunner().invoke(evaluate_submissions, ["codeval", "--submissions-dir", "submissions"],
+                                    catch_exceptions=False)
+        assert "skipped 1 submissions" in result.output
+
+    def test_no_dedup_across_assignments(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        codeval_dir, submissions_dir = _setup_evaluation(tmp_path, monkeypatch,
+                                                         f"T echo run >> {tmp_path}/runs; cat answer\nO 42\n")
+        (codeval_dir / "HW2.codeval").write_text((codeval_dir / "HW1.codeval").read_text())
+        for assignment in ("HW1", "HW2"):
+            (submissions_dir / "Course" / assignment / "12345/submission").mkdir(parents=True, exist_ok=True)
+            (submissions_dir / "Course" / assignment / "12345/submission/answer").write_text("42\n")
+        result = CliRunner().invoke(evaluate_submissions, ["codeval", "--submissions-dir", "submissions"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        assert "deduplicated" not in result.output
+        assert (tmp_path / "runs").read_text() == "run\nrun\n"
+
+    def test_file_mode_distinguishes_submissions(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        _, submissions_dir = _setup_evaluation(tmp_path, monkeypatch, "T ./prog\nO hi\n", students=("1", "2"))
+        for student in ("1", "2"):
+            (submissions_dir / "Course/HW1" / student / "submission/prog").write_text("#!/bin/sh\necho hi\n")
+        (submissions_dir / "Course/HW1/2/submission/prog").chmod(0o755)
+        result = CliRunner().invoke(evaluate_submissions, ["codeval", "--submissions-dir", "submissions"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        assert "deduplicated" not in result.output
+        assert "Passed" in (submissions_dir / "Course/HW1/2/comments.txt").read_text()
+        assert "FAILED" in (submissions_dir / "Course/HW1/1/comments.txt").read_text()
+
+    def test_no_dedup(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        _setup_evaluation(tmp_path, monkeypatch, f"T echo run >> {tmp_path}/runs\n", students=("1", "2"))
+        result = CliRunner().invoke(evaluate_submissions,
+                                    ["codeval", "--submissions-dir", "submissions", "--no-dedup"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        assert (tmp_path / "runs").read_text() == "run\nrun\n"
+
+    def test_spec_read_once_per_assignment(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from assignment_codeval import submissions
+
+        codeval_dir, submissions_dir = _setup_evaluation(tmp_path, monkeypatch, "CD work\nT cat id\nIF id\nO same\n",
+                                                         students=("1", "2", "3"))
+        (codeval_dir / "id").write_text("same\n")
+        for student in ("1", "2", "3"):
+            (submissions_dir / "Course/HW1" / student / "submission/work").mkdir()
+            (submissions_dir / "Course/HW1" / student / "submission/work/student").write_text(student)
+        calls = []
+        for name in ("find_codeval_file", "_parse_test_info"):
+            original = getattr(submissions, name)
+            monkeypatch.setattr(submissions, name,
+                                lambda *args, original=original, name=name: calls.append(name) or original(*args))
+        result = CliRunner().invoke(submissions.evaluate_submissions, ["codeval", "--submissions-dir", "submissions"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        assert sorted(calls) == ["_parse_test_info", "find_codeval_file"]
+        for student in ("1", "2", "3"):
+            assert "Passed" in (submissions_dir / "Course/HW1" / student / "comments.txt").read_text()
+
+    def test_support_files_shared(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        codeval_dir, submissions_dir = _setup_evaluation(tmp_path, monkeypatch,
+                                                         "Z support.zip\nT ./helper.sh\nIF in.txt\nO 42\n",
+                                                         students=("1", "2"))
+        (codeval_dir / "in.txt").write_text("42\n")
+        with zipfile.ZipFile(codeval_dir / "support.zip", "w") as zf:
+            info = zipfile.ZipInfo("helper.sh")
+            info.external_attr = 0o755 << 16
+            zf.writestr(info, "#!/bin/sh\ncat\n")
+            zf.writestr("SUBSTITUTIONS.txt", "/a/b/\n")
+        (submissions_dir / "Course/HW1/2/submission/helper.sh").write_text("echo student\n")
+        result = CliRunner().invoke(evaluate_submissions, ["codeval", "--submissions-dir", "submissions",
+                                                           "--no-dedup"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        assert re.search(r"support files: .*", result.output)
+        for student in ("1", "2"):
+            student_dir = submissions_dir / "Course/HW1" / student
+            assert "Passed" in (student_dir / "comments.txt").read_text()
+            assert (student_dir / "SUBSTITUTIONS.txt").read_text() == "/a/b/\n"
+            assert (student_dir / "submission/helper.sh").read_text() == "#!/bin/sh\ncat\n"
+        assert not list(tmp_path.glob(".codeval-support*"))
+
+    def test_unchanged_submissions_skipped(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        codeval_dir, submissions_dir = _setup_evaluation(tmp_path, monkeypatch,
+                                                         f"T echo run >> {tmp_path}/runs; cat answer\nO 42\n",
+                                                         students=("1", "2"))
+        for student in ("1", "2"):
+            student_dir = submissions_dir / "Course/HW1" / student
+            (student_dir / "submission/answer").write_text(f"{41 + int(student)}\n")
+            (student_dir / "comments.txt").write_text("cloning repo\n")
+        args = ["codeval", "--submissions-dir", "submissions"]
+
+        def comments(student):
+            text = (submissions_dir / "Course/HW1" / student / "comments.txt").read_text()
+            return re.sub(r"took [0-9.e+-]+ seconds", "took", text)
+
+        result = CliRunner().invoke(evaluate_submissions, args, catch_exceptions=False)
+        assert result.exit_code == 0
+        assert (tmp_path / "runs").read_text() == "run\nrun\n"
+        first = comments("1")
+        assert first.startswith("cloning repo\nTest case 1 of 1\n")
+
+        result = CliRunner().invoke(evaluate_submissions, args, catch_exceptions=False)
+        assert "skipped 2 submissions that did not change since their last evaluation" in result.output
+        assert (tmp_path / "runs").read_text() == "run\nrun\n"
+
+        (submissions_dir / "Course/HW1/2/submission/answer").write_text("42\n")
+        result = CliRunner().invoke(evaluate_submissions, args, catch_exceptions=False)
+        assert "skipped 1 submissions" in result.output
+        assert (tmp_path / "runs").read_text() == "run\n" * 3
+        assert comments("2") == first
+
+        result = CliRunner().invoke(evaluate_submissions, args + ["--force"], catch_exceptions=False)
+        assert "skipped" not in result.output
+        # the two submissions are identical now
+        assert (tmp_path / "runs").read_text() == "run\n" * 4
+        assert comments("1") == comments("2") == first
+
+        (codeval_dir / "HW1.codeval").write_text(f"T echo run >> {tmp_path}/runs; cat answer\nO 41\n")
+        CliRunner().invoke(evaluate_submissions, args, catch_exceptions=False)
+        assert (tmp_path / "runs").read_text() == "run\n" * 5
+        assert comments("1").startswith("cloning repo\nTest case 1 of 1\nFAILED")
+
+    def test_changed_support_files_evaluated_again(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        codeval_dir, submissions_dir = _setup_evaluation(
+            tmp_path, monkeypatch, f"Z support.zip\nT echo run >> {tmp_path}/runs; cat data.txt\nOF expected.txt\n")
+        (codeval_dir / "expected.txt").write_text("42\n")
+        with zipfile.ZipFile(codeval_dir / "support.zip", "w") as zf:
+            zf.writestr("data.txt", "42\n")
+        args = ["codeval", "--submissions-dir", "submissions"]
+        comments = submissions_dir / "Course/HW1/12345/comments.txt"
+
+        CliRunner().invoke(evaluate_submissions, args, catch_exceptions=False)
+        result = CliRunner().invoke(evaluate_submissions, args, catch_exceptions=False)
+        assert "skipped 1 submissions" in result.output
+        assert "Passed" in comments.read_text()
+
+        (codeval_dir / "expected.txt").write_text("43\n")
+        result = CliRunner().invoke(evaluate_submissions, args, catch_exceptions=False)
+        assert "skipped" not in result.output
+        assert "FAILED" in comments.read_text()
+
+        with zipfile.ZipFile(codeval_dir / "support.zip", "w") as zf:
+            zf.writestr("data.txt", "43\n")
+        result = CliRunner().invoke(evaluate_submissions, args, catch_exceptions=False)
+        assert "skipped" not in result.output
+        assert "Passed" in comments.read_text()
+        assert (tmp_path / "runs").read_text() == "run\n" * 3
+
+    def test_interrupted_evaluation_replaced(self, tmp_path, monkeypatch):
+        import json
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        _, submissions_dir = _setup_evaluation(tmp_path, monkeypatch, "T echo hi\nO hi\n")
+        student_dir = submissions_dir / "Course/HW1/12345"
+        (student_dir / "comments.txt").write_text("cloning repo\nhalf of an earlier evaluation\n")
+        (student_dir / "evaluation.json").write_text(json.dumps({"version": 1, "comments_prefix": 13,
+                                                                 "command": "anything"}))
+        result = CliRunner().invoke(evaluate_submissions, ["codeval", "--submissions-dir", "submissions"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        assert (student_dir / "comments.txt").read_text().startswith("cloning repo\nTest case 1 of 1\nPassed")
+        assert "submission" in json.loads((student_dir / "evaluation.json").read_text())
+
+    def test_jobs(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        students = ("1", "2", "3", "4")
+        spec = f"T date +%s.%N >> {tmp_path}/started; sleep 0.5; date +%s.%N >> {tmp_path}/ended; cat name\nO ok\n"
+        _, submissions_dir = _setup_evaluation(tmp_path, monkeypatch, spec, students=students)
+        for student in students:
+            student_dir = submissions_dir / "Course/HW1" / student
+            (student_dir / "submission/name").write_text("ok\n" if student != "3" else "bad\n")
+            (student_dir / "submission/id").write_text(student)
+            (student_dir / "comments.txt").write_text(f"earlier comments of {student}\n")
+        result = CliRunner().invoke(evaluate_submissions,
+                                    ["codeval", "--submissions-dir", "submissions", "--jobs", "4"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        # the second evaluation started before the first one ended
+        started = sorted(float(line) for line in (tmp_path / "started").read_text().split())
+        ended = sorted(float(line) for line in (tmp_path / "ended").read_text().split())
+        assert started[1] < ended[0]
+        for student in students:
+            comments = (submissions_dir / "Course/HW1" / student / "comments.txt").read_text()
+            assert comments.startswith(f"earlier comments of {student}\n")
+            assert ("FAILED" if student == "3" else "Passed") in comments
+            assert not list((submissions_dir / "Course/HW1" / student).glob("*.tmp"))
+        assert "evaluated 4 submissions in" in result.output
+        assert "with 4 jobs" in result.output
+        assert re.search(r"slowest submissions: \S+/Course/HW1/\d \d+\.\ds", result.output)
+
+    def test_jobs_share_link_dirs(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        students = ("1", "2", "3", "4", "5")
+        _, submissions_dir = _setup_evaluation(tmp_path, monkeypatch, "T cat name\nO ok\n", students=students)
+        for student in students:
+            (submissions_dir / "Course/HW1" / student / "submission/name").write_text("ok\n")
+            (submissions_dir / "Course/HW1" / student / "submission/id").write_text(student)
+        result = CliRunner().invoke(evaluate_submissions,
+                                    ["codeval", "--submissions-dir", "submissions", "--jobs", "2"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0
+        link_dirs = set(re.findall(r"command to execute: cd (\S+)/submissions", result.output))
+        assert 1 <= len(link_dirs) <= 2
+        for student in students:
+            assert "Passed" in (submissions_dir / "Course/HW1" / student / "comments.txt").read_text()
+
+
+def _setup_pool(tmp_path, pool_exec="cd SUBMISSIONS && EVALUATE"):
+    """Configure a pool whose containers are only recorded in log files."""
+    log_dir = tmp_path / "containers"
+    log_dir.mkdir()
+    (tmp_path / "app/codeval.ini").write_text(
+        "[RUN]\ncommand = cd SUBMISSIONS && EVALUATE\n"
+        f"pool_command = echo NAME >> {log_dir}/started\n"
+        f"pool_exec = echo NAME >> {log_dir}/exec; {pool_exec}\n"
+        f"pool_stop = echo NAME >> {log_dir}/stopped\n")
+    return log_dir
+
+
+class TestEvaluateSubmissionsPool:
+    def _names(self, path):
+        return path.read_text().split() if path.exists() else []
+
+    def test_containers_reused_and_recycled(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        students = ("1", "2", "3")
+        _, submissions_dir = _setup_evaluation(tmp_path, monkeypatch, "T cat name\nO ok\n", students=students)
+        log_dir = _setup_pool(tmp_path)
+        for student in students:
+            (submissions_dir / "Course/HW1" / student / "submission/name").write_text("ok\n")
+            (submissions_dir / "Course/HW1" / student / "submission/id").write_text(student)
+        result = CliRunner().invoke(evaluate_submissions, ["codeval", "--submissions-dir", "submissions", "--pool",
+                                                           "--recycle-after", "2"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0, result.output
+        started = self._names(log_dir / "started")
+        executed = self._names(log_dir / "exec")
+        assert len(started) == 2
+        assert executed == [started[0], started[0], started[1]]
+        assert sorted(self._names(log_dir / "stopped")) == sorted(started)
+        for student in students:
+            student_dir = submissions_dir / "Course/HW1" / student
+            assert "Passed" in (student_dir / "comments.txt").read_text()
+            assert (student_dir / "results.json").exists()
+            # the evaluation ran on a copy
+            assert sorted(os.listdir(student_dir / "submission")) == ["id", "name"]
+
+    def test_recycled_after_failure(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        students = ("1", "2")
+        _, submissions_dir = _setup_evaluation(tmp_path, monkeypatch, "T true\n", students=students)
+        log_dir = _setup_pool(tmp_path, "cd SUBMISSIONS && EVALUATE; test ! -e crash || exit 137")
+        (submissions_dir / "Course/HW1/1/submission/crash").write_text("")
+        (submissions_dir / "Course/HW1/2/submission/ok").write_text("")
+        result = CliRunner().invoke(evaluate_submissions, ["codeval", "--submissions-dir", "submissions", "--pool"],
+                                    catch_exceptions=False)
+        assert result.exit_code == 0, result.output
+        assert re.search(r"recycling pool container \S+ after \d+ jobs and a failure", result.output)
+        assert sorted(self._names(log_dir / "stopped")) == sorted(self._names(log_dir / "started"))
+
+    def test_pool_command_required(self, tmp_path, monkeypatch):
+        from click.testing import CliRunner
+        from assignment_codeval.submissions import evaluate_submissions
+
+        _setup_evaluation(tmp_path, monkeypatch, "T true\n")
+        result = CliRunner().invoke(evaluate_submissions, ["codeval", "--submissions-dir", "submissions", "--pool"])
+        assert result.exit_code == 2
+        assert "pool_command" in result.output
@@ -0,0 +1,370 @@
+"""Unit tests for process_runner.py (in-memory stdin/stdout/stderr for test commands)."""
+import os
+import subprocess
+import time
+
+import pytest
+
+from assignment_codeval import process_runner
+from assignment_codeval.process_runner import (
+    LIMIT_CPU,
+    LIMIT_MEMORY,
+    LIMIT_PROCESSES,
+    STOPPED_MISMATCH,
+    STOPPED_OUTPUT_CAP,
+    ResourceLimits,
+    _Cgroup,
+    buffer_equals,
+    buffer_size,
+    kill_process_group,
+    read_buffer,
+    run_supervised,
+    run_with_pipes,
+    stop_process_group,
+)
+
+
+def _alive(pid):
+    """Tell whether pid is still running, giving a killed process a moment to go away."""
+    for _ in range(50):
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                state = f.read().rsplit(")", 1)[1].split()[0]
+        except FileNotFoundError:
+            return False
+        # A killed orphan may linger as a zombie until init reaps it
+        if state == "Z":
+            return False
+        time.sleep(0.02)
+    return True
+
+
+class TestRunWithPipes:
+    def test_captures_stdout_and_stderr(self):
+        result = run_with_pipes("echo out; echo err >&2")
+        assert result.returncode == 0
+        assert read_buffer(result.stdout) == b"out\n"
+        assert read_buffer(result.stderr) == b"err\n"
+        result.close()
+
+    def test_feeds_stdin_from_memory(self):
+        result = run_with_pipes("cat", b"hello\nworld\n")
+        assert read_buffer(result.stdout) == b"hello\nworld\n"
+        result.close()
+
+    def test_empty_input_closes_stdin(self):
+        result = run_with_pipes("cat", timeout=5)
+        assert not result.timed_out
+        assert read_buffer(result.stdout) == b""
+        result.close()
+
+    def test_input_larger_than_pipe_buffer(self):
+        data = b"x" * (1024 * 1024)
+        result = run_with_pipes("wc -c", data, timeout=10)
+        assert read_buffer(result.stdout).strip() == str(len(data)).encode()
+        result.close()
+
+    def test_program_ignoring_stdin(self):
+        result = run_with_pipes("true", b"y" * (1024 * 1024), timeout=10)
+        assert result.returncode == 0
+        result.close()
+
+    def test_exit_code(self):
+        result = run_with_pipes("exit 3")
+        assert result.returncode == 3
+        result.close()
+
+    def test_timeout_kills_process(self):
+        start = time.monotonic()
+        result = run_with_pipes("sleep 10", timeout=0.5)
+        assert time.monotonic() - start < 5
+        assert result.timed_out
+        assert result.returncode is None
+        result.close()
+
+    def test_timeout_keeps_partial_output(self):
+        result = run_with_pipes("echo early; sleep 10", timeout=0.5)
+        assert result.timed_out
+        assert read_buffer(result.stdout) == b"early\n"
+        result.close()
+
+    def test_large_output_spills_to_disk(self):
+        result = run_with_pipes("head -c 200000 /dev/zero", spool_threshold=1024)
+        assert buffer_size(result.stdout) == 200000
+        assert result.stdout._rolled
+        result.close()
+
+    def test_small_output_stays_in_memory(self):
+        result = run_with_pipes("echo small")
+        assert not result.stdout._rolled
+        result.close()
+
+
+class TestEarlyStop:
+    def test_stops_when_output_cannot_match(self):
+        start = time.monotonic()
+        result = run_with_pipes("echo wrong; sleep 10", expected_stdout=b"right\n", timeout=20)
+        assert time.monotonic() - start < 5
+        assert result.stopped == STOPPED_MISMATCH
+        assert result.returncode is None
+        assert not result.timed_out
+        result.close()
+
+    def test_output_longer_than_expected_is_a_mismatch(self):
+        result = run_with_pipes("yes", expected_stdout=b"y\n", timeout=20)
+        assert result.stopped == STOPPED_MISMATCH
+        result.close()
+
+    def test_slack_keeps_output_after_mismatch(self):
+        result = run_with_pipes("yes", expected_stdout=b"n\n", mismatch_slack=10000, timeout=20)
+        assert result.stopped == STOPPED_MISMATCH
+        assert buffer_size(result.stdout) >= 10000
+        result.close()
+
+    def test_stderr_checked_too(self):
+        result = run_with_pipes("echo oops >&2; sleep 10", expected_stderr=b"", timeout=20)
+        assert result.stopped == STOPPED_MISMATCH
+        result.close()
+
+    def test_matching_output_runs_to_completion(self):
+        result = run_with_pipes("echo right", expected_stdout=b"right\n", expected_stderr=b"")
+        assert result.stopped is None
+        assert result.returncode == 0
+        result.close()
+
+    def test_output_cap(self):
+        result = run_with_pipes("yes", output_cap=100000, timeout=20)
+        assert result.stopped == STOPPED_OUTPUT_CAP
+        assert buffer_size(result.stdout) > 100000
+        result.close()
+
+    def test_output_cap_allows_expected_length(self):
+        expected = b"x" * 5000
+        result = run_with_pipes("head -c 5000 /dev/zero | tr '\\0' x", expected_stdout=expected,
+                                output_cap=100)
+        assert result.stopped is None
+        assert buffer_equals(result.stdout, expected)
+        result.close()
+
+
+class TestProcessGroups:
+    def test_background_children_killed_after_exit(self, tmp_path):
+        pidfile = tmp_path / "pid"
+        start = time.monotonic()
+        result = run_with_pipes(f"sleep 30 & echo $! > {pidfile}; echo done", timeout=20)
+        assert time.monotonic() - start < 5
+        assert result.returncode == 0
+        assert read_buffer(result.stdout) == b"done\n"
+        assert result.strays == 1
+        assert not _alive(int(pidfile.read_text()))
+        result.close()
+
+    def test_timeout_kills_whole_tree(self, tmp_path):
+        pidfile = tmp_path / "pid"
+        result = run_with_pipes(f"sh -c 'echo $$ > {pidfile}; sleep 30'; true", timeout=0.5)
+        assert result.timed_out
+        assert result.strays >= 1
+        assert not _alive(int(pidfile.read_text()))
+        result.close()
+
+    def test_no_strays_for_plain_command(self):
+        result = run_with_pipes("echo plain")
+        assert result.strays == 0
+        result.close()
+
+    def test_run_supervised(self, tmp_path):
+        pidfile = tmp_path / "pid"
+        result = run_supervised(f"sleep 30 > /dev/null & echo $! > {pidfile}; exit 4")
+        assert result.returncode == 4
+        assert result.strays == 1
+        assert result.stdout is None
+        assert not _alive(int(pidfile.read_text()))
+
+    def test_stop_process_group_terminates_first(self, tmp_path):
+        marker = tmp_path / "stopped"
+        proc = subprocess.Popen(f"trap 'echo bye > {marker}; exit 0' TERM; sleep 30 & wait", shell=True,
+                                start_new_session=True)
+        time.sleep(0.2)
+        start = time.monotonic()
+        assert stop_process_group(proc, grace=5) == 1
+        assert time.monotonic() - start < 5
+        assert marker.read_text() == "bye\n"
+
+    def test_stop_process_group_kills_after_grace(self):
+        proc = subprocess.Popen("trap '' TERM; sleep 30", shell=True, start_new_session=True)
+        time.sleep(0.2)
+        stop_process_group(proc, grace=0.2)
+        assert proc.returncode is not None
+
+    def test_kill_missing_group(self):
+        result = run_with_pipes("true")
+        # The group is gone once the command finished
+        assert kill_process_group(2 ** 22 - 1) == 0
+        result.close()
+
+
+class TestResourceUsage:
+    def test_usage_recorded(self):
+        result = run_with_pipes("python3 -c 'x = bytearray(100 * 1024 * 1024); print(1)'", timeout=20)
+        usage = result.usage
+        assert usage.stdout_bytes == 2
+        assert usage.stderr_bytes == 0
+        assert usage.max_rss_kb > 100 * 1024
+        assert usage.user_time + usage.system_time > 0
+        assert usage.wall_time > 0
+        result.close()
+
+    def test_usage_includes_waited_children(self):
+        result = run_with_pipes("sh -c 'i=0; while [ $i -lt 20000 ]; do i=$((i+1)); done'; true", timeout=20)
+        assert result.usage.user_time + result.usage.system_time > 0
+        result.close()
+
+    def test_usage_after_timeout(self):
+        result = run_with_pipes("sleep 10", timeout=0.3)
+        assert result.timed_out
+        assert result.usage.wall_time >= 0.3
+        result.close()
+
+    def test_rss_floor(self):
+        result = run_with_pipes("true")
+        assert result.usage.rss_floor_kb > 0
+        # a tiny command still reports the peak it inherited
+        assert result.usage.max_rss_kb <= result.usage.rss_floor_kb
+        result.close()
+
+    def test_supervised_usage(self):
+        result = run_supervised("python3 -c 'x = bytearray(100 * 1024 * 1024)'")
+        assert result.usage.max_rss_kb > 100 * 1024
+
+
+class TestResourceLimits:
+    def test_memory_limit(self):
+        result = run_with_pipes("python3 -c 'x = bytearray(500 * 1024 * 1024)'",
+                                limits=ResourceLimits(memory_mb=200), timeout=20)
+        assert result.returncode != 0
+        assert result.limit == LIMIT_MEMORY
+        assert b"MemoryError" in read_buffer(result.stderr)
+        result.close()
+
+    def test_failure_after_cpu_budget_not_blamed_on_limit(self):
+        # the rlimit is rounded up to a second, so using 0.5s of CPU and failing is not a limit hit
+        result = run_with_pipes("python3 -c 'import time, sys\nt = time.process_time()\n"
+                                "while time.process_time() - t < 0.6: pass\nsys.exit(1)'",
+                                limits=ResourceLimits(cpu_seconds=0.5), timeout=20)
+        assert result.returncode == 1
+        assert result.limit is None
+        result.close()
+
+    def test_process_limit_from_fork_error(self):
+        # RLIMIT_NPROC does not apply to root, so the shell's fork error is printed by hand
+        result = run_with_pipes("echo 'sh: 1: Cannot fork: Resource temporarily unavailable' >&2; exit 2",
+                                limits=ResourceLimits(processes=4))
+        assert result.limit == LIMIT_PROCESSES
+        result.close()
+
+    def test_other_failures_not_blamed_on_limits(self):
+        result = run_with_pipes("echo 'Resource temporarily unavailable' >&2; exit 1",
+                                limits=ResourceLimits(memory_mb=200))
+        assert result.returncode == 1
+        assert result.limit is None
+        result.close()
+
+    def test_cpu_limit(self):
+        start = time.monotonic()
+        result = run_with_pipes("python3 -c 'while True: pass'", limits=ResourceLimits(cpu_seconds=1),
+                                timeout=20)
+        assert time.monotonic() - start < 10
+        assert not result.timed_out
+        assert result.limit == LIMIT_CPU
+        result.close()
+
+    def test_within_limits(self):
+        result = run_with_pipes("echo fine", limits=ResourceLimits(memory_mb=200, cpu_seconds=5))
+        assert result.returncode == 0
+        assert result.limit is None
+        assert read_buffer(result.stdout) == b"fine\n"
+        result.close()
+
+    @pytest.mark.skipif(os.geteuid() == 0, reason="RLIMIT_NPROC does not apply to root")
+    def test_process_limit(self):
+        result = run_with_pipes("for i in 1 2 3 4 5 6 7 8; do sleep 5 & done; wait",
+                                limits=ResourceLimits(processes=1), timeout=20)
+        assert result.returncode != 0 or result.usage.wall_time < 5
+        result.close()
+
+    def test_supervised_cpu_limit(self):
+        result = run_supervised("python3 -c 'while True: pass'", ResourceLimits(cpu_seconds=1))
+        assert result.limit == LIMIT_CPU
+
+    @pytest.mark.parametrize("prlimit", [True, False])
+    def test_limits_set_by_the_shell(self, monkeypatch, prlimit):
+        # nothing may run between fork and exec while other threads run test cases
+        popen = subprocess.Popen
+
+        def checked_popen(*args, **kwargs):
+            assert kwargs.get("preexec_fn") is None
+            return popen(*args, **kwargs)
+        monkeypatch.setattr(subprocess, "Popen", checked_popen)
+        if not prlimit:
+            monkeypatch.setattr(process_runner.shutil, "which", lambda name: None)
+        result = run_with_pipes("ulimit -t; ulimit -v", limits=ResourceLimits(memory_mb=200, cpu_seconds=2.5))
+        assert read_buffer(result.stdout) == f"3\n{200 * 1024}\n".encode()
+        result.close()
+
+    def test_command_enters_cgroup(self, tmp_path):
+        result = run_supervised("cat /proc/self/stat > /dev/null", ResourceLimits(processes=5),
+                                cgroup_parent=str(tmp_path))
+        assert result.returncode == 0
+        # a plain directory stands in for the cgroup, the shell wrote itself into its cgroup.procs
+        (procs,) = tmp_path.glob("codeval-*/cgroup.procs")
+        assert procs.read_text() == "0\n"
+
+    def test_unusable_cgroup_falls_back_to_rlimits(self, tmp_path):
+        result = run_with_pipes("python3 -c 'while True: pass'", limits=ResourceLimits(cpu_seconds=1),
+                                cgroup_parent=str(tmp_path / "missing"), timeout=20)
+        assert result.limit == LIMIT_CPU
+        result.close()
+
+
+class TestCgroup:
+    def test_limits_written(self, tmp_path):
+        cgroup = _Cgroup(str(tmp_path), ResourceLimits(memory_mb=64, processes=5))
+        assert os.path.dirname(cgroup.path) == str(tmp_path)
+        with open(os.path.join(cgroup.path, "memory.max")) as f:
+            assert f.read() == f"{64 * 1024 * 1024}\n"
+        with open(os.path.join(cgroup.path, "pids.max")) as f:
+            assert f.read() == "5\n"
+        assert cgroup.limit_hit() is None
+
+    def test_limit_hit_from_events(self, tmp_path):
+        cgroup = _Cgroup(str(tmp_path), ResourceLimits(memory_mb=64))
+        with open(os.path.join(cgroup.path, "memory.events"), "w") as f:
+            f.write("low 0\nhigh 0\nmax 3\noom 1\noom_kill 1\n")
+        assert cgroup.limit_hit() == LIMIT_MEMORY
+        cgroup = _Cgroup(str(tmp_path), ResourceLimits(processes=2))
+        with open(os.path.join(cgroup.path, "pids.events"), "w") as f:
+            f.write("max 4\n")
+        assert cgroup.limit_hit() == LIMIT_PROCESSES
+
+    def test_each_command_gets_its_own_cgroup(self, tmp_path):
+        first = _Cgroup(str(tmp_path), ResourceLimits(processes=2))
+        second = _Cgroup(str(tmp_path), ResourceLimits(processes=2))
+        assert first.path != second.path
+        os.remove(os.path.join(first.path, "pids.max"))
+        first.remove()
+        assert not os.path.exists(first.path)
+
+
+class TestBufferHelpers:
+    def test_buffer_equals(self):
+        result = run_with_pipes("printf abc")
+        assert buffer_equals(result.stdout, b"abc")
+        assert not buffer_equals(result.stdout, b"abd")
+        assert not buffer_equals(result.stdout, b"ab")
+        result.close()
+
+    def test_buffer_equals_large(self):
+        result = run_with_pipes("head -c 100000 /dev/zero", spool_threshold=1024)
+        assert buffer_equals(result.stdout, b"\0" * 100000)
+        assert not buffer_equals(result.stdout, b"\0" * 99999 + b"\1")
+        result.close()
@@ -0,0 +1,172 @@
+"""Unit tests for result_cache.py (test case outcomes replayed by run-evaluation --result-cache)."""
+import json
+import re
+
+import pytest
+from click.testing import CliRunner
+
+import assignment_codeval.evaluate as ev_mod
+from assignment_codeval.evaluate import run_evaluation
+from assignment_codeval.result_cache import ResultCache
+
+# Each run of the test command is counted in a file outside the working directory
+SPEC = """\
+T echo run >> ../runs; cat greeting
+O hello
+T echo run >> ../runs; tr a-z A-Z
+I shout
+O SHOUT
+"""
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    work = tmp_path / "work"
+    work.mkdir()
+    monkeypatch.chdir(work)
+    (work / "greeting").write_text("hello\n")
+    # run-evaluation leaves the cache of its last run behind
+    monkeypatch.setattr(ev_mod, "result_cache", None)
+    return work
+
+
+def _run(workdir, spec, *args):
+    (workdir / "codeval.txt").write_text(spec)
+    ev_mod.test_case_count = 0
+    results_file = workdir.parent / "results.json"
+    result = CliRunner().invoke(run_evaluation, [
+        "codeval.txt", "--result-cache", str(workdir.parent / "cache"), "--results-file", str(results_file),
+        *args])
+    return result, json.loads(results_file.read_text())
+
+
+def _runs(workdir):
+    runs = workdir.parent / "runs"
+    return len(runs.read_text().splitlines()) if runs.exists() else 0
+
+
+def _without_time(output):
+    return re.sub(r"took [0-9.e+-]+ seconds\n", "", output)
+
+
+class TestTreeKey:
+    def test_content_and_mode(self, tmp_path):
+        cache = ResultCache(str(tmp_path / "cache"))
+        work = tmp_path / "work"
+        work.mkdir()
+        (work / "prog").write_text("echo hi\n")
+        before = cache.tree_key(str(work))
+        assert cache.tree_key(str(work)) == before
+        (work / "prog").chmod(0o755)
+        assert cache.tree_key(str(work)) != before
+        (work / "prog").chmod(0o644)
+        assert cache.tree_key(str(work)) == before
+        (work / "prog").write_text("echo bye\n")
+        assert cache.tree_key(str(work)) != before
+
+    def test_excluded_files_ignored(self, tmp_path):
+        cache = ResultCache(str(tmp_path / "cache"))
+        work = tmp_path / "work"
+        (work / ".testing").mkdir(parents=True)
+        before = cache.tree_key(str(work), [".testing"])
+        (work / ".testing" / "youroutput").write_text("x")
+        assert cache.tree_key(str(work), [".testing"]) == before
+
+    def test_store_and_lookup(self, tmp_path):
+        cache = ResultCache(str(tmp_path / "cache"))
+        assert cache.lookup("ab" * 32) is None
+        assert cache.store("ab" * 32, {"passed": True})
+        assert cache.lookup("ab" * 32)["passed"] is True
+
+
+class TestRunEvaluationResultCache:
+    def test_second_run_replayed(self, workdir):
+        first, results = _run(workdir, SPEC)
+        assert first.exit_code == 0, first.output
+        assert results["result_cache"] == {"hits": 0, "misses": 2}
+        assert _runs(workdir) == 2
+
+        second, results = _run(workdir, SPEC)
+        assert second.exit_code == 0, second.output
+        assert results["result_cache"] == {"hits": 2, "misses": 0}
+        assert [test["cached"] for test in results["tests"]] == [True, True]
+        assert _without_time(second.output) == _without_time(first.output)
+        assert _runs(workdir) == 2
+
+    def test_changed_file_runs_again(self, workdir):
+        _run(workdir, SPEC)
+        (workdir / "greeting").write_text("bye\n")
+        result, results = _run(workdir, SPEC)
+        assert result.exit_code == 2
+        assert results["result_cache"] == {"hits": 0, "misses": 1}
+        assert _runs(workdir) == 3
+
+    def test_changed_expected_output_runs_again(self, workdir):
+        _run(workdir, SPEC)
+        result, results = _run(workdir, SPEC.replace("O SHOUT", "O WHISPER"))
+        assert result.exit_code == 2
+        assert results["result_cache"] == {"hits": 1, "misses": 1}
+        assert "cached" not in results["tests"][1]
+
+    def test_failure_replayed(self, workdir):
+        spec = SPEC.replace("O hello", "O wrong")
+        first, _ = _run(workdir, spec, "--keep-going")
+        second, results = _run(workdir, spec, "--keep-going")
+        assert second.exit_code == first.exit_code == 2
+        assert _without_time(second.output) == _without_time(first.output)
+        assert results["result_cache"] == {"hits": 2, "misses": 0}
+        assert results["tests"][0]["status"] == "failed"
+
+    def test_inserted_test_case_keeps_keys(self, workdir):
+        _run(workdir, SPEC)
+        result, results = _run(workdir, "T echo new\nO new\n" + SPEC)
+        assert result.exit_code == 0, result.output
+        assert results["result_cache"] == {"hits": 2, "misses": 1}
+        assert "Test case 3 of 3" in result.output
+        assert [test["test_case"] for test in results["tests"]] == [1, 2, 3]
+
+    def test_test_changing_files_not_cached(self, workdir):
+        spec = "T echo run >> ../runs; echo more >> greeting; echo ok\nO ok\n"
+        _run(workdir, spec)
+        (workdir / "greeting").write_text("hello\n")
+        result, results = _run(workdir, spec)
+        assert results["result_cache"] == {"hits": 0, "misses": 1}
+        assert _runs(workdir) == 2
+
+    def test_temp_files_do_not_prevent_caching(self, workdir):
+        spec = "TEMP scratch\nT echo run >> ../runs; echo x > scratch; echo ok\nO ok\n"
+        _run(workdir, spec)
+        result, results = _run(workdir, spec)
+        assert result.exit_code == 0, result.output
+        assert results["result_cache"] == {"hits": 1, "misses": 0}
+        assert _runs(workdir) == 1
+
+    def test_timeout_not_cached(self, workdir):
+        spec = "T echo run >> ../runs; sleep 5\nTO 0.2\n"
+        _run(workdir, spec)
+        result, results = _run(workdir, spec)
+        assert "Took more than" in result.output
+        assert results["result_cache"] == {"hits": 0, "misses": 1}
+
+    def test_parallel_jobs(self, workdir):
+        first, _ = _run(workdir, SPEC, "--jobs", "2")
+        second, results = _run(workdir, SPEC, "--jobs", "2")
+        assert second.exit_code == 0, second.output
+        assert results["result_cache"] == {"hits": 2, "misses": 0}
+        assert _without_time(second.output) == _without_time(first.output)
+        assert _runs(workdir) == 2
+
+    def test_same_key_with_and_without_jobs(self, workdir):
+        spec = SPEC.replace("O SHOUT", "O WHISPER")
+        first, _ = _run(workdir, spec, "--keep-going")
+        second, results = _run(workdir, spec, "--keep-going", "--jobs", "2")
+        assert results["result_cache"] == {"hits": 2, "misses": 0}
+        assert ".testing/case-2/youroutput" in second.output
+        assert _without_time(second.output) == _without_time(first.output).replace(".testing/", ".testing/case-2/")
+
+    def test_usage_marked_cached(self, workdir):
+        usage_file = workdir.parent / "usage.json"
+        _run(workdir, SPEC)
+        _run(workdir, SPEC, "--usage-file", str(usage_file))
+        usage = json.loads(usage_file.read_text())
+        assert [test["cached"] for test in usage["tests"]] == [True, True]
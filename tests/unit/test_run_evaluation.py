@@ -4,7 +4,9 @@ Running through CliRunner (instead of subprocess) keeps code execution in the
 pytest process so pytest-cov tracks coverage of setup/parse_tags/check_test/cleanup.
 """
 import os
+import socket
 import textwrap
+import time
 import pytest
 from click.testing import CliRunner
 
@@ -23,6 +25,7 @@ def reset_eval_globals(tmp_path, monkeypatch):
     ev_mod.num_passed = 0
     ev_mod.num_failed = 0
     ev_mod.timeout_val = 10
+    ev_mod.output_length_limit = 4096
     ev_mod.expected_exit_code = -1
     ev_mod.test_case_hint = ""
     ev_mod.is_hidden_testcase = False
@@ -30,11 +33,24 @@ def reset_eval_globals(tmp_path, monkeypatch):
     ev_mod.temp_files = []
     ev_mod._active_temp_files = []
     ev_mod.last_compile_command = ""
+    ev_mod.test_input = []
+    ev_mod.expected_output = []
+    ev_mod.expected_error = []
+    ev_mod.stray_processes = 0
+    ev_mod.memory_limit_mb = None
+    ev_mod.cpu_limit_sec = None
+    ev_mod.process_limit = None
     yield
     # Cleanup .testing dir if still present
     cleanup()
 
 
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
 def _write_codeval(tmp_path, content):
     f = tmp_path / "test.codeval"
     f.write_text(textwrap.dedent(content))
@@ -50,11 +66,14 @@ class TestSetupCleanup:
         setup()
         assert os.path.isdir(ev_mod.TESTING_DIR)
 
-    def test_setup_creates_required_files(self, tmp_path):
+    def test_setup_keeps_test_data_in_memory(self, tmp_path):
+        ev_mod.test_input = [b"stale"]
+        ev_mod.expected_output = [b"stale"]
         setup()
-        for fname in ["compilelog", "difflog", "expectedoutput", "expectederror",
-                      "fileinput", "yourerror", "youroutput"]:
-            assert os.path.exists(os.path.join(ev_mod.TESTING_DIR, fname))
+        assert ev_mod.test_input == []
+        assert ev_mod.expected_output == []
+        assert ev_mod.expected_error == []
+        assert os.listdir(ev_mod.TESTING_DIR) == []
 
     def test_cleanup_removes_testing_files(self, tmp_path):
         setup()
@@ -106,6 +125,12 @@ class TestParseTagsNonProgram:
         parse_tags(["OLEN 512\n"])
         assert ev_mod.output_length_limit == 512
 
+    def test_limit_tags_set_globals(self, tmp_path):
+        parse_tags(["MEM 128\n", "CPU 1.5\n", "NPROC 20\n"])
+        assert ev_mod._current_limits() == ev_mod.ResourceLimits(128, 1.5, 20)
+        parse_tags(["CPU 0\n"])
+        assert ev_mod.cpu_limit_sec is None
+
     def test_crt_hw_block_skipped(self, tmp_path):
         setup()
         # Any T tag inside the block should NOT increment test_case_count
@@ -382,3 +407,426 @@ class TestRunEvaluationViaCliRunner:
         runner = CliRunner()
         result = runner.invoke(run_evaluation, [str(codeval)], catch_exceptions=False)
         assert result.exit_code == 0
+
+
+# ---------------------------------------------------------------------------
+# run_evaluation --jobs
+# ---------------------------------------------------------------------------
+
+class TestRunEvaluationParallel:
+    def test_parallel_results_in_spec_order(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text(
+            "T sleep 0.3; echo one\nO one\n"
+            "T echo two\nO two\n"
+            "HT sleep 0.1; echo three\nO three\n"
+        )
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval), "--jobs", "3"], catch_exceptions=False)
+        assert result.exit_code == 0
+        headers = [line for line in result.output.splitlines() if line.startswith("Test case")]
+        assert headers == ["Test case 1 of 3", "Test case 2 of 3", "Test case 3 of 3"]
+        assert result.output.count("Passed") == 3
+
+    def test_parallel_tests_run_concurrently(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("".join("T sleep 0.5; echo ok\nO ok\n" for _ in range(4)))
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval), "-j", "4"], catch_exceptions=False)
+        assert result.exit_code == 0
+        took = float(result.output.split("took ")[1].split()[0])
+        assert took < 1.5
+
+    def test_parallel_stops_at_first_failure(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text(
+            "T echo one\nO one\n"
+            "T echo two\nHINT look again\nO wrong\n"
+            "T echo three\nO three\n"
+        )
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval), "--jobs", "2"])
+        assert result.exit_code == 2
+        assert "Test case 2 of 3" in result.output
+        assert "HINT: look again" in result.output
+        assert "Test case 3 of 3" not in result.output
+        assert not os.path.exists(ev_mod.TESTING_DIR)
+
+    def test_parallel_each_test_gets_own_input(self, tmp_path):
+        prog = tmp_path / "echo.py"
+        prog.write_text("print(input())\n")
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text(
+            f"T python3 {prog}\nI first\nO first\n"
+            f"T python3 {prog}\nI second\nO second\n"
+        )
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval), "--jobs", "2"], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert result.output.count("Passed") == 2
+
+    def test_parallel_barrier_tags_keep_order(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text(
+            "T sleep 0.2; echo one\nO one\n"
+            "PRINT Section B\n"
+            "T echo two\nO two\n"
+        )
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval), "--jobs", "2"], catch_exceptions=False)
+        assert result.exit_code == 0
+        out = result.output
+        assert out.index("Test case 1 of 2") < out.index("Section B") < out.index("Test case 2 of 2")
+
+    def test_cmp_tests_run_serially(self, tmp_path):
+        (tmp_path / "expected.txt").write_text("data\n")
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("T echo data > out.txt\nCMP out.txt expected.txt\n")
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval), "--jobs", "2"], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert "Passed" in result.output
+
+
+class TestRunEvaluationEarlyStop:
+    def test_endless_output_stops_before_timeout(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("TO 30\nT yes\nO y\nO y\n")
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval)], catch_exceptions=False)
+        assert result.exit_code == 2
+        assert "Stopped early because the output can no longer match. FAIL" in result.output
+        assert "Took more than" not in result.output
+
+    def test_mismatch_report_keeps_output_after_mismatch(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("T yes wrong\nO right\n")
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval)], catch_exceptions=False)
+        assert result.exit_code == 2
+        assert "@@ -1," in result.output
+        assert result.output.count("-wrong$") > 100
+
+    def test_output_cap(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("OLEN 100000000\nT yes\n")
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval), "--output-cap", "1000"],
+                               catch_exceptions=False)
+        assert result.exit_code == 2
+        assert "Stopped after producing more than 1000 bytes of output. FAIL" in result.output
+
+    def test_killed_test_reports_why_instead_of_exit_code(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("TO 30\nX 3\nT yes\nO y\n")
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval)], catch_exceptions=False)
+        assert result.exit_code == 2
+        assert "Exit Code failure: expected 3, but the test was killed because its output can " \
+               "no longer match" in result.output
+        assert "got None" not in result.output
+
+        codeval.write_text("OLEN 100000000\nX 0\nT yes\n")
+        result = runner.invoke(run_evaluation, [str(codeval), "--output-cap", "1000"],
+                               catch_exceptions=False)
+        assert result.exit_code == 2
+        assert "Exit Code failure: expected 0, but the test was killed because it produced more " \
+               "than 1000 bytes of output" in result.output
+
+    def test_matching_output_larger_than_cap_passes(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("T printf '%02000d\\n' 0\nO " + "0" * 2000 + "\n")
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval), "--output-cap", "100"],
+                               catch_exceptions=False)
+        assert result.exit_code == 0
+
+
+class TestRunEvaluationProcessGroups:
+    def test_cmd_background_process_reaped(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("CMD sleep 30 > /dev/null &\nT echo hi\nO hi\n")
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval)], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert "Killed 1 stray processes left running by tests" in result.output
+
+    def test_test_background_process_reaped(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("T sleep 30 & echo hi\nO hi\n")
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval)], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert "Killed 1 stray processes" in result.output
+
+    def test_strays_reported_when_test_times_out(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("TO 1\nT bash -c 'sleep 30 & sleep 5'\n")
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval)], catch_exceptions=False)
+        assert result.exit_code == 2
+        assert "Took more than 1.0 seconds to run. FAIL" in result.output
+        assert "stray processes left running by tests" in result.output
+
+    def test_server_stopped_at_end(self, tmp_path):
+        pidfile = tmp_path / "server.pid"
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text(f"SS 0.2 60 sh -c 'echo $$ > {pidfile}; sleep 60'\nT echo hi\nO hi\n")
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval)], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert ev_mod._servers == []
+        stat = f"/proc/{pidfile.read_text().strip()}/stat"
+        # The killed server is gone, or a zombie waiting for init to reap it
+        for _ in range(50):
+            if not os.path.exists(stat) or " Z " in open(stat).read():
+                break
+            time.sleep(0.02)
+        else:
+            pytest.fail("server still running")
+
+    def test_no_stray_message_without_strays(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("T echo hi\nO hi\n")
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval)], catch_exceptions=False)
+        assert "stray" not in result.output
+
+
+class TestRunEvaluationServerReadiness:
+    def _run(self, tmp_path, spec):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text(spec)
+        start = time.monotonic()
+        result = CliRunner().invoke(run_evaluation, [str(codeval)], catch_exceptions=False)
+        return result, time.monotonic() - start
+
+    def test_tcp_port(self, tmp_path):
+        port = _free_port()
+        server = f"python3 -m http.server {port} --bind 127.0.0.1"
+        result, elapsed = self._run(tmp_path, f"SS 20 60 tcp:{port} {server}\n"
+                                              f"T python3 -c 'import urllib.request; "
+                                              f"urllib.request.urlopen(\"http://127.0.0.1:{port}/\")'\n")
+        assert result.exit_code == 0, result.output
+        assert "Server ready after" in result.output
+        assert elapsed < 15
+
+    def test_log_line(self, tmp_path):
+        result, elapsed = self._run(tmp_path, "SS 20 60 log:'now listening' "
+                                              "sh -c 'sleep 0.2; echo now listening; sleep 60'\nT echo hi\nO hi\n")
+        assert result.exit_code == 0, result.output
+        assert "Server ready after" in result.output
+        assert elapsed < 10
+
+    def test_file(self, tmp_path):
+        result, elapsed = self._run(tmp_path, "SS 20 60 file:ready.flag sh -c 'touch ready.flag; sleep 60'\n"
+                                              "T echo hi\nO hi\n")
+        assert result.exit_code == 0, result.output
+        assert "Server ready after" in result.output
+        assert elapsed < 10
+
+    def test_not_ready_within_timeout(self, tmp_path):
+        result, _ = self._run(tmp_path, "SS 0.3 60 file:never sleep 60\nT echo hi\nO hi\n")
+        assert result.exit_code == 0
+        assert "Server not ready after 0.3 seconds" in result.output
+
+    def test_server_exit_ends_wait(self, tmp_path):
+        result, elapsed = self._run(tmp_path, "SS 20 60 exit 3\nT echo hi\nO hi\n")
+        assert "Server exited with 3 while starting" in result.output
+        assert elapsed < 10
+
+    def test_condition_parsing(self):
+        assert ev_mod._split_ready_condition("tcp:8080 ./server -p 8080") == (("tcp", "8080"), "./server -p 8080")
+        assert ev_mod._split_ready_condition("log:'Listening on' java Server") == \
+            (("log", "Listening on"), "java Server")
+        assert ev_mod._split_ready_condition("PORT=80 ./server") == (None, "PORT=80 ./server")
+        assert ev_mod._split_ready_condition("tcp:8080") == (None, "tcp:8080")
+
+
+class TestRunEvaluationResourceUsage:
+    def test_trailer_is_opt_in(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("T echo hi\nO hi\n")
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval)], catch_exceptions=False)
+        assert "Resource usage:" not in result.output
+
+    def test_trailer(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("T echo hi\nO hi\nTCMD true\n")
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval), "--show-usage"], catch_exceptions=False)
+        assert result.exit_code == 0
+        trailer = result.output[result.output.index("Resource usage:"):]
+        assert "  Test case 1: wall " in trailer
+        assert "  Test case 2: wall " in trailer
+        assert "output 3 bytes" in trailer
+        assert "  Total: wall " in trailer
+
+    def test_usage_file(self, tmp_path):
+        import json
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("T python3 -c 'x = bytearray(200 * 1024 * 1024); print(len(x))'\nO 209715200\n")
+        usage_file = tmp_path / "usage.json"
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval), "--usage-file", str(usage_file)],
+                               catch_exceptions=False)
+        assert result.exit_code == 0
+        usage = json.loads(usage_file.read_text())
+        test = usage["tests"][0]
+        assert test["test_case"] == 1
+        assert test["passed"] is True
+        assert test["stdout_bytes"] == 10
+        assert test["max_rss_kb"] > 200 * 1024
+        assert test["user_time"] + test["system_time"] > 0
+        assert usage["total"]["max_rss_kb"] == test["max_rss_kb"]
+
+    def test_usage_file_written_on_failure(self, tmp_path):
+        import json
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("T echo one\nO one\nT echo two\nO three\nT echo never\n")
+        usage_file = tmp_path / "usage.json"
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval), "--usage-file", str(usage_file)])
+        assert result.exit_code == 2
+        usage = json.loads(usage_file.read_text())
+        assert [(t["test_case"], t["passed"]) for t in usage["tests"]] == [(1, True), (2, False)]
+
+
+class TestRunEvaluationResourceLimits:
+    def test_cpu_limit_failure(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("CPU 1\nTO 30\nT python3 -c 'while True: pass'\n")
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval)], catch_exceptions=False)
+        assert result.exit_code == 2
+        assert "Exceeded the CPU time limit of 1 seconds. FAIL" in result.output
+        assert "Took more than" not in result.output
+
+    def test_memory_limit_stops_allocation(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("MEM 200\nT python3 -c 'x = bytearray(500 * 1024 * 1024); print(1)'\nO 1\n")
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval)], catch_exceptions=False)
+        assert result.exit_code == 2
+        assert "Exceeded the memory limit of 200 MiB. FAIL" in result.output
+        assert "MemoryError" in result.output
+
+    def test_limit_within_budget_passes(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("MEM 200\nCPU 5\nT echo hi\nO hi\n")
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval)], catch_exceptions=False)
+        assert result.exit_code == 0
+
+    def test_tcmd_cpu_limit(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("CPU 1\nTCMD python3 -c 'while True: pass'\n")
+        runner = CliRunner()
+        result = runner.invoke(run_evaluation, [str(codeval)])
+        assert result.exit_code == 1
+        assert "Exceeded the CPU time limit of 1 seconds. FAIL" in result.output
+
+
+class TestRunEvaluationResultsFile:
+    def _run(self, tmp_path, spec):
+        import json
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text(spec)
+        results_file = tmp_path / "results.json"
+        result = CliRunner().invoke(run_evaluation, [str(codeval), "--results-file", str(results_file)])
+        return result, json.loads(results_file.read_text())
+
+    def test_all_passed(self, tmp_path):
+        result, results = self._run(tmp_path, "T echo hi\nO hi\nTCMD true\n")
+        assert result.exit_code == 0
+        assert results["status"] == "passed"
+        assert (results["test_case_total"], results["passed"], results["failed"]) == (2, 2, 0)
+        first, second = results["tests"]
+        assert (first["test_case"], first["tag"], first["status"]) == (1, "T", "passed")
+        assert first["wall_time"] > 0
+        assert (second["tag"], second["status"]) == ("TCMD", "passed")
+
+    def test_failure_details(self, tmp_path):
+        result, results = self._run(tmp_path, "T echo hi\nO hi\nT echo wrong\nO right\nX 3\nHINT look\n"
+                                              "T echo never\n")
+        assert result.exit_code == 2
+        assert results["status"] == "failed"
+        assert (results["passed"], results["failed"]) == (1, 1)
+        failed = results["tests"][1]
+        assert failed["status"] == "failed"
+        assert failed["hint"] == "look"
+        assert failed["failures"] == ["    Exit Code failure: expected 3 got 0"]
+        assert "-wrong$" in failed["diff"]
+        assert "+right$" in failed["diff"]
+
+    def test_hidden_flag(self, tmp_path):
+        _, results = self._run(tmp_path, "HT echo hi\nO hi\n")
+        assert results["tests"][0]["hidden"] is True
+        assert results["tests"][0]["tag"] == "HT"
+
+    def test_diff_truncated_at_olen(self, tmp_path):
+        _, results = self._run(tmp_path, "OLEN 200\nT seq 1000\nO 1\n")
+        assert 0 < len(results["tests"][0]["diff"]) <= 300
+
+    def test_compile_failure_is_not_passed(self, tmp_path):
+        result, results = self._run(tmp_path, "C false\nT echo hi\nO hi\n")
+        assert result.exit_code != 0
+        assert results["status"] == "failed"
+        assert results["tests"] == []
+
+
+class TestRunEvaluationKeepGoing:
+    def test_default_stops_at_first_failure(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("T echo one\nO two\nT echo three\nO three\n")
+        result = CliRunner().invoke(run_evaluation, [str(codeval)])
+        assert result.exit_code == 2
+        assert "Test case 2 of 2" not in result.output
+        assert "test cases," not in result.output
+
+    def test_keep_going_runs_all_tests(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("T echo one\nO two\nT echo three\nO three\nT exit 1\nX 0\nTCMD false\nTCMD true\n")
+        result = CliRunner().invoke(run_evaluation, [str(codeval), "--keep-going"])
+        assert result.exit_code == 2
+        assert result.output.count("FAILED") == 3
+        assert "Test case 2 of 5" in result.output
+        assert "Passed 2 of 5 test cases, 3 failed" in result.output
+
+    def test_keep_going_all_passed(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("T echo one\nO one\n")
+        result = CliRunner().invoke(run_evaluation, [str(codeval), "-k"])
+        assert result.exit_code == 0
+        assert "Passed 1 of 1 test cases, 0 failed" in result.output
+
+    def test_failure_logs_do_not_leak_into_next_test(self, tmp_path):
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("T echo wrong\nO right\nT exit 3\nX 0\n")
+        result = CliRunner().invoke(run_evaluation, [str(codeval), "--keep-going"])
+        second = result.output[result.output.index("Test case 2 of 2"):]
+        assert "wrong" not in second
+        assert "Exit Code failure: expected 0 got 3" in second
+
+    def test_keep_going_compile_and_server_after_failure(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("T echo hi\nO bye\nC echo compiled\nSS 0.2 60 sleep 60\nT echo ok\nO ok\n")
+        result = CliRunner().invoke(run_evaluation, [str(codeval), "--keep-going"])
+        assert result.exit_code == 2, result.output
+        assert "Error on line" not in result.output
+        assert "Test case 2 of 2" in result.output
+        assert "Passed 1 of 2 test cases, 1 failed" in result.output
+
+    def test_keep_going_parallel(self, tmp_path):
+        import json
+        codeval = tmp_path / "t.codeval"
+        codeval.write_text("".join(f"T echo {i}\nO {i if i % 2 else 'x'}\n" for i in range(6)))
+        results_file = tmp_path / "results.json"
+        result = CliRunner().invoke(run_evaluation, [str(codeval), "--keep-going", "--jobs", "3",
+                                                     "--results-file", str(results_file)])
+        assert result.exit_code == 2
+        assert "Passed 3 of 6 test cases, 3 failed" in result.output
+        results = json.loads(results_file.read_text())
+        assert [t["status"] for t in results["tests"]] == ["failed", "passed"] * 3
@@ -0,0 +1,181 @@
+"""Unit tests for shards.py (run-evaluation --shard and merge-shards)."""
+import json
+import re
+
+import pytest
+from click.testing import CliRunner
+
+import assignment_codeval.evaluate as ev_mod
+from assignment_codeval.evaluate import run_evaluation
+from assignment_codeval.shards import merge_shard_outputs, merge_shards, parse_shard, shard_of
+
+SPEC = """\
+C echo compiled > built
+PRINT before the tests
+T cat built
+O compiled
+T echo two
+O two
+PRINT after test 2
+CF main prog.c
+TCMD true
+HT echo four
+O four
+TO 5
+T echo five
+O five
+PRINT after test 5
+T echo six
+O six
+"""
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "prog.c").write_text("int main() { return 0; }\n")
+    for name, value in (("shard", None), ("failed_test_case", None), ("test_case_count", 0),
+                        ("timeout_val", 10), ("output_length_limit", 4096), ("stray_processes", 0),
+                        ("last_compile_command", "")):
+        monkeypatch.setattr(ev_mod, name, value)
+    return tmp_path
+
+
+def _run(tmp_path, spec, *args):
+    (tmp_path / "codeval.txt").write_text(spec)
+    ev_mod.test_case_count = 0
+    ev_mod.stray_processes = 0
+    result = CliRunner().invoke(run_evaluation, ["codeval.txt", *args])
+    return result.output, result.exit_code
+
+
+def _without_time(output):
+    """Drop the run time and the file times in diffs, which differ between runs."""
+    output = re.sub(r"took [0-9.e+-]+ seconds\n", "", output)
+    return re.sub(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.\d+ [+-]\d{4}", "TIME", output)
+
+
+def _sharded(tmp_path, spec, count, *args):
+    outputs = [_run(tmp_path, spec, "--shard", f"{index}/{count}", *args)[0] for index in range(1, count + 1)]
+    merged, exit_code, _ = merge_shard_outputs(outputs)
+    return outputs, merged, exit_code
+
+
+class TestParseShard:
+    def test_valid(self):
+        assert parse_shard("2/3") == (2, 3)
+        assert parse_shard(" 1 / 1 ") == (1, 1)
+
+    @pytest.mark.parametrize("text", ["0/3", "4/3", "1", "a/b", "1/0"])
+    def test_invalid(self, text):
+        with pytest.raises(ValueError):
+            parse_shard(text)
+
+    def test_round_robin(self):
+        assert [shard_of(number, 3) for number in range(0, 8)] == [1, 1, 2, 3, 1, 2, 3, 1]
+
+    def test_cli_rejects_bad_shard(self, tmp_path):
+        (tmp_path / "codeval.txt").write_text(SPEC)
+        result = CliRunner().invoke(run_evaluation, ["codeval.txt", "--shard", "3/2"])
+        assert result.exit_code == 2
+        assert "--shard" in result.output
+
+
+class TestShardedRun:
+    def test_shard_runs_its_test_cases(self, workdir):
+        output, exit_code = _run(workdir, SPEC, "--shard", "2/3")
+        assert exit_code == 0
+        assert re.findall(r"^Test case (?:count )?(\d+) of 6$", output, re.M) == ["2", "5"]
+        assert "before the tests" not in output
+        assert "after test 2" in output
+        assert "after test 5" in output
+        assert "Used main PASSED" in output
+        assert "### codeval shard 2/3 stopped at test case 6 of 6 with exit code 0\n" in output
+
+    def test_every_shard_compiles(self, workdir):
+        output, exit_code = _run(workdir, SPEC, "--shard", "1/3")
+        assert exit_code == 0
+        assert "Test case 1 of 6" in output
+
+    @pytest.mark.parametrize("count", [1, 2, 3, 4, 7])
+    def test_merge_matches_unsharded(self, workdir, count):
+        expected, expected_code = _run(workdir, SPEC)
+        _, merged, exit_code = _sharded(workdir, SPEC, count)
+        assert _without_time(merged) == _without_time(expected)
+        assert exit_code == expected_code == 0
+
+    def test_merge_stops_at_first_failure(self, workdir):
+        spec = SPEC.replace("O five", "O wrong")
+        expected, expected_code = _run(workdir, spec)
+        outputs, merged, exit_code = _sharded(workdir, spec, 2)
+        assert "Test case 6 of 6" in outputs[1]
+        assert _without_time(merged) == _without_time(expected)
+        assert exit_code == expected_code == 2
+
+    def test_merge_with_failed_tcmd(self, workdir):
+        spec = SPEC.replace("TCMD true", "TCMD false")
+        expected, expected_code = _run(workdir, spec)
+        _, merged, exit_code = _sharded(workdir, spec, 3)
+        assert _without_time(merged) == _without_time(expected)
+        assert exit_code == expected_code == 1
+
+    def test_tcmd_setup_runs_in_every_shard(self, workdir):
+        spec = ("C rm -f seeded\nT echo one\nO one\nTCMD echo seeded > seeded\n"
+                "T cat seeded\nO seeded\nT cat seeded\nO seeded\nT cat seeded\nO seeded\n")
+        expected, expected_code = _run(workdir, spec)
+        outputs, merged, exit_code = _sharded(workdir, spec, 3)
+        assert all("FAILED" not in output for output in outputs)
+        assert [output.count("Test case count 2 of 5") for output in outputs] == [0, 1, 0]
+        assert _without_time(merged) == _without_time(expected)
+        assert exit_code == expected_code == 0
+
+    def test_merge_with_failed_compile(self, workdir):
+        spec = SPEC.replace("T echo five", "C echo broken && false\nT echo five")
+        expected, expected_code = _run(workdir, spec)
+        _, merged, exit_code = _sharded(workdir, spec, 3)
+        assert "broken" in merged
+        assert _without_time(merged) == _without_time(expected)
+        assert exit_code == expected_code == 1
+
+    def test_merge_keep_going(self, workdir):
+        spec = SPEC.replace("O two", "O wrong").replace("O six", "O wrong")
+        expected, expected_code = _run(workdir, spec, "--keep-going")
+        _, merged, exit_code = _sharded(workdir, spec, 2, "--keep-going")
+        assert "Passed 4 of 6 test cases, 2 failed" in merged
+        assert _without_time(merged) == _without_time(expected)
+        assert exit_code == expected_code == 2
+
+    def test_parallel_shards(self, workdir):
+        expected, _ = _run(workdir, SPEC)
+        _, merged, _ = _sharded(workdir, SPEC, 2, "--jobs", "3")
+        assert _without_time(merged) == _without_time(expected)
+
+
+class TestMergeShardsCommand:
+    def test_merge_outputs_and_results(self, workdir):
+        spec = SPEC.replace("O six", "O wrong")
+        for index in (1, 2):
+            output, _ = _run(workdir, spec, "--shard", f"{index}/2", "--results-file", f"results{index}.json")
+            (workdir / f"out{index}.txt").write_text(output)
+        result = CliRunner().invoke(merge_shards, ["out2.txt", "out1.txt", "--results", "results1.json",
+                                                   "--results", "results2.json", "--results-file", "merged.json"])
+        assert result.exit_code == 2
+        assert re.findall(r"^Test case (?:count )?(\d+) of 6$", result.output, re.M) == \
+            ["1", "2", "3", "4", "5", "6"]
+        merged = json.loads((workdir / "merged.json").read_text())
+        assert [test["test_case"] for test in merged["tests"]] == [1, 2, 3, 4, 5, 6]
+        assert (merged["status"], merged["passed"], merged["failed"]) == ("failed", 5, 1)
+
+    def test_missing_shard(self, workdir):
+        output, _ = _run(workdir, SPEC, "--shard", "1/2")
+        (workdir / "out1.txt").write_text(output)
+        result = CliRunner().invoke(merge_shards, ["out1.txt"])
+        assert result.exit_code == 1
+        assert "each of the 2 shards" in result.output
+
+    def test_unsharded_output(self, workdir):
+        output, _ = _run(workdir, SPEC)
+        (workdir / "out.txt").write_text(output)
+        result = CliRunner().invoke(merge_shards, ["out.txt"])
+        assert result.exit_code == 1
+        assert "without a shard marker" in result.output
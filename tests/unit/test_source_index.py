@@ -0,0 +1,175 @@
+"""Unit tests for source_index.py (token index and Python calls behind CO, CC and CF)."""
+import ast
+import os
+
+import pytest
+
+import assignment_codeval.evaluate as ev_mod
+from assignment_codeval.source_index import MODULE_SCOPE, SourceIndex, tokenize
+
+CPP_SOURCE = """\
+#include <iostream>
+#include <vector>
+// printf("commented out"); cerr << x;
+/* std::map<int, int> m;
+   fopen("x", "r"); */
+int main() {
+    std::vector<int> values{1'000, 2};
+    std::string name = "list<int> puts(";
+    char quote = '"';
+    std::cout << name << std::endl;
+    std::cin >> name;
+    strlen /* spacing */ (name.c_str());
+    return R"raw(sprintf(")raw"[0];
+}
+"""
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / "prog.cpp"
+    path.write_text(CPP_SOURCE)
+    return str(path)
+
+
+class TestTokenize:
+    def test_comments_dropped_and_literals_kept_whole(self):
+        tokens = tokenize('a /* b */ "c // d" // e\nf')
+        assert [text for _, text, _ in tokens] == ["a", '"c // d"', "f"]
+        assert tokens[0][2] is True
+        assert tokens[1][2] is False
+
+    def test_operators(self):
+        tokens = tokenize("cout<<x>>=y->z::w")
+        assert [text for _, text, _ in tokens] == ["cout", "<<", "x", ">>=", "y", "->", "z", "::", "w"]
+
+    def test_hash_comments(self):
+        tokens = tokenize("x = 1  # print(x)\ns = '''\nprint(y)\n'''\n", hash_comments=True)
+        assert "print" not in [text for _, text, _ in tokens]
+
+
+class TestSourceIndex:
+    def test_calls(self, source):
+        index = SourceIndex()
+        assert index.calls([source], "strlen")
+        assert index.calls([source], "c_str")
+        for name in ("printf", "fopen", "puts", "sprintf", "main2"):
+            assert not index.calls([source], name), name
+
+    def test_streams(self, source):
+        index = SourceIndex()
+        assert index.streams([source], "cout")
+        assert index.streams([source], "std::cout")
+        assert index.streams([source], "cin")
+        assert not index.streams([source], "cerr")
+        assert not index.streams([source], "endl")
+
+    def test_declares_with(self, source):
+        index = SourceIndex()
+        assert index.declares_with([source], "vector")
+        assert index.declares_with([source], "std::vector")
+        assert index.declares_with([source], "string")
+        assert not index.declares_with([source], "map")
+        assert not index.declares_with([source], "list")
+
+    def test_globs(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "a.c").write_text("int main() { return 0; }\n")
+        (tmp_path / "b.c").write_text("void f() { qsort(0, 0, 0, 0); }\n")
+        assert SourceIndex().calls(["*.c"], "qsort")
+
+    def test_missing_file(self, tmp_path):
+        assert not SourceIndex().calls([str(tmp_path / "missing.c")], "main")
+
+    def test_changed_file_reindexed(self, tmp_path):
+        path = tmp_path / "a.c"
+        path.write_text("int main() { puts(\"hi\"); }\n")
+        index = SourceIndex()
+        assert index.calls([str(path)], "puts")
+        path.write_text("int main() { printf(\"hi\"); }\n")
+        os.utime(path, ns=(1, 1))
+        assert not index.calls([str(path)], "puts")
+        assert index.calls([str(path)], "printf")
+
+
+PY_SOURCE = """\
+import math
+
+
+class Stack:
+    def push(self, item):
+        self.items.append(item)
+
+    def root(self):
+        def inner():
+            return math.sqrt(len(self.items))
+        return inner()
+
+
+def main():
+    s = Stack()
+    s.push(sorted([3, 1]))
+    print("open(")
+
+
+main()
+"""
+
+
+class TestPythonCalls:
+    @pytest.fixture
+    def py_source(self, tmp_path):
+        path = tmp_path / "prog.py"
+        path.write_text(PY_SOURCE)
+        return str(path)
+
+    def test_calls(self, py_source):
+        calls = SourceIndex().python_calls(py_source).calls
+        assert {"append", "sqrt", "len", "inner", "Stack", "push", "sorted", "print", "main"} <= calls
+        assert "open" not in calls
+        assert "math" not in calls
+
+    def test_call_graph(self, py_source):
+        analysis = SourceIndex().python_calls(py_source)
+        assert analysis.call_graph["Stack.push"] == {"append"}
+        assert analysis.call_graph["Stack.root"] == {"inner"}
+        assert analysis.call_graph["Stack.root.inner"] == {"sqrt", "len"}
+        assert analysis.call_graph[MODULE_SCOPE] == {"main"}
+        assert analysis.calls_from("main", "push")
+        assert not analysis.calls_from("main", "append")
+
+    def test_parsed_once(self, py_source, monkeypatch):
+        index = SourceIndex()
+        index.python_calls_any([py_source], "print")
+        monkeypatch.setattr(ast, "parse", lambda *args, **kwargs: pytest.fail("parsed again"))
+        assert index.python_calls_any([py_source], "sorted")
+        assert not index.python_calls_any([py_source], "open")
+
+    def test_syntax_error(self, tmp_path):
+        path = tmp_path / "bad.py"
+        path.write_text("def foo(:::\n")
+        assert SourceIndex().python_calls(str(path)).calls == set()
+
+
+class TestTags:
+    @pytest.fixture(autouse=True)
+    def _chdir(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "prog.cpp").write_text(CPP_SOURCE)
+        # CO, CC and CF run the test case before them
+        monkeypatch.setattr(ev_mod, "check_test", lambda: None)
+
+    def test_check_object(self, capsys):
+        ev_mod.check_object("cout prog.cpp")
+        ev_mod.check_object("cerr prog.cpp")
+        assert capsys.readouterr().out == "Used cout PASSED\nNot using cerr FAILED\n"
+
+    def test_check_container(self, capsys):
+        ev_mod.check_container("vector prog.cpp")
+        ev_mod.check_container("map prog.cpp")
+        assert capsys.readouterr().out == "Used vector PASSED\nNot using map FAILED\n"
+
+    def test_check_function_source_fallback(self, capsys):
+        ev_mod.check_function("strlen prog.cpp")
+        ev_mod.check_function("printf prog.cpp")
+        assert capsys.readouterr().out == "Used strlen PASSED\nNot using printf FAILED\n"
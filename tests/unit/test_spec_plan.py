@@ -0,0 +1,210 @@
+"""Unit tests for spec_plan.py (compiled, cached codeval specs)."""
+import os
+import textwrap
+
+from click.testing import CliRunner
+
+import assignment_codeval.evaluate as ev_mod
+from assignment_codeval.evaluate import run_evaluation, tag_func_map
+from assignment_codeval.spec_plan import (
+    SpecPlan,
+    compile_spec,
+    load_spec_plan,
+    plan_path_for,
+    spec_hash,
+)
+
+
+def _compile(text):
+    return compile_spec(textwrap.dedent(text).splitlines(keepends=True), tag_func_map.keys())
+
+
+class TestCompileSpec:
+    def test_counts_test_cases(self):
+        plan = _compile("""\
+            C gcc -o prog prog.c
+            T ./prog
+            O one
+            HT ./prog
+            TCMD true
+        """)
+        assert plan.test_case_total == 3
+        assert [t.tag for t in plan.tests] == ["T", "HT", "TCMD"]
+        assert [t.number for t in plan.tests] == [1, 2, 3]
+
+    def test_assignment_block_skipped(self):
+        plan = _compile("""\
+            ASSIGNMENT START Homework
+            T ignored
+            ASSIGNMENT END
+            T ./prog
+        """)
+        assert plan.test_case_total == 1
+        assert [step.tag for step in plan.steps] == ["T"]
+
+    def test_test_data_collected(self):
+        plan = _compile("""\
+            TO 3
+            T ./prog
+            I hello
+            IB bare
+            IF input.txt
+            O out
+            E err
+            X 2
+            HINT look closer
+            CMP a.txt b.txt
+        """)
+        test = plan.tests[0]
+        assert test.input == [["text", "hello\n"], ["text", "bare"], ["file", "input.txt"]]
+        assert test.expected_output == [["text", "out\n"]]
+        assert test.expected_error == [["text", "err\n"]]
+        assert test.expected_exit_code == 2
+        assert test.hint == "look closer"
+        assert test.cmps == [["a.txt", "b.txt"]]
+        assert test.timeout == 3
+
+    def test_data_after_barrier_belongs_to_next_test(self):
+        plan = _compile("""\
+            T ./first
+            O first
+            CMD echo between
+            I for second
+            T ./second
+            O second
+        """)
+        first, second = plan.tests
+        assert first.input == []
+        assert second.input == [["text", "for second\n"]]
+
+    def test_hint_before_test_is_cleared(self):
+        plan = _compile("""\
+            HINT dropped
+            T ./prog
+        """)
+        assert plan.tests[0].hint == ""
+
+    def test_temp_files_claimed_by_next_test(self):
+        plan = _compile("""\
+            TEMP out.txt
+            T ./first
+            T ./second
+        """)
+        assert plan.tests[0].temp_files == ["out.txt"]
+        assert plan.tests[1].temp_files == []
+
+    def test_of_makes_output_length_dynamic(self):
+        plan = _compile("""\
+            T ./prog
+            OF expected.txt
+            T ./prog
+            OLEN 100
+        """)
+        assert plan.tests[0].output_length_limit is None
+        assert plan.tests[1].output_length_limit == 100
+
+    def test_resource_limits_persist(self):
+        plan = _compile("""\
+            MEM 256
+            CPU 2.5
+            NPROC 10
+            T ./first
+            TCMD ./second
+            MEM 0
+            T ./third
+        """)
+        limits = [(t.memory_limit_mb, t.cpu_limit_sec, t.process_limit) for t in plan.tests]
+        assert limits == [(256, 2.5, 10), (256, 2.5, 10), (None, 2.5, 10)]
+
+    def test_unknown_tag_becomes_error_step(self):
+        plan = _compile("""\
+            T ./prog
+            ZZZ nope
+            T ./never
+        """)
+        assert [step.kind for step in plan.steps] == ["tag", "error"]
+        assert plan.steps[1].messages[0] == "Error on line 2: Unknown tag 'ZZZ'"
+        # the total still covers the whole spec, like the old counting pass
+        assert plan.test_case_total == 2
+
+    def test_missing_arguments_error(self):
+        plan = _compile("T\n")
+        assert plan.steps[0].kind == "error"
+        assert plan.steps[0].messages == [
+            "Error on line 1: Tag 'T' requires arguments",
+            "  1: T",
+        ]
+
+    def test_bare_shell_command_warning(self):
+        plan = _compile("echo hello\n")
+        assert plan.steps[0].kind == "warning"
+        assert plan.steps[0].messages[-1] == "  Did you mean: CMD echo hello"
+
+    def test_ignored_tags_skipped(self):
+        plan = _compile("CD dir\nCTO 30\nZ support.zip\nRUN thing\n")
+        assert plan.steps == []
+
+    def test_json_round_trip(self):
+        plan = _compile("T ./prog\nI in\nO out\necho hi\n")
+        assert SpecPlan.from_json(plan.to_json()) == plan
+
+
+class TestLoadSpecPlan:
+    def test_writes_cache_next_to_spec(self, tmp_path):
+        spec = tmp_path / "hw.codeval"
+        spec.write_text("T ./prog\nO out\n")
+        plan = load_spec_plan(str(spec), tag_func_map.keys())
+        cache = tmp_path / ".hw.codeval.plan.json"
+        assert plan_path_for(str(spec)) == str(cache)
+        assert cache.exists()
+        assert plan.spec_hash == spec_hash(spec.read_text())
+
+    def test_uses_cache_when_hash_matches(self, tmp_path, monkeypatch):
+        spec = tmp_path / "hw.codeval"
+        spec.write_text("T ./prog\nO out\n")
+        load_spec_plan(str(spec), tag_func_map.keys())
+
+        def fail(*args, **kwargs):
+            raise AssertionError("spec should not be recompiled")
+
+        monkeypatch.setattr("assignment_codeval.spec_plan.compile_spec", fail)
+        plan = load_spec_plan(str(spec), tag_func_map.keys())
+        assert plan.test_case_total == 1
+
+    def test_recompiles_when_spec_changes(self, tmp_path):
+        spec = tmp_path / "hw.codeval"
+        spec.write_text("T ./prog\n")
+        load_spec_plan(str(spec), tag_func_map.keys())
+        spec.write_text("T ./prog\nT ./prog\n")
+        plan = load_spec_plan(str(spec), tag_func_map.keys())
+        assert plan.test_case_total == 2
+
+    def test_corrupt_cache_is_replaced(self, tmp_path):
+        spec = tmp_path / "hw.codeval"
+        spec.write_text("T ./prog\n")
+        (tmp_path / ".hw.codeval.plan.json").write_text("{not json")
+        plan = load_spec_plan(str(spec), tag_func_map.keys())
+        assert plan.test_case_total == 1
+
+    def test_read_only_directory_still_compiles(self, tmp_path):
+        spec = tmp_path / "hw.codeval"
+        spec.write_text("T ./prog\n")
+        os.chmod(tmp_path, 0o555)
+        try:
+            plan = load_spec_plan(str(spec), tag_func_map.keys())
+        finally:
+            os.chmod(tmp_path, 0o755)
+        assert plan.test_case_total == 1
+
+
+class TestRunEvaluationWithPlan:
+    def test_run_evaluation_reports_total_from_plan(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        ev_mod.test_case_total = 0
+        ev_mod.test_case_count = 0
+        spec = tmp_path / "t.codeval"
+        spec.write_text("T echo a\nO a\nT echo b\nO b\n")
+        result = CliRunner().invoke(run_evaluation, [str(spec)], catch_exceptions=False)
+        assert result.exit_code == 0
+        assert "Test case 2 of 2" in result.output
+        assert (tmp_path / ".t.codeval.plan.json").exists()
@@ -1,13 +1,16 @@
 """Unit tests for pure helper functions in submissions.py."""
+import json
 import os
 import zipfile
 import pytest
 
 from assignment_codeval.submissions import (
+    _load_codeval_spec,
     _parse_codeval_test_info,
     _read_of_file_content,
     _extract_codeval_title,
     find_codeval_file,
+    write_html_file,
 )
 
 
@@ -113,6 +116,43 @@ class TestReadOfFileContent:
         result = _read_of_file_content("expected.txt", str(codeval))
         assert result == "from file\n"
 
+    def test_read_once_per_spec(self, tmp_path):
+        codeval = tmp_path / "hw.codeval"
+        codeval.write_text("T cmd\nOF expected.txt\n")
+        (tmp_path / "expected.txt").write_text("first\n")
+        assert _read_of_file_content("expected.txt", str(codeval)) == "first\n"
+        (tmp_path / "expected.txt").write_text("second\n")
+        assert _read_of_file_content("expected.txt", str(codeval)) == "first\n"
+
+
+# ---------------------------------------------------------------------------
+# _load_codeval_spec
+# ---------------------------------------------------------------------------
+
+class TestLoadCodevalSpec:
+    def test_fields(self, tmp_path):
+        codeval = tmp_path / "hw.codeval"
+        codeval.write_text("CTO 45\nCD GITHUB_DIRECTORY\nCD src\nZ support.zip\nT ./a\nIF in.txt\nOF out.txt\n")
+        spec = _load_codeval_spec(str(codeval))
+        assert spec.compile_timeout == 45
+        assert spec.cd_dirs == ["GITHUB_DIRECTORY", "src"]
+        assert spec.zip_files == ["support.zip"]
+        assert spec.ref_files == ["in.txt", "out.txt"]
+        assert spec.test_info == {1: {"hidden": False, "of_file": "out.txt", "tag": "T"}}
+
+    def test_bad_compile_timeout_uses_default(self, tmp_path):
+        codeval = tmp_path / "hw.codeval"
+        codeval.write_text("CTO soon\n")
+        assert _load_codeval_spec(str(codeval)).compile_timeout == 20
+
+    def test_reused_until_changed(self, tmp_path):
+        codeval = tmp_path / "hw.codeval"
+        codeval.write_text("T ./a\n")
+        spec = _load_codeval_spec(str(codeval))
+        assert _load_codeval_spec(str(codeval)) is spec
+        codeval.write_text("T ./a\nHT ./b\n")
+        assert _parse_codeval_test_info(str(codeval))[2]["hidden"] is True
+
 
 # ---------------------------------------------------------------------------
 # _extract_codeval_title
@@ -175,3 +215,47 @@ class TestFindCodevalFile:
         f.write_text("T cmd\n")
         result = find_codeval_file(str(tmp_path), "my hw")
         assert result == str(f)
+
+
+# ---------------------------------------------------------------------------
+# write_html_file
+# ---------------------------------------------------------------------------
+
+class TestWriteHtmlFile:
+    def _make_dir(self, tmp_path, comments):
+        (tmp_path / "hw.codeval").write_text("T ./a\nOF one.txt\nT ./b\nOF two.txt\n")
+        (tmp_path / "one.txt").write_text("first\n")
+        (tmp_path / "two.txt").write_text("second\n")
+        student = tmp_path / "student"
+        student.mkdir()
+        (student / "metadata.txt").write_text("assignment=HW\nname=Alice\nattempt=1\ndate=\n")
+        (student / "comments.txt").write_text(comments)
+        (student / "codeval_path.txt").write_text(str(tmp_path / "hw.codeval"))
+        return student
+
+    def test_counts_from_comments(self, tmp_path):
+        student = self._make_dir(tmp_path, "Test case 1 of 2\nPassed\nTest case 2 of 2\nFAILED\n")
+        write_html_file(str(student))
+        html = (student / "results.html").read_text()
+        assert "1 Tests Passed" in html
+        assert "1 Tests Failed" in html
+        assert 'href="#expected-2"' in html
+
+    def test_counts_and_links_from_results(self, tmp_path):
+        student = self._make_dir(tmp_path, "Test case 1 of 2\nPassed\nTest case 2 of 2\nFAILED\n")
+        (student / "results.json").write_text(json.dumps({
+            "status": "failed", "test_case_total": 2, "passed": 1, "failed": 1,
+            "tests": [{"test_case": 1, "status": "passed"}, {"test_case": 2, "status": "failed"}],
+        }))
+        write_html_file(str(student))
+        html = (student / "results.html").read_text()
+        assert "1 Tests Passed" in html
+        assert "1 Tests Failed" in html
+        assert 'href="#expected-2"' in html
+        assert 'href="#expected-1"' not in html
+
+    def test_unreadable_results_ignored(self, tmp_path):
+        student = self._make_dir(tmp_path, "Test case 1 of 2\nPassed\n")
+        (student / "results.json").write_text("{truncated")
+        write_html_file(str(student))
+        assert "1 Tests Passed" in (student / "results.html").read_text()
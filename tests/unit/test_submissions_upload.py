@@ -164,6 +164,37 @@ class TestUploadSubmissionComments:
         )
         assert sent_file.exists()
 
+    def test_results_summary_in_comment(self, tmp_path):
+        base = self._make_submission_dir(tmp_path)
+        (tmp_path / "CS101" / "HW1" / "42" / "results.json").write_text(
+            '{"status": "failed", "test_case_total": 3, "passed": 2, "failed": 1, "tests": []}')
+        course = MagicMock()
+        course.id = "1"
+        assignment = MagicMock()
+        assignment.id = "2"
+        submission = MagicMock()
+        submission.submission_comments = []
+
+        with patch("assignment_codeval.submissions.connect_to_canvas",
+                   return_value=(MagicMock(), MagicMock())):
+            with patch("assignment_codeval.submissions.get_course", return_value=course):
+                with patch("assignment_codeval.submissions.get_assignment",
+                           return_value=assignment):
+                    with patch("assignment_codeval.submissions.get_submissions_by_id",
+                               return_value={"42": submission}):
+                        with patch("assignment_codeval.submissions.write_html_file"):
+                            with patch("assignment_codeval.submissions.upload_file_for_comment",
+                                       return_value=99):
+                                with patch("assignment_codeval.submissions._get_canvas_config",
+                                           return_value=("https://canvas.example.com", "tok")):
+                                    with patch("requests.put") as put:
+                                        result = CliRunner().invoke(
+                                            upload_submission_comments, [base]
+                                        )
+        assert result.exit_code == 0
+        text = put.call_args.kwargs["data"]["comment[text_comment]"]
+        assert text.startswith("codeval: passed 2 of 3 test cases\n<pre>")
+
     def test_applies_substitutions_file(self, tmp_path):
         base = self._make_submission_dir(tmp_path)
         subs_file = tmp_path / "CS101" / "HW1" / "42" / "SUBSTITUTIONS.txt"
@@ -0,0 +1,128 @@
+"""Unit tests for support_templates.py (Z archives and OF/IF files shared by submissions)."""
+import os
+import stat
+import zipfile
+
+import pytest
+
+from assignment_codeval.support_templates import SupportTemplates
+
+
+def _zip(path, members):
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, (content, mode) in members.items():
+            info = zipfile.ZipInfo(name)
+            info.external_attr = mode << 16
+            zf.writestr(info, content)
+
+
+@pytest.fixture
+def templates(tmp_path):
+    templates = SupportTemplates(str(tmp_path / "templates"))
+    yield templates
+    templates.close()
+
+
+class TestArchive:
+    def test_extracted_once(self, tmp_path, templates, monkeypatch):
+        _zip(tmp_path / "support.zip", {"lib/helper.sh": ("echo hi\n", 0o755), "data.txt": ("42\n", 0)})
+        template = templates.archive(str(tmp_path / "support.zip"))
+        monkeypatch.setattr(zipfile.ZipFile, "extract", lambda *args: pytest.fail("extracted again"))
+        assert templates.archive(str(tmp_path / "support.zip")) == template
+
+        mode = os.stat(os.path.join(template, "lib/helper.sh")).st_mode
+        assert mode & stat.S_IXUSR
+        assert not mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+    def test_changed_archive_gets_new_template(self, tmp_path, templates):
+        _zip(tmp_path / "support.zip", {"data.txt": ("42\n", 0o644)})
+        first = templates.archive(str(tmp_path / "support.zip"))
+        _zip(tmp_path / "support.zip", {"data.txt": ("43\n", 0o644)})
+        second = templates.archive(str(tmp_path / "support.zip"))
+        assert first != second
+        assert open(os.path.join(second, "data.txt")).read() == "43\n"
+
+    def test_changed_template_made_again(self, tmp_path, templates):
+        _zip(tmp_path / "support.zip", {"data.txt": ("42\n", 0o644)})
+        template = templates.archive(str(tmp_path / "support.zip"))
+        os.chmod(os.path.join(template, "data.txt"), 0o644)
+        with open(os.path.join(template, "data.txt"), "w") as f:
+            f.write("changed\n")
+        remade = templates.archive(str(tmp_path / "support.zip"))
+        assert remade != template
+        assert open(os.path.join(remade, "data.txt")).read() == "42\n"
+        assert templates.archive(str(tmp_path / "support.zip")) == remade
+
+        # a submission still getting the files of the changed template is not cut short
+        templates.materialize(template, str(tmp_path / "submission"))
+        assert (tmp_path / "submission/data.txt").read_text() == "changed\n"
+
+
+class TestMaterialize:
+    def test_files_replaced_not_written(self, tmp_path, templates):
+        _zip(tmp_path / "support.zip", {"sub/data.txt": ("42\n", 0o644), "empty/": ("", 0)})
+        template = templates.archive(str(tmp_path / "support.zip"))
+        dest = tmp_path / "submission"
+        (dest / "sub").mkdir(parents=True)
+        (dest / "sub/data.txt").write_text("student\n")
+        (dest / "sub/data.txt").chmod(0o444)
+        templates.materialize(template, str(dest))
+
+        assert (dest / "sub/data.txt").read_text() == "42\n"
+        assert (dest / "empty").is_dir()
+        assert sum(templates.methods.values()) == 1
+        # the template is unchanged whichever way the file was placed
+        assert open(os.path.join(template, "sub/data.txt")).read() == "42\n"
+
+    def test_copy_when_links_fail(self, tmp_path, templates, monkeypatch):
+        _zip(tmp_path / "support.zip", {"a.txt": ("a\n", 0o644), "b.txt": ("b\n", 0o644)})
+        template = templates.archive(str(tmp_path / "support.zip"))
+        monkeypatch.setattr(os, "link", lambda *args: (_ for _ in ()).throw(OSError("cross-device link")))
+        monkeypatch.setattr("fcntl.ioctl", lambda *args: (_ for _ in ()).throw(OSError("not supported")))
+        templates.materialize(template, str(tmp_path / "submission"))
+        assert templates.methods == {"reflink": 0, "hardlink": 0, "copy": 2}
+        assert (tmp_path / "submission/b.txt").read_text() == "b\n"
+
+
+    def test_copies_keep_archive_mode(self, tmp_path, templates, monkeypatch):
+        _zip(tmp_path / "support.zip", {"data.txt": ("42\n", 0o644), "run.sh": ("true\n", 0o755)})
+        template = templates.archive(str(tmp_path / "support.zip"))
+        monkeypatch.setattr("fcntl.ioctl", lambda *args: (_ for _ in ()).throw(OSError("not supported")))
+        templates.materialize(template, str(tmp_path / "submission"))
+        assert templates.methods["copy"] == 2
+        assert stat.S_IMODE((tmp_path / "submission/data.txt").stat().st_mode) == 0o644
+        assert stat.S_IMODE((tmp_path / "submission/run.sh").stat().st_mode) == 0o755
+        (tmp_path / "submission/data.txt").write_text("rebuilt\n")
+        assert open(os.path.join(template, "data.txt")).read() == "42\n"
+
+    def test_hardlinks_read_only(self, tmp_path, monkeypatch):
+        templates = SupportTemplates(str(tmp_path / "templates"), hardlink=True)
+        _zip(tmp_path / "support.zip", {"data.txt": ("42\n", 0o644)})
+        template = templates.archive(str(tmp_path / "support.zip"))
+        monkeypatch.setattr("fcntl.ioctl", lambda *args: (_ for _ in ()).throw(OSError("not supported")))
+        templates.materialize(template, str(tmp_path / "submission"))
+        assert templates.methods["hardlink"] == 1
+        st = (tmp_path / "submission/data.txt").stat()
+        assert st.st_ino == os.stat(os.path.join(template, "data.txt")).st_ino
+        assert not st.st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+        templates.close()
+
+
+class TestFiles:
+    def test_existing_files_inside_source_dir(self, tmp_path, templates):
+        source = tmp_path / "codeval"
+        (source / "data").mkdir(parents=True)
+        (source / "data/in.txt").write_text("in\n")
+        (tmp_path / "outside.txt").write_text("outside\n")
+        template = templates.files(str(source), ["data/in.txt", "missing.txt", "../outside.txt", "data/in.txt"])
+        dest = tmp_path / "work"
+        templates.materialize(template, str(dest))
+        assert (dest / "data/in.txt").read_text() == "in\n"
+        assert sorted(p.name for p in dest.rglob("*")) == ["data", "in.txt"]
+
+    def test_keyed_by_content(self, tmp_path, templates):
+        (tmp_path / "out.txt").write_text("one\n")
+        first = templates.files(str(tmp_path), ["out.txt"])
+        assert templates.files(str(tmp_path), ["out.txt"]) == first
+        (tmp_path / "out.txt").write_text("two\n")
+        assert templates.files(str(tmp_path), ["out.txt"]) != first
@@ -0,0 +1,147 @@
+"""Unit tests for symbol_index.py (ELF symbol tables and class file names for CF/NCF)."""
+import os
+import shutil
+import struct
+import subprocess
+
+import pytest
+
+from assignment_codeval.evaluate import _function_used_in_java, _objdump_mentions
+from assignment_codeval.symbol_index import SymbolIndex, read_class_names, read_elf_symbols
+
+needs_gpp = pytest.mark.skipif(shutil.which("g++") is None or shutil.which("objdump") is None,
+                               reason="g++ or objdump not available")
+
+CPP_SOURCE = """\
+#include <iostream>
+#include <vector>
+#include <algorithm>
+namespace shapes { struct Circle { double area() const { return 3.14 * r * r; } double r = 1; }; }
+static int helper(int x) { return x * 2; }
+void greet() { std::cout << "Hello World" << std::endl; }
+int main() {
+    std::vector<int> v{3, 1, 2};
+    std::sort(v.begin(), v.end());
+    greet();
+    return helper(shapes::Circle().area());
+}
+"""
+
+
+def _compile(tmp_path, source, name="sample", *flags):
+    src = tmp_path / f"{name}.cpp"
+    src.write_text(source)
+    out = tmp_path / name
+    subprocess.run(["g++", *flags, "-o", str(out), str(src)], check=True, capture_output=True)
+    return str(out)
+
+
+def _class_file(methods, calls, extra_constants=()):
+    """Build a minimal class file `Hello` declaring methods and calling java/io/PrintStream methods."""
+    pool = []
+
+    def add(entry):
+        pool.append(entry)
+        return len(pool)
+
+    def utf8(text):
+        data = text.encode()
+        return add(struct.pack(">BH", 1, len(data)) + data)
+
+    this_class = add(struct.pack(">BH", 7, utf8("Hello")))
+    super_class = add(struct.pack(">BH", 7, utf8("java/lang/Object")))
+    stream = add(struct.pack(">BH", 7, utf8("java/io/PrintStream")))
+    for constant in extra_constants:
+        add(constant)
+        if constant[0] in (5, 6):
+            pool.append(b"")
+    for call in calls:
+        name_and_type = add(struct.pack(">BHH", 12, utf8(call), utf8("(Ljava/lang/String;)V")))
+        add(struct.pack(">BHH", 10, stream, name_and_type))
+    method_infos = [(utf8(method), utf8("()V")) for method in methods]
+    code = utf8("Code")
+
+    data = struct.pack(">IHHH", 0xCAFEBABE, 0, 52, len(pool) + 1) + b"".join(pool)
+    # public class, no interfaces and no fields
+    data += struct.pack(">HHHHH", 0x21, this_class, super_class, 0, 0)
+    data += struct.pack(">H", len(method_infos))
+    for name, descriptor in method_infos:
+        # one Code attribute with a body the reader skips over
+        data += struct.pack(">HHHHHI", 0x1, name, descriptor, 1, code, 3) + b"\xb1\x00\x00"
+    return data + struct.pack(">H", 0)
+
+
+@needs_gpp
+class TestElfSymbols:
+    NAMES = ["greet", "main", "helper", "area", "Circle", "shapes", "sort", "std", "cout", "endl",
+             "vector", "operator", "text", "bss", "UND", "printf", "forbidden_func", "std::sort",
+             "shapes::Circle::area", "operator<<"]
+
+    def test_same_answers_as_objdump(self, tmp_path):
+        artifact = _compile(tmp_path, CPP_SOURCE)
+        index = SymbolIndex()
+        for name in self.NAMES:
+            assert index.elf_uses(artifact, name) == _objdump_mentions(artifact, name), name
+
+    def test_object_file(self, tmp_path):
+        artifact = _compile(tmp_path, CPP_SOURCE, "sample", "-c")
+        index = SymbolIndex()
+        for name in self.NAMES:
+            assert index.elf_uses(artifact, name) == _objdump_mentions(artifact, name), name
+
+    def test_section_symbols_named_after_section(self, tmp_path):
+        symbols = read_elf_symbols(_compile(tmp_path, CPP_SOURCE, "sample", "-c"))
+        assert (".text", ".text") in symbols
+        assert ("_Z5greetv", ".text") in symbols
+
+    def test_stripped_artifact_has_no_symbols(self, tmp_path):
+        artifact = _compile(tmp_path, CPP_SOURCE, "sample", "-s")
+        assert read_elf_symbols(artifact) == []
+        assert SymbolIndex().elf_uses(artifact, "greet") is False
+
+    def test_rebuilt_artifact_reindexed(self, tmp_path):
+        index = SymbolIndex()
+        artifact = _compile(tmp_path, CPP_SOURCE)
+        assert index.elf_uses(artifact, "greet")
+        _compile(tmp_path, CPP_SOURCE.replace("greet", "wave"))
+        assert not index.elf_uses(artifact, "greet")
+        assert index.elf_uses(artifact, "wave")
+
+    def test_not_elf(self, tmp_path):
+        (tmp_path / "script").write_text("#!/bin/sh\necho greet\n")
+        assert read_elf_symbols(str(tmp_path / "script")) is None
+        assert SymbolIndex().elf_uses(str(tmp_path / "script"), "greet") is None
+
+    def test_missing_artifact(self, tmp_path):
+        assert SymbolIndex().elf_uses(str(tmp_path / "missing"), "greet") is None
+
+
+class TestClassNames:
+    def test_declared_and_called_names(self, tmp_path):
+        path = tmp_path / "Hello.class"
+        path.write_bytes(_class_file(["greet", "main"], ["println"]))
+        names = read_class_names(str(path))
+        assert {"greet", "main", "println", "Hello", "PrintStream", "java.io.PrintStream"} <= names
+        assert "print" not in names
+
+    def test_wide_constants_take_two_entries(self, tmp_path):
+        path = tmp_path / "Hello.class"
+        path.write_bytes(_class_file(["greet"], ["println"],
+                                     [struct.pack(">BQ", 5, 42), struct.pack(">Bd", 6, 1.5)]))
+        assert {"greet", "println"} <= read_class_names(str(path))
+
+    def test_not_a_class_file(self, tmp_path):
+        path = tmp_path / "Hello.class"
+        path.write_bytes(b"not a class file at all")
+        assert read_class_names(str(path)) is None
+
+    def test_function_used_in_java(self, tmp_path):
+        (tmp_path / "Hello.java").write_text("class Hello {}\n")
+        (tmp_path / "Hello.class").write_bytes(_class_file(["greet"], ["println"]))
+        files = [str(tmp_path / "Hello.java")]
+        assert _function_used_in_java("println", files) is True
+        assert _function_used_in_java("forbidden", files) is False
+        # part of a name matches, as it did with javap
+        assert _function_used_in_java("print", files) is True
+        os.remove(tmp_path / "Hello.class")
+        assert _function_used_in_java("println", files) is None
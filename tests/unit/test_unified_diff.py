@@ -0,0 +1,100 @@
+"""Unit tests for unified_diff.py (in-process `diff -U1 -a`)."""
+import random
+import re
+import shutil
+import subprocess
+
+import pytest
+
+from assignment_codeval.unified_diff import format_label, unified_diff
+
+needs_diff = pytest.mark.skipif(shutil.which("diff") is None, reason="diff not installed")
+
+
+def _gnu_diff(tmp_path, a, b):
+    """Return the output of the diff command, with the labels unified_diff gets in the tests."""
+    (tmp_path / "a").write_bytes(a)
+    (tmp_path / "b").write_bytes(b)
+    return subprocess.run(
+        ["diff", "-U1", "-a", "--label", "a", "--label", "b", str(tmp_path / "a"), str(tmp_path / "b")],
+        stdout=subprocess.PIPE,
+    ).stdout
+
+
+def _random_text(rng, alphabet, count):
+    text = b"".join(rng.choice(alphabet) + b"\n" for _ in range(count))
+    if text and rng.random() < 0.3:
+        text = text[:-1]
+    return text
+
+
+def _mutate(rng, text):
+    lines = text.split(b"\n")
+    for _ in range(rng.randint(0, 8)):
+        k = rng.randint(0, len(lines))
+        op = rng.random()
+        if op < 0.4:
+            lines.insert(k, rng.choice([b"a", b"b", b"new", b""]))
+        elif lines and op < 0.7:
+            del lines[min(k, len(lines) - 1)]
+        elif lines:
+            lines[min(k, len(lines) - 1)] = rng.choice([b"a", b"zz"])
+    return b"\n".join(lines)
+
+
+class TestUnifiedDiff:
+    def test_identical_is_empty(self):
+        assert unified_diff(b"same\n", b"same\n", "a", "b") == b""
+
+    def test_single_change(self):
+        assert unified_diff(b"1\n2\n3\n4\n5\n", b"1\n2\nx\n4\n5\n", "a", "b") == (
+            b"--- a\n+++ b\n@@ -2,3 +2,3 @@\n 2\n-3\n+x\n 4\n"
+        )
+
+    def test_empty_output(self):
+        assert unified_diff(b"", b"hello\n", "a", "b") == b"--- a\n+++ b\n@@ -0,0 +1 @@\n+hello\n"
+
+    def test_missing_newline(self):
+        assert unified_diff(b"abc", b"abc\n", "a", "b") == (
+            b"--- a\n+++ b\n@@ -1 +1 @@\n-abc\n\\ No newline at end of file\n+abc\n"
+        )
+
+    def test_limit_stops_early(self):
+        a = b"".join(b"%d\n" % i for i in range(10000))
+        out = unified_diff(a, b"nothing alike\n", "a", "b", limit=100)
+        assert 100 <= len(out) < 200
+
+    @needs_diff
+    @pytest.mark.parametrize("a, b", [
+        (b"a\nb\nc\n", b"a\nc\n"),
+        (b"a\na\na\nb\n", b"a\na\nb\n"),
+        (b"x\ny\n", b""),
+        (b"a\n\n\nb\n", b"a\n\nb\n\n"),
+        (b"no newline", b"no newline\nmore"),
+        (b"\x00\x01\tbinary\r\n", b"\x00\x02\tbinary\r\n"),
+        (b"1\n2\n3\n4\n5\n6\n7\n8\n", b"0\n2\n3\n4\n5\n6\n7\n9\n"),
+    ])
+    def test_matches_gnu_diff(self, tmp_path, a, b):
+        assert unified_diff(a, b, "a", "b") == _gnu_diff(tmp_path, a, b)
+
+    @needs_diff
+    def test_matches_gnu_diff_randomized(self, tmp_path):
+        rng = random.Random(4)
+        for _ in range(300):
+            alphabet = rng.choice([[b"a", b"b"], [b"a", b"b", b"c", b""], [b"%d" % i for i in range(20)]])
+            a = _random_text(rng, alphabet, rng.choice([0, 1, 3, 10, 50, 300]))
+            b = _mutate(rng, a) if rng.random() < 0.8 else _random_text(rng, alphabet, rng.randint(0, 50))
+            assert unified_diff(a, b, "a", "b") == _gnu_diff(tmp_path, a, b), (a, b)
+
+    @needs_diff
+    def test_expensive_comparison_uses_diff_command(self, tmp_path):
+        a, b = b"a\nb\nc\nd\n", b"b\na\nd\nc\n"
+        assert unified_diff(a, b, "a", "b", work_limit=0) == _gnu_diff(tmp_path, a, b)
+
+
+class TestFormatLabel:
+    def test_diff_timestamp_format(self):
+        label = format_label("./.testing/youroutput", 1_700_000_000_123_456_789)
+        assert re.fullmatch(
+            r"\./\.testing/youroutput\t\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\.123456789 [+-]\d{4}", label
+        )